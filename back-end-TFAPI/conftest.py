@@ -0,0 +1,4 @@
+"""
+Pytest configuration of the back-end: placing this file in the back-end directory puts it on
+'sys.path', so tests import the 'website' package as 'app.py' does.
+"""
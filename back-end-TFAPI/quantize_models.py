@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+"""
+Produce quantized TensorFlow Lite variants of the served models.
+
+This script loads the float32 'model_bin' and 'model_mul' SavedModels from the 'models'
+directory, converts them with dynamic-range, float16 and full-INT8 quantization (calibrated on
+a representative sample of images), evaluates every variant against the float32 models on a
+held-out set of images and writes the '.tflite' files together with 'quantization_report.json'
+next to the SavedModels.
+A variant can then be served by setting 'INFERENCE_BACKEND' to 'tflite-<variant>'.
+"""
+
+import argparse
+import json
+import os
+
+def main():
+    parser = argparse.ArgumentParser(description='Quantize the binary and multiclass models.')
+    parser.add_argument('calibration_dir', help='directory with representative lesion images')
+    parser.add_argument('evaluation_dir', help='directory with held-out images used to measure agreement, '
+                                               'disjoint from the calibration directory')
+    parser.add_argument('--sample-size', type=int, default=200, help='number of images sampled from every directory')
+    parser.add_argument('--min-agreement', type=float, default=0.99,
+                        help='minimum top-1 agreement with the float32 models required to activate a variant')
+    parser.add_argument('--variants', nargs='+', default=['dynamic', 'float16', 'int8'])
+    args = parser.parse_args()
+
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+    import tensorflow as tf
+    from website.quantization_handling import load_sample_tensors, quantize_models
+
+    models_directory = os.getcwd() + '/models'
+    float_models = {'binary_model': tf.keras.models.load_model(models_directory + '/model_bin'),
+                    'multiclass_model': tf.keras.models.load_model(models_directory + '/model_mul')}
+    calibration_tensors = load_sample_tensors(args.calibration_dir, args.sample_size)
+    evaluation_tensors = load_sample_tensors(args.evaluation_dir, args.sample_size)
+    report = quantize_models(float_models, models_directory, calibration_tensors, evaluation_tensors,
+                             min_agreement=args.min_agreement, variants=tuple(args.variants))
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
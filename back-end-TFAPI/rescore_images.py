@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+"""
+Re-score every stored image with the currently served models.
+
+This script creates the application as 'app.py' does (reading the same 'DATABASE_URL',
+'STORAGE_*' and 'INFERENCE_*' settings), waits for the models to load and runs
+'rescore_images': the stored images are streamed from the database in chunks, their objects are
+downloaded through the configured storage backend, and the new predictions are written back
+tagged with the models version. Progress is written to the checkpoint file after every chunk, so
+an interrupted run continues where it stopped when started again with the same checkpoint. Set
+'STORAGE_BACKEND=filesystem' and 'STORAGE_DIRECTORY' to run against a local copy of the archive.
+"""
+
+import argparse
+import json
+import sys
+import os
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-score the stored images with the current models.')
+    parser.add_argument('--chunk-size', type=int, default=128,
+                        help='images read, scored and committed together (about 1.2 MB of tensors per image, '
+                             '157 MB for the default of 128)')
+    parser.add_argument('--batch-size', type=int, default=32, help='images run through the models in a single pass')
+    parser.add_argument('--fetch-workers', type=int, default=8, help='concurrent downloads from the storage backend')
+    parser.add_argument('--preprocess-workers', type=int, help='decoding workers (defaults to the number of CPUs)')
+    parser.add_argument('--checkpoint', default='rescoring_checkpoint.json', help='file the progress is resumed from')
+    parser.add_argument('--only-stale', action='store_true',
+                        help='skip images already predicted by the current models version')
+    args = parser.parse_args()
+
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+    os.environ['INFERENCE_STARTUP'] = 'blocking'
+    os.environ['INFERENCE_MAX_BATCH_SIZE'] = str(args.batch_size)
+    os.environ['PREDICTION_CACHE_SIZE'] = '0'
+    from website import create_app
+    from website.rescoring_handling import rescore_images
+
+    def print_progress(checkpoint):
+        print(f"last id {checkpoint['last_id']}: {checkpoint['rescored']} re-scored, "
+              f"{checkpoint['failed']} failed", file=sys.stderr, flush=True)
+
+    app = create_app(recover_uploads=False)
+    with app.app_context():
+        report = rescore_images(app, chunk_size=args.chunk_size, fetch_workers=args.fetch_workers,
+                                preprocess_workers=args.preprocess_workers, checkpoint_path=args.checkpoint,
+                                only_stale=args.only_stale, on_chunk=print_progress)
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
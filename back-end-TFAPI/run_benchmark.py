@@ -0,0 +1,704 @@
+#!/usr/bin/env python3
+
+"""
+Run performance benchmarks for the back-end application.
+
+Each benchmark is a subcommand printing its results as JSON to the standard output, so that
+results can be stored and compared between commits. Models are loaded from the 'models'
+directory, the same way 'create_app' loads them.
+"""
+
+import argparse
+import tracemalloc
+import sys
+import json
+import io
+import os
+import threading
+import time
+import numpy as np
+
+CLIENT_COUNTS = [1, 8, 32, 128]
+INPUT_SHAPE = (320, 320, 3)
+
+def load_models():
+    """
+    Load the binary and multiclass models from the 'models' directory.
+
+    Returns:
+        dict: Models keyed by name, as stored in 'app.available_models'.
+    """
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+    import tensorflow as tf
+    return {'binary_model': tf.keras.models.load_model(os.getcwd() + '/models/model_bin'),
+            'multiclass_model': tf.keras.models.load_model(os.getcwd() + '/models/model_mul')}
+
+def run_clients(number_of_clients, requests_per_client, send_request):
+    """
+    Run concurrent clients, each sending a fixed number of requests, and measure throughput.
+
+    Args:
+        number_of_clients (int): Number of concurrent client threads.
+        requests_per_client (int): Number of requests sent by every client.
+        send_request (callable): Function performing a single request.
+
+    Returns:
+        dict: Number of clients, total requests, elapsed time, throughput and latency percentiles.
+    """
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def client():
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            send_request()
+            with latencies_lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(number_of_clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {'clients': number_of_clients,
+            'requests': len(latencies),
+            'elapsed_s': elapsed,
+            'throughput_rps': len(latencies) / elapsed,
+            'p50_ms': float(np.percentile(latencies, 50) * 1000),
+            'p99_ms': float(np.percentile(latencies, 99) * 1000)}
+
+def benchmark_scheduler(args):
+    """
+    Compare per-request 'predict' calls against the micro-batching inference scheduler.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        dict: Throughput results per number of concurrent clients for both paths.
+    """
+    from website.inference_handling import InferenceScheduler, ConcurrentPredictor, PREDICTION_KEYS
+    available_models = load_models()
+    scheduler = InferenceScheduler(ConcurrentPredictor(available_models), max_batch_size=args.max_batch_size,
+                                   max_wait_time=args.max_wait_ms / 1000)
+    image_tensor = np.random.rand(1, *INPUT_SHAPE).astype('float32')
+
+    def unbatched_request():
+        for model_name in PREDICTION_KEYS.values():
+            available_models[model_name].predict(image_tensor, verbose=0)
+
+    def scheduled_request():
+        scheduler.predict(image_tensor)
+
+    results = {'unbatched': [], 'scheduler': []}
+    for number_of_clients in args.clients:
+        results['unbatched'].append(run_clients(number_of_clients, args.requests, unbatched_request))
+        results['scheduler'].append(run_clients(number_of_clients, args.requests, scheduled_request))
+    results['scheduler_metrics'] = scheduler.get_metrics()
+    return results
+
+def measure_latency(function, repetitions):
+    """
+    Call a function repeatedly and collect latency percentiles.
+
+    Args:
+        function (callable): Function to measure.
+        repetitions (int): Number of measured calls.
+
+    Returns:
+        dict: Number of calls and the p50 and p99 latency in milliseconds.
+    """
+    latencies = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    return {'calls': repetitions,
+            'p50_ms': float(np.percentile(latencies, 50) * 1000),
+            'p99_ms': float(np.percentile(latencies, 99) * 1000)}
+
+def benchmark_engine(args):
+    """
+    Compare 'Model.predict' against models traced into concrete tf.function graphs.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        dict: Latency percentiles per model, engine and batch size.
+    """
+    from website.inference_handling import TracedModel, get_batch_buckets
+    available_models = load_models()
+    batch_buckets = get_batch_buckets(max(args.batch_sizes))
+    results = {}
+    for model_name, model in available_models.items():
+        engines = {'keras': model,
+                   'traced': TracedModel(model, batch_buckets),
+                   'traced_xla': TracedModel(model, batch_buckets, jit_compile=True)}
+        results[model_name] = {}
+        for engine_name, engine in engines.items():
+            results[model_name][engine_name] = {}
+            for batch_size in args.batch_sizes:
+                batch = np.random.rand(batch_size, *INPUT_SHAPE).astype('float32')
+                for _ in range(args.warmup):
+                    engine.predict(batch, verbose=0)
+                results[model_name][engine_name][batch_size] = measure_latency(
+                    lambda: engine.predict(batch, verbose=0), args.repetitions)
+    return results
+
+def benchmark_fusion(args):
+    """
+    Check that the fused two-headed model predicts the same as the separate models and compare their latency.
+
+    The fused model is run through 'Model.predict' and through traced graphs, as it is served,
+    and its outputs are compared with the separate Keras models on random images and, if
+    '--images-dir' is given, on a sample of real images.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        dict: Largest absolute difference per output and engine, whether every difference is
+              within '--tolerance' under 'equivalent', and latency percentiles of fused and
+              separate prediction.
+    """
+    from website.inference_handling import (TracedModel, ConcurrentPredictor, FusedPredictor, build_fused_model,
+                                            get_batch_buckets, PREDICTION_KEYS)
+    available_models = load_models()
+    fused_model = build_fused_model(available_models)
+    if fused_model is None:
+        return {'fusable': False}
+    batch = np.random.rand(args.batch_size, *INPUT_SHAPE).astype('float32')
+    if args.images_dir:
+        from website.quantization_handling import load_sample_tensors
+        batch = np.concatenate([batch, load_sample_tensors(args.images_dir, args.batch_size)], axis=0)
+    separate_predictor = ConcurrentPredictor(available_models)
+    fused_predictors = {'keras': FusedPredictor(fused_model),
+                        'traced': FusedPredictor(TracedModel(fused_model, get_batch_buckets(args.batch_size)))}
+    separate_outputs = separate_predictor.predict(batch)
+    results = {'fusable': True, 'images': len(batch), 'tolerance': args.tolerance, 'max_abs_difference': {}}
+    for engine_name, fused_predictor in fused_predictors.items():
+        fused_outputs = fused_predictor.predict(batch)
+        results['max_abs_difference'][engine_name] = {
+            key: float(np.max(np.abs(fused_outputs[key] - separate_outputs[key]))) for key in PREDICTION_KEYS}
+    results['equivalent'] = all(difference <= args.tolerance
+                                for differences in results['max_abs_difference'].values()
+                                for difference in differences.values())
+    latency_batch = batch[:args.batch_size]
+    results['latency'] = {'separate': measure_latency(lambda: separate_predictor.predict(latency_batch),
+                                                      args.repetitions),
+                          'fused_traced': measure_latency(lambda: fused_predictors['traced'].predict(latency_batch),
+                                                          args.repetitions)}
+    return results
+
+def legacy_transform_image_into_tensor(image):
+    """
+    Reproduce the preprocessing used before decoding at reduced scale, for comparison.
+
+    Args:
+        image: An image object in the PIL (Pillow) format.
+
+    Returns:
+        numpy.ndarray: A float32 tensor of the image at its original resolution.
+    """
+    image = image.copy().convert('RGB').copy()
+    image = np.asarray(image, dtype='float32')
+    image = np.expand_dims(image, axis=0)
+    return image.astype('float32')/255
+
+def benchmark_preprocessing(args):
+    """
+    Compare latency and peak memory of the legacy and reduced-scale preprocessing on large JPEGs.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        dict: Latency percentiles and peak traced allocations per resolution and pipeline.
+    """
+    from PIL import Image
+    from website.transform_handling import transform_image_into_tensor, get_thread_buffer
+
+    pipelines = {'legacy': legacy_transform_image_into_tensor,
+                 'reduced_scale': lambda image: transform_image_into_tensor(image, out=get_thread_buffer()),
+                 'reduced_scale_center_crop': lambda image: transform_image_into_tensor(
+                     image, out=get_thread_buffer(), center_crop=True)}
+    results = {}
+    for megapixels in args.megapixels:
+        width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+        height = int(width * 3 / 4)
+        pixels = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        jpeg = io.BytesIO()
+        Image.fromarray(pixels).save(jpeg, format='JPEG', quality=90)
+        jpeg_bytes = jpeg.getvalue()
+
+        def run(pipeline):
+            return pipeline(Image.open(io.BytesIO(jpeg_bytes)))
+
+        results[f'{width}x{height}'] = {}
+        for name, pipeline in pipelines.items():
+            tracemalloc.start()
+            run(pipeline)
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            measurement = measure_latency(lambda: run(pipeline), args.repetitions)
+            measurement['peak_numpy_memory_mb'] = peak_memory / 2**20
+            results[f'{width}x{height}'][name] = measurement
+    return results
+
+def benchmark_encodings(args):
+    """
+    Compare request size, parse time and peak memory of the three /predict image encodings.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        dict: Request size, parse latency percentiles and peak traced allocations per resolution
+              and encoding.
+    """
+    import base64
+    from PIL import Image
+    from werkzeug.test import EnvironBuilder
+    from werkzeug.wrappers import Request
+    from website.transform_handling import (transform_base64_into_image_and_byte_data,
+                                            transform_stream_into_image_and_byte_data)
+
+    results = {}
+    for megapixels in args.megapixels:
+        width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+        height = int(width * 3 / 4)
+        pixels = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        jpeg = io.BytesIO()
+        Image.fromarray(pixels).save(jpeg, format='JPEG', quality=90)
+        jpeg_bytes = jpeg.getvalue()
+        credentials = {'email': 'benchmark@example.com', 'password': 'benchmark'}
+        builders = {
+            'base64_form': lambda: EnvironBuilder(method='POST', data=dict(
+                credentials, base64='data:image/jpeg;base64,' + base64.b64encode(jpeg_bytes).decode())),
+            'multipart_file': lambda: EnvironBuilder(method='POST', data=dict(
+                credentials, image=(io.BytesIO(jpeg_bytes), 'image.jpg', 'image/jpeg'))),
+            'raw_body': lambda: EnvironBuilder(method='POST', data=jpeg_bytes, content_type='image/jpeg')}
+        parsers = {
+            'base64_form': lambda request: transform_base64_into_image_and_byte_data(request.form.get('base64')),
+            'multipart_file': lambda request: transform_stream_into_image_and_byte_data(request.files['image'].stream),
+            'raw_body': lambda request: transform_stream_into_image_and_byte_data(request.stream)}
+
+        results[f'{width}x{height}'] = {}
+        for encoding, build in builders.items():
+            built_environ = build().get_environ()
+            request_body = built_environ['wsgi.input'].read()
+            content_type = built_environ['CONTENT_TYPE']
+
+            def parse():
+                environ = EnvironBuilder(method='POST', input_stream=io.BytesIO(request_body),
+                                         content_type=content_type,
+                                         content_length=len(request_body)).get_environ()
+                return parsers[encoding](Request(environ))
+
+            tracemalloc.start()
+            parse()
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            measurement = measure_latency(parse, args.repetitions)
+            measurement['request_bytes'] = len(request_body)
+            measurement['peak_memory_mb'] = peak_memory / 2**20
+            results[f'{width}x{height}'][encoding] = measurement
+    return results
+
+def benchmark_auth(args):
+    """
+    Compare the per-request authentication overhead of password checks and session tokens.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        dict: Latency percentiles of authenticating one request with each method.
+    """
+    from flask import Flask
+    from werkzeug.security import generate_password_hash
+    from website import db
+    from website.models import User
+    from website.endpoints import attempt_user_login
+    from website.auth_handling import TokenAuthenticator
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        user = User(email = 'benchmark@example.com', first_name = 'Benchmark',
+                    password = generate_password_hash('benchmark'))
+        db.session.add(user)
+        db.session.commit()
+        token_authenticator = TokenAuthenticator('benchmark-secret-key')
+        token = token_authenticator.issue_token(user)
+        return {'password': measure_latency(lambda: attempt_user_login('benchmark@example.com', 'benchmark'),
+                                            args.repetitions),
+                'token': measure_latency(lambda: token_authenticator.verify_token(token), args.repetitions)}
+
+def create_database_app(database_url, tuned):
+    """
+    Create a minimal application with only the database configured.
+
+    Args:
+        database_url (str): SQLAlchemy database URL.
+        tuned (bool): Whether to use the tuned settings or SQLAlchemy's defaults.
+
+    Returns:
+        Flask: The application.
+    """
+    from flask import Flask
+    from website import db
+    from website.database_handling import get_database_settings, tune_sqlite_engine
+
+    app = Flask(__name__)
+    app.config.update(get_database_settings(database_url))
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    if not tuned:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {}
+    db.init_app(app)
+    if tuned:
+        with app.app_context():
+            tune_sqlite_engine(db.engine, app.config['SQLITE_BUSY_TIMEOUT_MS'])
+    return app
+
+def write_database_load(worker_index, database_url, tuned, duration, results):
+    """
+    Insert users and images for a fixed time, like one application worker handling sign-ups and predictions.
+
+    Args:
+        worker_index (int): Index of the worker process, used to keep emails unique.
+        database_url (str): SQLAlchemy database URL.
+        tuned (bool): Whether to use the tuned settings or SQLAlchemy's defaults.
+        duration (float): Time in seconds to write for.
+        results (multiprocessing.Queue): Queue receiving the number of commits and failures.
+    """
+    import sqlalchemy
+    from website import db
+    from website.models import User, Image
+
+    app = create_database_app(database_url, tuned)
+    commits = 0
+    locked_errors = 0
+    with app.app_context():
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            try:
+                user = User(email = f'worker{worker_index}_{commits}@example.com', first_name = 'Load', password = 'x')
+                db.session.add(user)
+                db.session.flush()
+                db.session.add(Image(url = 'file:///load.jpg', prediction = {'binary': [1, 0], 'multiclass': [1]},
+                                     predicted_class = 0, upload_status = 'uploaded', user_id = user.id))
+                db.session.commit()
+                commits += 1
+            except sqlalchemy.exc.OperationalError:
+                db.session.rollback()
+                locked_errors += 1
+    results.put((commits, locked_errors))
+
+def benchmark_database(args):
+    """
+    Measure SQLite write throughput of concurrent worker processes with default and tuned settings.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        dict: Commits per second and "database is locked" failures for every mode.
+    """
+    import multiprocessing
+    import tempfile
+    from website import db
+    from website.migrations import upgrade_database
+
+    results = {}
+    for mode, tuned in (('default', False), ('tuned', True)):
+        with tempfile.TemporaryDirectory() as directory:
+            database_url = f'sqlite:///{directory}/load.db'
+            app = create_database_app(database_url, tuned)
+            with app.app_context():
+                upgrade_database(os.path.join(directory, 'migrations.lock'))
+                db.engine.dispose()
+            queue = multiprocessing.Queue()
+            workers = [multiprocessing.Process(target=write_database_load,
+                                               args=(index, database_url, tuned, args.duration, queue))
+                       for index in range(args.workers)]
+            for worker in workers:
+                worker.start()
+            worker_results = [queue.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+            commits = sum(worker_result[0] for worker_result in worker_results)
+            results[mode] = {'workers': args.workers,
+                             'commits': commits,
+                             'commits_per_second': commits / args.duration,
+                             'locked_errors': sum(worker_result[1] for worker_result in worker_results)}
+    return results
+
+def run_inference_frontend(index, addresses, settings, args, start_event, results):
+    """
+    Act as one web worker sending single-image predictions, either to its own in-process models or
+    to an inference server.
+
+    Args:
+        index (int): Index of the web worker.
+        addresses (list): Socket paths of the inference server, or an empty list to load the models
+                          in-process.
+        settings (dict): Inference settings, as returned by 'get_inference_settings'.
+        args (argparse.Namespace): Parsed command line arguments.
+        start_event (multiprocessing.Event): Set once every web worker and server worker is ready.
+        results (multiprocessing.Queue): Queue receiving the readiness and the results of the worker.
+    """
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+    from website.quantization_handling import get_resident_memory
+    if addresses:
+        from website.inference_server import RemoteInferenceClient
+        scheduler = RemoteInferenceClient(addresses, b'benchmark', max_batch_size=settings['INFERENCE_MAX_BATCH_SIZE'])
+    else:
+        import tensorflow as tf
+        from website.inference_handling import load_inference_scheduler
+        tf.config.threading.set_intra_op_parallelism_threads(settings['INFERENCE_INTRA_OP_THREADS'])
+        tf.config.threading.set_inter_op_parallelism_threads(settings['INFERENCE_INTER_OP_THREADS'])
+        available_models, scheduler = load_inference_scheduler(settings, os.getcwd() + '/models')
+    image_tensor = np.random.rand(1, *INPUT_SHAPE).astype('float32')
+    results.put(('ready', index))
+    start_event.wait()
+    result = run_clients(args.clients, args.requests, lambda: scheduler.predict(image_tensor))
+    result['resident_memory_mb'] = get_resident_memory() / 2**20
+    results.put(('done', result))
+
+def benchmark_inference_server(args):
+    """
+    Compare web workers holding their own models against web workers sharing an inference server.
+
+    Both setups get the same number of CPUs: in-process web workers split them between their
+    TensorFlow thread pools, while in server mode they are split between the inference workers.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        dict: Summed throughput, latency and resident memory of every process for both setups.
+    """
+    import multiprocessing
+    import tempfile
+    from website.startup_handling import get_inference_settings
+    from website.inference_server import get_inference_server_addresses, start_inference_server
+    from website.quantization_handling import get_resident_memory
+
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for mode, server_workers in (('in_process', 0), ('server', args.server_workers)):
+        settings = get_inference_settings()
+        settings['INFERENCE_INTER_OP_THREADS'] = 1
+        settings['INFERENCE_INTRA_OP_THREADS'] = max(1, args.cpus // (server_workers or args.web_workers))
+        with tempfile.TemporaryDirectory() as socket_directory:
+            addresses = get_inference_server_addresses(socket_directory, server_workers)
+            server_processes = start_inference_server(addresses, b'benchmark', settings, os.getcwd() + '/models')
+            while not all(os.path.exists(address) for address in addresses):
+                time.sleep(0.1)
+            start_event = context.Event()
+            queue = context.Queue()
+            web_processes = [context.Process(target=run_inference_frontend,
+                                             args=(index, addresses, settings, args, start_event, queue))
+                             for index in range(args.web_workers)]
+            for process in web_processes:
+                process.start()
+            for _ in web_processes:
+                queue.get()
+            start_event.set()
+            web_results = [queue.get()[1] for _ in web_processes]
+            server_memory = sum(get_resident_memory(process.pid) for process in server_processes) / 2**20
+            for process in web_processes:
+                process.join()
+            for process in server_processes:
+                process.terminate()
+                process.join()
+        web_memory = sum(web_result['resident_memory_mb'] for web_result in web_results)
+        results[mode] = {'cpus': args.cpus,
+                         'web_workers': args.web_workers,
+                         'server_workers': server_workers,
+                         'throughput_rps': sum(web_result['throughput_rps'] for web_result in web_results),
+                         'p50_ms': max(web_result['p50_ms'] for web_result in web_results),
+                         'p99_ms': max(web_result['p99_ms'] for web_result in web_results),
+                         'web_memory_mb': web_memory,
+                         'server_memory_mb': server_memory,
+                         'total_memory_mb': web_memory + server_memory}
+    return results
+
+def measure_startup(startup_mode, directory, results):
+    """
+    Create the application in a fresh interpreter and time every startup phase.
+
+    Args:
+        startup_mode (str): 'blocking' or 'background', used as 'INFERENCE_STARTUP'.
+        directory (str): Temporary directory for the database and stored images.
+        results (multiprocessing.Queue): Queue receiving the measured durations.
+    """
+    os.environ.setdefault('SESKEY', 'benchmark-secret-key')
+    os.environ['INFERENCE_STARTUP'] = startup_mode
+    os.environ['DATABASE_URL'] = f'sqlite:///{directory}/startup.db'
+    os.environ['STORAGE_BACKEND'] = 'filesystem'
+    os.environ['STORAGE_DIRECTORY'] = f'{directory}/storage'
+    start = time.perf_counter()
+    from website import create_app
+    import_website_s = time.perf_counter() - start
+    start = time.perf_counter()
+    app = create_app()
+    create_app_s = time.perf_counter() - start
+    app.model_loader.wait()
+    results.put({'import_website_s': import_website_s,
+                 'create_app_s': create_app_s,
+                 'time_to_ready_s': time.perf_counter() - start,
+                 'model_loader': app.model_loader.get_status()})
+
+def benchmark_startup(args):
+    """
+    Break down the cold start of the application into its import, load and warm-up phases.
+
+    Every repetition runs in a new interpreter, so module imports are not cached between them.
+    'create_app_s' is the time until the application can serve its non-ML endpoints and
+    'time_to_ready_s' the time until '/readyz' succeeds.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        dict: The measured phases of every repetition for both startup modes.
+    """
+    import multiprocessing
+    import tempfile
+
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for startup_mode in ('blocking', 'background'):
+        results[startup_mode] = []
+        for _ in range(args.repetitions):
+            with tempfile.TemporaryDirectory() as directory:
+                queue = context.Queue()
+                process = context.Process(target=measure_startup, args=(startup_mode, directory, queue))
+                process.start()
+                results[startup_mode].append(queue.get())
+                process.join()
+    return results
+
+def benchmark_metrics(args):
+    """
+    Measure the per-request overhead of the Prometheus metrics.
+
+    A minimal application instruments a request the way '/predict' is instrumented: the request
+    hooks, four pipeline stages and one call of an instrumented stand-in model. Requests are sent
+    through Flask's test client with metrics enabled and disabled, so the difference is the cost
+    of the instrumentation alone.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        dict: Request latencies with and without metrics and the difference of their medians.
+    """
+    from flask import Flask, jsonify
+    from website.metrics_handling import PipelineMetrics, InstrumentedModel
+
+    class StandInModel:
+        def predict(self, batch, verbose=0):
+            return batch
+
+    batch = np.zeros((1, 1), dtype='float32')
+    results = {}
+    for mode, enabled in (('disabled', False), ('enabled', True)):
+        app = Flask(__name__)
+        pipeline_metrics = PipelineMetrics(enabled=enabled)
+        pipeline_metrics.init_app(app)
+        model = (InstrumentedModel(StandInModel(), 'stand_in_model', pipeline_metrics) if pipeline_metrics.enabled
+                 else StandInModel())
+
+        @app.route('/predict', methods=['POST'])
+        def predict():
+            for stage in ('decode', 'transform', 'inference', 'database_commit'):
+                with pipeline_metrics.time_stage(stage):
+                    if stage == 'inference':
+                        model.predict(batch, verbose=0)
+            return jsonify({'result': 'success'})
+
+        client = app.test_client()
+        for _ in range(args.warmup):
+            client.post('/predict')
+        results[mode] = measure_latency(lambda: client.post('/predict'), args.repetitions)
+    results['overhead_ms'] = results['enabled']['p50_ms'] - results['disabled']['p50_ms']
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Back-end performance benchmarks.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    scheduler_parser = subparsers.add_parser('scheduler', help='micro-batching scheduler throughput')
+    scheduler_parser.add_argument('--clients', type=int, nargs='+', default=CLIENT_COUNTS)
+    scheduler_parser.add_argument('--requests', type=int, default=8, help='requests per client')
+    scheduler_parser.add_argument('--max-batch-size', type=int, default=32)
+    scheduler_parser.add_argument('--max-wait-ms', type=float, default=5)
+    scheduler_parser.set_defaults(run=benchmark_scheduler)
+
+    engine_parser = subparsers.add_parser('engine', help='Model.predict versus traced graph latency')
+    engine_parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+    engine_parser.add_argument('--repetitions', type=int, default=100)
+    engine_parser.add_argument('--warmup', type=int, default=5)
+    engine_parser.set_defaults(run=benchmark_engine)
+
+    fusion_parser = subparsers.add_parser('fusion', help='fused versus separate model outputs and latency '
+                                                          '(exits with status 1 if the outputs differ)')
+    fusion_parser.add_argument('--batch-size', type=int, default=8)
+    fusion_parser.add_argument('--images-dir', help='directory with lesion images compared besides random ones')
+    fusion_parser.add_argument('--tolerance', type=float, default=1e-5)
+    fusion_parser.add_argument('--repetitions', type=int, default=20)
+    fusion_parser.set_defaults(run=benchmark_fusion)
+
+    preprocessing_parser = subparsers.add_parser('preprocessing', help='image preprocessing latency and memory')
+    preprocessing_parser.add_argument('--megapixels', type=float, nargs='+', default=[0.1, 3, 12, 24])
+    preprocessing_parser.add_argument('--repetitions', type=int, default=20)
+    preprocessing_parser.set_defaults(run=benchmark_preprocessing)
+
+    encodings_parser = subparsers.add_parser('encodings', help='/predict image encodings size, parse time and memory')
+    encodings_parser.add_argument('--megapixels', type=float, nargs='+', default=[0.1, 3, 12])
+    encodings_parser.add_argument('--repetitions', type=int, default=20)
+    encodings_parser.set_defaults(run=benchmark_encodings)
+
+    auth_parser = subparsers.add_parser('auth', help='per-request authentication overhead')
+    auth_parser.add_argument('--repetitions', type=int, default=200)
+    auth_parser.set_defaults(run=benchmark_auth)
+
+    database_parser = subparsers.add_parser('database', help='SQLite write throughput with default and tuned settings')
+    database_parser.add_argument('--workers', type=int, default=8, help='concurrent writer processes')
+    database_parser.add_argument('--duration', type=float, default=10, help='seconds of writing per mode')
+    database_parser.set_defaults(run=benchmark_database)
+
+    server_parser = subparsers.add_parser('inference-server',
+                                          help='memory and throughput of in-process models versus an inference server')
+    server_parser.add_argument('--cpus', type=int, default=os.cpu_count(), help='CPUs shared by both setups')
+    server_parser.add_argument('--web-workers', type=int, default=4)
+    server_parser.add_argument('--server-workers', type=int, default=1)
+    server_parser.add_argument('--clients', type=int, default=8, help='concurrent clients per web worker')
+    server_parser.add_argument('--requests', type=int, default=16, help='requests per client')
+    server_parser.set_defaults(run=benchmark_inference_server)
+
+    startup_parser = subparsers.add_parser('startup', help='cold start time split into import, load and warm-up')
+    startup_parser.add_argument('--repetitions', type=int, default=3)
+    startup_parser.set_defaults(run=benchmark_startup)
+
+    metrics_parser = subparsers.add_parser('metrics', help='per-request overhead of the Prometheus metrics')
+    metrics_parser.add_argument('--repetitions', type=int, default=2000)
+    metrics_parser.add_argument('--warmup', type=int, default=100)
+    metrics_parser.set_defaults(run=benchmark_metrics)
+
+    args = parser.parse_args()
+    results = args.run(args)
+    print(json.dumps(results, indent=2))
+    if results.get('equivalent') is False:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
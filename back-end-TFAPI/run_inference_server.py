@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+"""
+Run the models in a pool of dedicated inference worker processes.
+
+Every web worker started with 'app.py' normally loads its own copy of both models. With an
+inference server running, web workers started with 'INFERENCE_SERVER_ADDRESSES' set to the
+printed socket paths load no model at all and send their preprocessed batches to the server
+through shared memory, so the models are held once per inference worker. The inference settings
+('INFERENCE_*', 'QUANTIZATION_*') are read from the environment as in 'app.py', and
+'SESKEY' is used as the key web workers authenticate with.
+"""
+
+import argparse
+import os
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the binary and multiclass models to web workers.')
+    parser.add_argument('--workers', type=int, default=1, help='number of inference worker processes')
+    parser.add_argument('--socket-dir', default='/tmp', help='directory of the workers\' Unix domain sockets')
+    parser.add_argument('--intra-op-threads', type=int,
+                        help='threads every worker uses inside an operation (defaults to CPUs / workers)')
+    parser.add_argument('--inter-op-threads', type=int, default=1,
+                        help='operations every worker runs in parallel')
+    args = parser.parse_args()
+
+    intra_op_threads = args.intra_op_threads or max(1, os.cpu_count() // args.workers)
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+    os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+    os.environ['INFERENCE_INTRA_OP_THREADS'] = str(intra_op_threads)
+    os.environ['INFERENCE_INTER_OP_THREADS'] = str(args.inter_op_threads)
+    from website.startup_handling import get_inference_settings
+    from website.inference_server import get_inference_server_addresses, start_inference_server
+
+    addresses = get_inference_server_addresses(args.socket_dir, args.workers)
+    processes = start_inference_server(addresses, os.environ['SESKEY'].encode(), get_inference_settings(),
+                                       os.getcwd() + '/models')
+    print('INFERENCE_SERVER_ADDRESSES=' + ','.join(addresses), flush=True)
+    for process in processes:
+        process.join()
+
+if __name__ == '__main__':
+    main()
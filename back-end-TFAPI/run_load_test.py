@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+
+"""
+Run a reproducible end-to-end load test of the back-end application without network services.
+
+The application is started in its own process against a temporary SQLite database, the
+filesystem storage backend (a local stand-in for S3) and small stand-in models with the same
+input and output shapes as the served models. Synthetic lesion images are generated at
+realistic resolutions, and for every concurrency level, every client signs up, logs in and
+sends '/predict' requests, with a '/history' request every few predictions. Afterwards many
+clients send predictions for the same user at once and the stored history and objects are
+checked for lost or duplicated images; the script exits with status 1 if that check fails.
+
+Throughput, latency percentiles per endpoint and the peak resident memory of the server are
+printed as JSON (or written to '--output'), so results can be stored and compared between
+commits. The stand-in models make the numbers independent of the trained weights; they measure
+the serving stack, not the cost of the real backbones.
+"""
+
+import argparse
+import multiprocessing
+import sys
+import threading
+import tempfile
+import resource
+import json
+import time
+import io
+import os
+import numpy as np
+import requests
+
+INPUT_SHAPE = (320, 320, 3)
+PASSWORD = 'load-test-password'
+
+def save_stand_in_models(models_directory, seed=0):
+    """
+    Save small binary and multiclass models shaped like the served ones.
+
+    Both models are sequential models with the same frozen nested backbone followed by their own
+    classification head, like the transfer-learning models, so the fused serving path is used.
+
+    Args:
+        models_directory (str): Directory the 'model_bin' and 'model_mul' SavedModels are written to.
+        seed (int): Seed of the random weights.
+    """
+    import tensorflow as tf
+    tf.keras.utils.set_random_seed(seed)
+    backbone = tf.keras.Sequential([tf.keras.layers.Conv2D(16, 7, strides=4, activation='relu'),
+                                    tf.keras.layers.Conv2D(32, 3, strides=2, activation='relu'),
+                                    tf.keras.layers.GlobalAveragePooling2D()], name='stand_in_backbone')
+    backbone.build((None,) + INPUT_SHAPE)
+    backbone.trainable = False
+    for model_name, number_of_classes in (('model_bin', 2), ('model_mul', 8)):
+        model = tf.keras.Sequential([tf.keras.Input(shape=INPUT_SHAPE), backbone,
+                                     tf.keras.layers.Dense(number_of_classes, activation='softmax')])
+        tf.keras.models.save_model(model, os.path.join(models_directory, model_name))
+
+def generate_lesion_image(width, height, seed):
+    """
+    Generate a JPEG image of a synthetic skin lesion.
+
+    The image shows a dark blob with an irregular border on a skin-toned background with
+    sensor-like noise, so its JPEG size and decoding cost are close to those of real photographs.
+
+    Args:
+        width (int): Width of the image in pixels.
+        height (int): Height of the image in pixels.
+        seed (int): Seed of the random shape, colors and noise.
+
+    Returns:
+        bytes: The JPEG-encoded image.
+    """
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    y, x = np.ogrid[0:height, 0:width]
+    center_y, center_x = height * rng.uniform(0.35, 0.65), width * rng.uniform(0.35, 0.65)
+    radius = min(width, height) * rng.uniform(0.12, 0.3)
+    angle = np.arctan2(y - center_y, x - center_x)
+    border = radius * (1 + 0.15 * np.sin(3 * angle + rng.uniform(0, 2 * np.pi))
+                       + 0.07 * np.sin(7 * angle + rng.uniform(0, 2 * np.pi)))
+    distance = np.hypot(y - center_y, x - center_x)
+    lesion_mask = np.clip((border - distance) / (0.08 * radius), 0, 1).astype(np.float32)[..., None]
+    skin_color = np.array([224, 172, 150], dtype=np.float32) + rng.normal(0, 8, 3).astype(np.float32)
+    lesion_color = np.array([96, 58, 42], dtype=np.float32) + rng.normal(0, 10, 3).astype(np.float32)
+    pixels = skin_color * (1 - lesion_mask) + lesion_color * lesion_mask
+    pixels += rng.normal(0, 6, (height, width, 1)).astype(np.float32)
+    jpeg = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(jpeg, format='JPEG', quality=90)
+    return jpeg.getvalue()
+
+def run_server(directory, environment, port_queue):
+    """
+    Entry point of the server process: create the stand-in models and serve the application.
+
+    Args:
+        directory (str): Temporary directory holding the models, database and stored images.
+        environment (dict): Environment variables configuring the application.
+        port_queue (multiprocessing.Queue): Queue receiving the port the server listens on.
+    """
+    os.environ.update(environment)
+    save_stand_in_models(environment['MODELS_DIRECTORY'])
+    from werkzeug.serving import make_server
+    from website import create_app
+    app = create_app()
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+def get_process_memory(pid):
+    """
+    Return the current and peak resident memory of a process.
+
+    Args:
+        pid (int): Id of the process.
+
+    Returns:
+        dict: 'rss_mb' and 'peak_rss_mb', read from '/proc/<pid>/status'.
+    """
+    memory = {}
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith(('VmRSS:', 'VmHWM:')):
+                key = 'rss_mb' if line.startswith('VmRSS:') else 'peak_rss_mb'
+                memory[key] = int(line.split()[1]) / 1024
+    return memory
+
+def wait_until_ready(base_url, timeout):
+    """
+    Poll '/readyz' until the models are loaded and warmed up.
+
+    Args:
+        base_url (str): URL of the server.
+        timeout (float): Maximum time to wait in seconds.
+
+    Returns:
+        dict: The loading status reported by the server.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = requests.get(base_url + '/readyz', timeout=5)
+            if response.status_code == 200:
+                return response.json()
+            if response.json()['state'] == 'failed':
+                raise RuntimeError(f'Loading the models failed: {response.json()["error"]}')
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError('The server did not become ready in time')
+
+def summarize(latencies, errors, elapsed):
+    """
+    Summarize the latencies of one endpoint.
+
+    Args:
+        latencies (list): Latency of every request in seconds.
+        errors (int): Number of failed requests.
+        elapsed (float): Duration of the load level in seconds.
+
+    Returns:
+        dict: Number of requests and errors, throughput and latency percentiles in milliseconds.
+    """
+    if not latencies:
+        return {'requests': 0, 'errors': errors}
+    return {'requests': len(latencies),
+            'errors': errors,
+            'throughput_rps': len(latencies) / elapsed,
+            'p50_ms': float(np.percentile(latencies, 50) * 1000),
+            'p95_ms': float(np.percentile(latencies, 95) * 1000),
+            'p99_ms': float(np.percentile(latencies, 99) * 1000)}
+
+class LoadClient:
+    """
+    A simulated user sending requests to the server and recording their latencies.
+
+    Attributes:
+        base_url (str): URL of the server.
+        email (str): Email of the simulated user.
+        token (str or None): Session token, set by 'log_in'.
+        latencies (dict): Request latencies in seconds per endpoint.
+        errors (dict): Number of failed requests per endpoint.
+        stored_predictions (int): Number of predictions the server reported as successful.
+    """
+    def __init__(self, base_url, email):
+        self.base_url = base_url
+        self.email = email
+        self.token = None
+        self.latencies = {}
+        self.errors = {}
+        self.stored_predictions = 0
+        self._session = requests.Session()
+
+    def sign_up(self):
+        """
+        Sign the user up.
+        """
+        self._send('/sign-up', data={'email': self.email, 'firstName': 'Load', 'password': PASSWORD,
+                                     'repeatedPassword': PASSWORD})
+
+    def log_in(self):
+        """
+        Log the user in and keep the session token.
+        """
+        response = self._send('/login', data={'email': self.email, 'password': PASSWORD})
+        self.token = response['token'] if response is not None else None
+
+    def predict(self, image_bytes):
+        """
+        Send an image as a raw JPEG body for prediction.
+
+        Args:
+            image_bytes (bytes): The JPEG-encoded image.
+        """
+        if self._send('/predict', data=image_bytes, headers={'Content-Type': 'image/jpeg'}) is not None:
+            self.stored_predictions += 1
+
+    def get_history(self, limit=50, cursor=None):
+        """
+        Request a page of the user's history.
+
+        Args:
+            limit (int): Maximum number of images on the page.
+            cursor (int or None): Cursor of the page.
+
+        Returns:
+            dict or None: The response, or None if the request failed.
+        """
+        data = {'limit': limit}
+        if cursor is not None:
+            data['cursor'] = cursor
+        return self._send('/history', data=data)
+
+    def get_full_history(self):
+        """
+        Page through the user's whole history.
+
+        Returns:
+            list: Every image of the user, newest first.
+        """
+        images = []
+        cursor = None
+        while True:
+            response = self.get_history(limit=200, cursor=cursor)
+            if response is None:
+                raise RuntimeError(f'History of {self.email} could not be read')
+            images.extend(response['images'])
+            cursor = response['nextCursor']
+            if cursor is None:
+                return images
+
+    def _send(self, endpoint, data, headers=None):
+        """
+        Send a POST request and record its latency and outcome.
+
+        Args:
+            endpoint (str): Path of the endpoint.
+            data (dict or bytes): Form fields or raw body of the request.
+            headers (dict or None): Additional request headers.
+
+        Returns:
+            dict or None: The JSON response if the request succeeded, otherwise None.
+        """
+        headers = dict(headers or {})
+        if self.token is not None:
+            headers['Authorization'] = f'Bearer {self.token}'
+        start = time.perf_counter()
+        try:
+            response = self._session.post(self.base_url + endpoint, data=data, headers=headers, timeout=120)
+            body = response.json() if response.status_code == 200 else None
+        except (requests.RequestException, ValueError):
+            body = None
+        self.latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+        if body is None or body.get('result') != 'success':
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            return None
+        return body
+
+def run_clients(clients, work):
+    """
+    Run a function for every client on its own thread.
+
+    Args:
+        clients (list): The clients.
+        work (callable): Function taking a client and its index.
+
+    Returns:
+        float: Elapsed time in seconds.
+    """
+    threads = [threading.Thread(target=work, args=(client, index)) for index, client in enumerate(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+def run_load_level(base_url, images, number_of_clients, requests_per_client, history_every, level):
+    """
+    Run one concurrency level: every client signs up, logs in and sends predictions and history requests.
+
+    Args:
+        base_url (str): URL of the server.
+        images (list): JPEG-encoded images, cycled through by the clients.
+        number_of_clients (int): Number of concurrent clients.
+        requests_per_client (int): Number of '/predict' requests of every client.
+        history_every (int): Number of predictions between two '/history' requests.
+        level (int): Index of the level, used to keep emails unique.
+
+    Returns:
+        dict: Results per endpoint and for all requests together.
+    """
+    clients = [LoadClient(base_url, f'load{level}_{index}@example.com') for index in range(number_of_clients)]
+
+    def work(client, index):
+        client.sign_up()
+        client.log_in()
+        for request_index in range(requests_per_client):
+            client.predict(images[(index + request_index) % len(images)])
+            if history_every and (request_index + 1) % history_every == 0:
+                client.get_history()
+
+    elapsed = run_clients(clients, work)
+    endpoints = sorted({endpoint for client in clients for endpoint in client.latencies})
+    results = {'clients': number_of_clients, 'elapsed_s': elapsed, 'endpoints': {}}
+    for endpoint in endpoints:
+        results['endpoints'][endpoint] = summarize([latency for client in clients
+                                                    for latency in client.latencies.get(endpoint, [])],
+                                                   sum(client.errors.get(endpoint, 0) for client in clients),
+                                                   elapsed)
+    results['all'] = summarize([latency for client in clients for latencies in client.latencies.values()
+                                for latency in latencies],
+                               sum(sum(client.errors.values()) for client in clients), elapsed)
+    return results
+
+def check_same_user_integrity(base_url, images, storage_directory, number_of_clients, requests_per_client,
+                              upload_timeout):
+    """
+    Send predictions for a single user from many clients at once and check the stored history.
+
+    Every successful prediction must produce exactly one history entry with its own storage key,
+    and once the background uploads have finished, every entry must be uploaded and have its
+    object in the storage directory. Every violated condition is described under 'failures'.
+
+    Args:
+        base_url (str): URL of the server.
+        images (list): JPEG-encoded images, cycled through by the clients.
+        storage_directory (str): Directory of the filesystem storage backend.
+        number_of_clients (int): Number of concurrent clients sharing the user.
+        requests_per_client (int): Number of '/predict' requests of every client.
+        upload_timeout (float): Maximum time in seconds to wait for pending uploads.
+
+    Returns:
+        dict: Number of successful predictions, stored history entries, duplicated storage keys,
+              entries whose upload failed or did not finish and uploaded entries without an object,
+              whether the check 'passed' and the list of 'failures'.
+    """
+    owner = LoadClient(base_url, 'same-user@example.com')
+    owner.sign_up()
+    owner.log_in()
+    clients = [LoadClient(base_url, owner.email) for _ in range(number_of_clients)]
+    for client in clients:
+        client.token = owner.token
+
+    def work(client, index):
+        for request_index in range(requests_per_client):
+            client.predict(images[(index + request_index) % len(images)])
+
+    run_clients(clients, work)
+    deadline = time.monotonic() + upload_timeout
+    history = owner.get_full_history()
+    while any(image['uploadStatus'] == 'pending' for image in history) and time.monotonic() < deadline:
+        time.sleep(0.2)
+        history = owner.get_full_history()
+    storage_keys = [image['name'] for image in history]
+    results = {'clients': number_of_clients,
+               'successful_predictions': sum(client.stored_predictions for client in clients),
+               'history_entries': len(history),
+               'duplicate_storage_keys': len(storage_keys) - len(set(storage_keys)),
+               'not_uploaded': sum(image['uploadStatus'] != 'uploaded' for image in history),
+               'missing_objects': sum(image['uploadStatus'] == 'uploaded'
+                                      and not os.path.exists(os.path.join(storage_directory, image['name']))
+                                      for image in history)}
+    failures = []
+    if results['successful_predictions'] == 0:
+        failures.append('no prediction succeeded')
+    if results['history_entries'] != results['successful_predictions']:
+        failures.append(f"{results['successful_predictions']} successful predictions but "
+                        f"{results['history_entries']} history entries")
+    for name in ('duplicate_storage_keys', 'not_uploaded', 'missing_objects'):
+        if results[name]:
+            failures.append(f"{results[name]} {name.replace('_', ' ')}")
+    results['passed'] = not failures
+    results['failures'] = failures
+    return results
+
+def parse_resolution(resolution):
+    """
+    Parse a 'WIDTHxHEIGHT' resolution.
+
+    Args:
+        resolution (str): The resolution, e.g. '1024x768'.
+
+    Returns:
+        tuple: Width and height in pixels.
+    """
+    width, height = resolution.lower().split('x')
+    return (int(width), int(height))
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end load test of the back-end application.')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 32], help='concurrency levels')
+    parser.add_argument('--requests', type=int, default=20, help='/predict requests per client and level')
+    parser.add_argument('--history-every', type=int, default=5, help='/predict requests between /history requests')
+    parser.add_argument('--resolutions', nargs='+', default=['1024x768', '4032x3024'],
+                        help='resolutions of the synthetic images (dermatoscope and phone camera by default)')
+    parser.add_argument('--images-per-resolution', type=int, default=8)
+    parser.add_argument('--same-user-clients', type=int, default=16,
+                        help='clients sending predictions for one user in the integrity check (0 to skip)')
+    parser.add_argument('--same-user-requests', type=int, default=4, help='/predict requests per same-user client')
+    parser.add_argument('--prediction-cache-size', type=int, default=0,
+                        help='PREDICTION_CACHE_SIZE of the server (disabled by default so every request runs inference)')
+    parser.add_argument('--ready-timeout', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file the JSON results are written to instead of the standard output')
+    args = parser.parse_args()
+
+    images = [generate_lesion_image(width, height, args.seed + index)
+              for width, height in map(parse_resolution, args.resolutions)
+              for index in range(args.images_per_resolution)]
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        environment = {'SESKEY': 'load-test-secret-key',
+                       'TF_CPP_MIN_LOG_LEVEL': '3',
+                       'MODELS_DIRECTORY': os.path.join(directory, 'models'),
+                       'DATABASE_URL': f'sqlite:///{directory}/load-test.db',
+                       'STORAGE_BACKEND': 'filesystem',
+                       'STORAGE_DIRECTORY': os.path.join(directory, 'storage'),
+                       'UPLOAD_SPOOL_DIRECTORY': os.path.join(directory, 'upload-spool'),
+                       'PREDICTION_CACHE_SIZE': str(args.prediction_cache_size)}
+        port_queue = context.Queue()
+        server = context.Process(target=run_server, args=(directory, environment, port_queue), daemon=True)
+        server.start()
+        try:
+            base_url = f'http://127.0.0.1:{port_queue.get(timeout=args.ready_timeout)}'
+            results = {'config': {key: value for key, value in vars(args).items() if key != 'output'},
+                       'startup': wait_until_ready(base_url, args.ready_timeout),
+                       'levels': []}
+            for level, number_of_clients in enumerate(args.clients):
+                level_results = run_load_level(base_url, images, number_of_clients, args.requests,
+                                               args.history_every, level)
+                level_results['server_memory'] = get_process_memory(server.pid)
+                results['levels'].append(level_results)
+            if args.same_user_clients:
+                results['same_user_integrity'] = check_same_user_integrity(
+                    base_url, images, environment['STORAGE_DIRECTORY'], args.same_user_clients,
+                    args.same_user_requests, upload_timeout=60)
+            results['server_memory'] = get_process_memory(server.pid)
+            results['client_peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        finally:
+            server.terminate()
+            server.join()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+    if not results.get('same_user_integrity', {'passed': True})['passed']:
+        print('Same-user integrity check failed: ' + '; '.join(results['same_user_integrity']['failures']),
+              file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+tf = pytest.importorskip('tensorflow')
+inference_handling = pytest.importorskip('website.inference_handling')
+
+INPUT_SHAPE = (32, 32, 3)
+TOLERANCE = 1e-5
+
+def build_models(backbone_trainable=False, seed=0):
+    """
+    Build small binary and multiclass models sharing one nested backbone, like 'save_stand_in_models'.
+
+    Args:
+        backbone_trainable (bool): Whether the shared backbone is left trainable (fine-tuned).
+        seed (int): Seed of the random weights.
+
+    Returns:
+        dict: Models keyed by name, as stored in 'app.available_models'.
+    """
+    tf.keras.utils.set_random_seed(seed)
+    backbone = tf.keras.Sequential([tf.keras.layers.Conv2D(8, 3, strides=2, activation='relu'),
+                                    tf.keras.layers.GlobalAveragePooling2D()], name='test_backbone')
+    backbone.build((None,) + INPUT_SHAPE)
+    backbone.trainable = backbone_trainable
+    available_models = {}
+    for model_name, number_of_classes in (('binary_model', 2), ('multiclass_model', 8)):
+        available_models[model_name] = tf.keras.Sequential([tf.keras.Input(shape=INPUT_SHAPE), backbone,
+                                                            tf.keras.layers.Dense(16, activation='relu'),
+                                                            tf.keras.layers.Dense(number_of_classes,
+                                                                                  activation='softmax')])
+    return available_models
+
+def get_separate_outputs(available_models, batch):
+    return {key: available_models[model_name].predict(batch, verbose=0)
+            for key, model_name in inference_handling.PREDICTION_KEYS.items()}
+
+def test_fused_model_matches_separate_models():
+    available_models = build_models()
+    fused_model = inference_handling.build_fused_model(available_models, input_shape=INPUT_SHAPE)
+    assert fused_model is not None
+    batch = np.random.default_rng(0).random((5,) + INPUT_SHAPE, dtype=np.float32)
+    expected = get_separate_outputs(available_models, batch)
+    for predictor in (inference_handling.FusedPredictor(fused_model),
+                      inference_handling.FusedPredictor(inference_handling.TracedModel(fused_model, [1, 2, 4],
+                                                                                       input_shape=INPUT_SHAPE))):
+        outputs = predictor.predict(batch)
+        for key in inference_handling.PREDICTION_KEYS:
+            np.testing.assert_allclose(outputs[key], expected[key], atol=TOLERANCE)
+
+def test_trainable_backbone_falls_back_to_concurrent_predictor():
+    available_models = build_models(backbone_trainable=True)
+    assert inference_handling.build_fused_model(available_models, input_shape=INPUT_SHAPE) is None
+    predictor = inference_handling.build_predictor(available_models, engine='keras')
+    assert isinstance(predictor, inference_handling.ConcurrentPredictor)
+    batch = np.random.default_rng(1).random((3,) + INPUT_SHAPE, dtype=np.float32)
+    outputs = predictor.predict(batch)
+    expected = get_separate_outputs(available_models, batch)
+    for key in inference_handling.PREDICTION_KEYS:
+        np.testing.assert_allclose(outputs[key], expected[key], atol=TOLERANCE)
+
+def test_different_backbones_are_not_fused():
+    available_models = build_models(seed=0)
+    available_models['multiclass_model'] = build_models(seed=1)['multiclass_model']
+    assert inference_handling.build_fused_model(available_models, input_shape=INPUT_SHAPE) is None
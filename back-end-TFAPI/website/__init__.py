@@ -1,19 +1,31 @@
 from flask import Flask
-import tensorflow as tf
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import os
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 
+from .s3_bucket_handling import UploadQueue, create_storage
+from .cache_handling import PredictionCache
+from .auth_handling import TokenAuthenticator
+from .database_handling import get_database_settings, tune_sqlite_engine
+from .startup_handling import get_inference_settings, ModelLoader
+from .metrics_handling import PipelineMetrics
+
 db = SQLAlchemy()
 DB_NAME = "database.db"
 
-def create_app():
+def create_app(recover_uploads=True):
     """
     Create and configure an instance of the Flask application.
 
     This function sets up the Flask application with necessary configurations,
-    initializes the database, and loads machine learning models using TensorFlow.
-    It also sets up CORS (Cross-Origin Resource Sharing) for the application.
+    initializes the database, and loads machine learning models using TensorFlow,
+    by default on a background thread (see 'ModelLoader'). It also sets up CORS (Cross-Origin Resource Sharing) for the application.
+
+    Args:
+        recover_uploads (bool): Whether to re-enqueue the pending uploads of previous runs. Offline
+                                tools sharing the database with running servers pass False.
 
     Returns:
         Flask: A Flask application instance with registered endpoints, database,
@@ -22,12 +34,74 @@ def create_app():
     Environment Variables:
         TF_CPP_MIN_LOG_LEVEL: TensorFlow logging level (set to '3' to suppress logs).
         SESKEY: Secret key for the Flask application.
+        MODELS_DIRECTORY: Directory holding the models (defaults to 'models' in the working directory).
+        DATABASE_URL, DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_POOL_RECYCLE, SQLITE_TUNED,
+        SQLITE_BUSY_TIMEOUT_MS: Database settings, see 'get_database_settings'.
+        MIGRATION_LOCK_FILE: Lock file serializing the schema upgrades of concurrently starting
+                             workers on databases other than PostgreSQL (defaults to
+                             'migrations.lock' in the instance folder).
+        INFERENCE_*, QUANTIZATION_*: Inference settings, see 'get_inference_settings'.
+        STORAGE_BACKEND: 's3' to store images in an S3 bucket (default) or 'filesystem' to store
+                         them in a local directory.
+        S3_BUCKET, S3_REGION, S3_ENDPOINT_URL: The S3 bucket, its region and an optional endpoint
+                                               of an S3-compatible stand-in.
+        STORAGE_DIRECTORY, STORAGE_BASE_URL: The directory and URL prefix of the filesystem backend.
+        UPLOAD_WORKERS: Number of background upload workers (defaults to 4).
+        UPLOAD_QUEUE_SIZE: Maximum number of uploads waiting for a worker (defaults to 256).
+        UPLOAD_MAX_ATTEMPTS: Number of attempts before an upload is marked as failed (defaults to 5).
+        UPLOAD_SPOOL_DIRECTORY: Directory holding the bytes of pending uploads until they are
+                                stored (defaults to 'upload-spool' in the instance folder).
+        UPLOAD_MAX_PENDING_AGE: Age in seconds after which pending images without spooled bytes
+                                are marked as failed when the spool is recovered (defaults to 3600).
+        PREDICTION_CACHE_SIZE: Maximum number of predictions cached in memory (defaults to 1024,
+                               0 disables the cache).
+        PREDICTION_CACHE_TTL: Time to live of a cached prediction in seconds (defaults to 3600).
+        PREDICTION_CACHE_PERSISTENT: Set to '1' to also cache predictions in the database.
+        BATCH_PREDICT_MAX_IMAGES: Maximum number of images in a '/predict/batch' request (defaults to 64).
+        MAX_CONTENT_LENGTH_MB: Maximum size of a request body in megabytes (defaults to 64).
+        TOKEN_MAX_AGE: Lifetime of a session token in seconds (defaults to 86400).
+        PREPROCESSING_WORKERS: Number of threads decoding and preprocessing batch images (defaults
+                               to the number of CPUs).
+        METRICS_ENABLED: Set to '0' to disable the Prometheus metrics and the '/metrics' endpoint
+                         (always disabled when 'prometheus_client' is not installed).
+        PROFILE_SAMPLE_RATE: Fraction of requests profiled (defaults to 0, profiling disabled).
+        PROFILER: 'cprofile' to write '.prof' files of sampled requests (default) or 'tensorflow'
+                  to record TensorFlow profiler traces.
+        PROFILE_DIRECTORY: Directory profiles are written to (defaults to 'profiles' in the
+                           instance folder).
     """
     os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
     app = Flask(__name__)
     CORS(app)
     app.config['SECRET_KEY'] = os.environ['SESKEY']
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DB_NAME}'
+    app.config['MODELS_DIRECTORY'] = os.environ.get('MODELS_DIRECTORY', os.getcwd() + '/models')
+    app.config.update(get_database_settings(f'sqlite:///{DB_NAME}'))
+    app.config.update(get_inference_settings())
+    app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 's3')
+    app.config['S3_BUCKET'] = os.environ.get('S3_BUCKET', 'rofbusinesstestbucket')
+    app.config['S3_REGION'] = os.environ.get('S3_REGION', 'eu-central-1')
+    app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL')
+    app.config['STORAGE_DIRECTORY'] = os.environ.get('STORAGE_DIRECTORY', os.path.join(app.instance_path, 'storage'))
+    app.config['STORAGE_BASE_URL'] = os.environ.get('STORAGE_BASE_URL')
+    app.config['UPLOAD_WORKERS'] = int(os.environ.get('UPLOAD_WORKERS', 4))
+    app.config['UPLOAD_QUEUE_SIZE'] = int(os.environ.get('UPLOAD_QUEUE_SIZE', 256))
+    app.config['UPLOAD_MAX_ATTEMPTS'] = int(os.environ.get('UPLOAD_MAX_ATTEMPTS', 5))
+    app.config['UPLOAD_SPOOL_DIRECTORY'] = os.environ.get('UPLOAD_SPOOL_DIRECTORY',
+                                                          os.path.join(app.instance_path, 'upload-spool'))
+    app.config['UPLOAD_MAX_PENDING_AGE'] = float(os.environ.get('UPLOAD_MAX_PENDING_AGE', 3600))
+    app.config['PREDICTION_CACHE_SIZE'] = int(os.environ.get('PREDICTION_CACHE_SIZE', 1024))
+    app.config['PREDICTION_CACHE_TTL'] = float(os.environ.get('PREDICTION_CACHE_TTL', 3600))
+    app.config['PREDICTION_CACHE_PERSISTENT'] = os.environ.get('PREDICTION_CACHE_PERSISTENT', '0') == '1'
+    app.config['BATCH_PREDICT_MAX_IMAGES'] = int(os.environ.get('BATCH_PREDICT_MAX_IMAGES', 64))
+    app.config['MAX_CONTENT_LENGTH'] = int(float(os.environ.get('MAX_CONTENT_LENGTH_MB', 64)) * 2**20)
+    app.config['TOKEN_MAX_AGE'] = int(os.environ.get('TOKEN_MAX_AGE', 86400))
+    app.config['PREPROCESSING_WORKERS'] = int(os.environ.get('PREPROCESSING_WORKERS', os.cpu_count()))
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+    app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    app.config['PROFILER'] = os.environ.get('PROFILER', 'cprofile')
+    app.config['PROFILE_DIRECTORY'] = os.environ.get('PROFILE_DIRECTORY', os.path.join(app.instance_path, 'profiles'))
+    app.config['MIGRATION_LOCK_FILE'] = os.environ.get('MIGRATION_LOCK_FILE',
+                                                       os.path.join(app.instance_path, 'migrations.lock'))
     db.init_app(app)
 
     from .endpoints import endpoints
@@ -35,14 +109,39 @@ def create_app():
 
     create_database(app)
 
-    available_models = {}
-    available_models['binary_model'] = tf.keras.models.load_model(os.getcwd() + '/models/model_bin')
-    tf.keras.backend.clear_session()
-    available_models['multiclass_model'] = tf.keras.models.load_model(os.getcwd() + '/models/model_mul')
-    tf.keras.backend.clear_session()
-    app.available_models = available_models
-    for model in app.available_models:
-        app.available_models[model].summary()
+    app.pipeline_metrics = PipelineMetrics(enabled=app.config['METRICS_ENABLED'],
+                                           profile_sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+                                           profile_directory=app.config['PROFILE_DIRECTORY'],
+                                           profiler=app.config['PROFILER'])
+    app.pipeline_metrics.init_app(app)
+
+    app.token_authenticator = TokenAuthenticator(app.config['SECRET_KEY'], max_age=app.config['TOKEN_MAX_AGE'])
+    app.preprocessing_executor = ThreadPoolExecutor(max_workers=app.config['PREPROCESSING_WORKERS'],
+                                                    thread_name_prefix='preprocessing')
+    app.storage = create_storage(app.config)
+    app.upload_queue = UploadQueue(app, app.storage, app.config['UPLOAD_SPOOL_DIRECTORY'],
+                                   workers=app.config['UPLOAD_WORKERS'],
+                                   max_size=app.config['UPLOAD_QUEUE_SIZE'],
+                                   max_attempts=app.config['UPLOAD_MAX_ATTEMPTS'],
+                                   max_pending_age=app.config['UPLOAD_MAX_PENDING_AGE'],
+                                   metrics=app.pipeline_metrics)
+    if recover_uploads:
+        threading.Thread(target=app.upload_queue.recover_pending, name='upload-recovery', daemon=True).start()
+
+    app.prediction_cache = None
+    if app.config['PREDICTION_CACHE_SIZE'] > 0:
+        app.prediction_cache = PredictionCache(max_entries=app.config['PREDICTION_CACHE_SIZE'],
+                                               ttl=app.config['PREDICTION_CACHE_TTL'],
+                                               persistent=app.config['PREDICTION_CACHE_PERSISTENT'])
+
+    app.available_models = {}
+    app.inference_scheduler = None
+    app.models_version = None
+    app.model_loader = ModelLoader(app, app.config['MODELS_DIRECTORY'])
+    if app.config['INFERENCE_STARTUP'] == 'blocking':
+        app.model_loader.load(raise_errors=True)
+    else:
+        app.model_loader.start()
 
     return app
 
@@ -51,12 +150,17 @@ def create_database(app):
     Create the database for the Flask application.
 
     This function is called during the application setup to create the database
-    if it does not already exist. It uses SQLAlchemy to interact with the database.
+    if it does not already exist, or to apply pending schema migrations to an existing
+    one. It uses SQLAlchemy to interact with the database. SQLite connections are
+    switched to WAL journaling first, unless disabled with 'SQLITE_TUNED'. Workers starting
+    at the same time upgrade the database one after the other (see 'upgrade_database').
 
     Args:
         app (Flask): The Flask application instance for which the database is created.
     """
-    from .models import User, Image
+    from .models import User, Image, CachedPrediction
+    from .migrations import upgrade_database
     with app.app_context():
-        if not os.path.exists('website/' + DB_NAME):
-            db.create_all()
+        if app.config['SQLITE_TUNED']:
+            tune_sqlite_engine(db.engine, app.config['SQLITE_BUSY_TIMEOUT_MS'])
+        upgrade_database(app.config['MIGRATION_LOCK_FILE'])
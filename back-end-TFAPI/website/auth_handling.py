@@ -0,0 +1,98 @@
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+import threading
+import time
+
+from . import db
+
+TOKEN_SALT = 'auth-token'
+
+class TokenAuthenticator:
+    """
+    Issue and verify signed, expiring session tokens.
+
+    Checking a password hash is deliberately slow, so instead of sending the password with every
+    request, clients exchange it once on '/login' for a token signed with the application's
+    secret key. A token carries the user's id, email and token generation; verifying it is an
+    HMAC check plus a lookup of the user's current generation. Revoking a user's tokens bumps
+    the generation stored in the database, which invalidates every token issued before.
+
+    Generations are cached in memory for 'generation_cache_ttl' seconds, so most verifications do
+    not touch the database. In a deployment with several worker processes a revocation therefore
+    takes effect in the other workers after at most that long.
+
+    Attributes:
+        max_age (int): Lifetime of a token in seconds.
+        generation_cache_ttl (float): Time in seconds a user's token generation is cached.
+    """
+    def __init__(self, secret_key, max_age=86400, generation_cache_ttl=5):
+        self.max_age = max_age
+        self.generation_cache_ttl = generation_cache_ttl
+        self._serializer = URLSafeTimedSerializer(secret_key, salt=TOKEN_SALT)
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def issue_token(self, user):
+        """
+        Issue a token for a user.
+
+        Args:
+            user (User): The authenticated user.
+
+        Returns:
+            str: The signed token.
+        """
+        return self._serializer.dumps({'id': user.id, 'email': user.email, 'generation': user.token_generation or 0})
+
+    def verify_token(self, token):
+        """
+        Verify a token.
+
+        Args:
+            token (str): A token issued by 'issue_token'.
+
+        Returns:
+            tuple: A tuple containing the result ('success' or 'fail'), the reason for failure if
+                   applicable and the email of the token's user (None on failure).
+        """
+        try:
+            payload = self._serializer.loads(token, max_age=self.max_age)
+        except SignatureExpired:
+            return ('fail', 'Token has expired!', None)
+        except BadSignature:
+            return ('fail', 'Token is not valid!', None)
+        if payload['generation'] != self._get_generation(payload['id']):
+            return ('fail', 'Token has been revoked!', None)
+        return ('success', '', payload['email'])
+
+    def revoke_tokens(self, user):
+        """
+        Revoke every token issued so far for a user.
+
+        Args:
+            user (User): The user whose tokens are revoked.
+        """
+        user.token_generation = (user.token_generation or 0) + 1
+        db.session.commit()
+        with self._lock:
+            self._generations.pop(user.id, None)
+
+    def _get_generation(self, user_id):
+        """
+        Return the current token generation of a user, using the in-memory cache.
+
+        Args:
+            user_id (int): Id of the user.
+
+        Returns:
+            int or None: The user's token generation, or None if the user does not exist.
+        """
+        with self._lock:
+            cached = self._generations.get(user_id)
+        if cached is not None and time.monotonic() - cached[0] <= self.generation_cache_ttl:
+            return cached[1]
+        from .models import User
+        user = db.session.get(User, user_id)
+        generation = (user.token_generation or 0) if user is not None else None
+        with self._lock:
+            self._generations[user_id] = (time.monotonic(), generation)
+        return generation
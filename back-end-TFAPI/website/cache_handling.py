@@ -0,0 +1,175 @@
+from collections import OrderedDict
+import threading
+import hashlib
+import json
+import time
+import os
+
+from . import db
+
+def get_models_version(models_directory, backend=''):
+    """
+    Compute a version identifier of the models served by the application.
+
+    The identifier is a hash of the inference backend and the relative path, size and
+    modification time of every file under the models directory, so it changes whenever a model
+    is replaced, retrained or re-quantized.
+
+    Args:
+        models_directory (str): Directory holding the models.
+        backend (str): Name of the inference backend, since backends produce slightly different
+                       predictions for the same model files.
+
+    Returns:
+        str: A short hexadecimal version identifier.
+    """
+    digest = hashlib.sha256(backend.encode())
+    for directory, directory_names, file_names in os.walk(models_directory):
+        directory_names.sort()
+        for file_name in sorted(file_names):
+            path = os.path.join(directory, file_name)
+            stat = os.stat(path)
+            digest.update(f'{os.path.relpath(path, models_directory)}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()[:16]
+
+class PredictionCache:
+    """
+    Two-tier cache of predictions keyed by the content of the uploaded image and the models version.
+
+    The first tier is an in-process LRU dictionary with a maximum number of entries and a time
+    to live. The optional second tier is the 'CachedPrediction' table, shared by every worker
+    and surviving restarts. Every entry stores the prediction and the id of the 'Image' row
+    holding the already uploaded object, so that repeated submissions can reuse it.
+
+    The models version is the version of the models actually loaded by the application, set with
+    'set_models_version' when they are installed, so cached predictions always belong to the
+    models that made them. Setting another version clears the in-process tier and deletes
+    persistent entries of other versions.
+
+    Attributes:
+        max_entries (int): Maximum number of entries in the in-process tier.
+        ttl (float): Time to live of an entry in seconds.
+        persistent (bool): Whether the database tier is used.
+        models_version (str or None): Version of the loaded models, None until they are loaded.
+    """
+    def __init__(self, max_entries=1024, ttl=3600, persistent=False):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persistent = persistent
+        self.models_version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._statistics = {'memory_hits': 0, 'persistent_hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get_key(self, image_byte_data):
+        """
+        Compute the cache key of an uploaded image.
+
+        Args:
+            image_byte_data (bytes): The decoded (not base64-encoded) bytes of the image file.
+
+        Returns:
+            str: A hash of the image bytes and the models version.
+        """
+        return hashlib.sha256(image_byte_data).hexdigest() + ':' + self.models_version
+
+    def get(self, key):
+        """
+        Look up a cached prediction, first in memory and then in the database.
+
+        Args:
+            key (str): A key returned by 'get_key'.
+
+        Returns:
+            dict or None: A dictionary with the 'prediction' and the 'image_id' of the uploaded
+                          object, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self._statistics['memory_hits'] += 1
+                return entry[1]
+            self._entries.pop(key, None)
+        if self.persistent:
+            from .models import CachedPrediction
+            cached_prediction = db.session.get(CachedPrediction, key)
+            if cached_prediction is not None and time.time() - cached_prediction.created_at <= self.ttl:
+                value = {'prediction': json.loads(cached_prediction.prediction), 'image_id': cached_prediction.image_id}
+                self._store_in_memory(key, value)
+                with self._lock:
+                    self._statistics['persistent_hits'] += 1
+                return value
+        with self._lock:
+            self._statistics['misses'] += 1
+        return None
+
+    def put(self, key, prediction, image_id):
+        """
+        Store a prediction in every enabled tier.
+
+        Args:
+            key (str): A key returned by 'get_key'.
+            prediction (dict): The prediction returned to the user.
+            image_id (int): Id of the 'Image' row holding the uploaded object.
+        """
+        self._store_in_memory(key, {'prediction': prediction, 'image_id': image_id})
+        if self.persistent:
+            from .models import CachedPrediction
+            db.session.merge(CachedPrediction(key = key,
+                                              models_version = self.models_version,
+                                              prediction = json.dumps(prediction),
+                                              image_id = image_id,
+                                              created_at = time.time()))
+            db.session.commit()
+
+    def get_metrics(self):
+        """
+        Return the cache statistics.
+
+        Returns:
+            dict: Hit and miss counts, hit rate, number of invalidations, number of entries in
+                  memory and the current models version.
+        """
+        with self._lock:
+            statistics = dict(self._statistics)
+            statistics['entries'] = len(self._entries)
+        lookups = statistics['memory_hits'] + statistics['persistent_hits'] + statistics['misses']
+        statistics['hit_rate'] = (lookups - statistics['misses']) / lookups if lookups else 0.0
+        statistics['models_version'] = self.models_version
+        return statistics
+
+    def _store_in_memory(self, key, value):
+        """
+        Insert an entry into the in-process tier, evicting the least recently used entries.
+
+        Args:
+            key (str): A key returned by 'get_key'.
+            value (dict): The cached value.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set_models_version(self, models_version):
+        """
+        Switch the cache to the version of newly loaded models, invalidating entries of other versions.
+
+        Must be called inside an application context when the database tier is used.
+
+        Args:
+            models_version (str): Version of the loaded models, as returned by 'get_models_version'.
+        """
+        if models_version == self.models_version:
+            return
+        with self._lock:
+            if self.models_version is not None:
+                self._statistics['invalidations'] += 1
+            self.models_version = models_version
+            self._entries.clear()
+        if self.persistent:
+            from .models import CachedPrediction
+            CachedPrediction.query.filter(CachedPrediction.models_version != models_version).delete()
+            db.session.commit()
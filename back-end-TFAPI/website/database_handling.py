@@ -0,0 +1,68 @@
+from sqlalchemy import event
+import os
+
+def get_database_settings(default_url):
+    """
+    Build the SQLAlchemy settings of the application from environment variables.
+
+    SQLite databases get a busy timeout and cross-thread connections, while server databases
+    get a sized connection pool with pre-ping and connection recycling, so that connections
+    dropped by the server are replaced instead of failing requests.
+
+    Environment Variables:
+        DATABASE_URL: SQLAlchemy database URL overriding 'default_url'.
+        DATABASE_POOL_SIZE: Number of pooled connections of a server database (defaults to 10).
+        DATABASE_MAX_OVERFLOW: Number of connections opened beyond the pool size under load
+                               (defaults to 20).
+        DATABASE_POOL_RECYCLE: Age in seconds after which pooled connections are replaced
+                               (defaults to 1800).
+        SQLITE_TUNED: Set to '0' to keep SQLite's default journaling and synchronous settings.
+        SQLITE_BUSY_TIMEOUT_MS: Time a SQLite write waits for the database lock (defaults to 5000).
+
+    Args:
+        default_url (str): Database URL used when 'DATABASE_URL' is not set.
+
+    Returns:
+        dict: Flask configuration entries: 'SQLALCHEMY_DATABASE_URI', 'SQLALCHEMY_ENGINE_OPTIONS',
+              'SQLITE_TUNED' and 'SQLITE_BUSY_TIMEOUT_MS'.
+    """
+    database_url = os.environ.get('DATABASE_URL', default_url)
+    if database_url.startswith('postgres://'):
+        database_url = 'postgresql://' + database_url[len('postgres://'):]
+    settings = {'SQLALCHEMY_DATABASE_URI': database_url,
+                'SQLITE_TUNED': os.environ.get('SQLITE_TUNED', '1') == '1',
+                'SQLITE_BUSY_TIMEOUT_MS': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}
+    if database_url.startswith('sqlite'):
+        settings['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_pre_ping': True,
+            'connect_args': {'timeout': settings['SQLITE_BUSY_TIMEOUT_MS'] / 1000, 'check_same_thread': False}}
+    else:
+        settings['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': int(os.environ.get('DATABASE_POOL_SIZE', 10)),
+            'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW', 20)),
+            'pool_recycle': int(os.environ.get('DATABASE_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': True}
+    return settings
+
+def tune_sqlite_engine(engine, busy_timeout_ms):
+    """
+    Configure every new SQLite connection of an engine for concurrent writers.
+
+    Write-ahead logging lets readers proceed while a write is in progress, the busy timeout
+    makes writers wait for the lock instead of failing with "database is locked", and
+    'synchronous=NORMAL' only syncs the log at checkpoints, which is safe in WAL mode.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the application's database.
+        busy_timeout_ms (int): Time a write waits for the database lock, in milliseconds.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout_ms)}')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
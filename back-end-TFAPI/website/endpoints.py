@@ -1,17 +1,94 @@
-from flask import Blueprint, request, current_app, jsonify, url_for
+from flask import Blueprint, Response, request, current_app, jsonify, url_for, stream_with_context
 from werkzeug.security import generate_password_hash, check_password_hash
 import requests
 import sqlalchemy
+import numpy as np
+import json
+import uuid
+from datetime import datetime
 import re
 import os
 
 from . import db
-from .transform_handling import transform_image_into_tensor, transform_base64_into_image_and_byte_data
+from .transform_handling import transform_image_into_tensor, transform_base64_into_image_and_byte_data, get_thread_buffer, \
+    transform_stream_into_image_and_byte_data, INPUT_SHAPE
 from .models import User, Image
-from .s3_bucket_handling import upload_to_s3
 
 endpoints = Blueprint('endpoints', __name__)
 EMAIL_REGEX = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,7}\b'
+RAW_IMAGE_MIMETYPES = ('image/jpeg', 'image/png')
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+def get_request_credentials():
+    """
+    Read the user's credentials from the current request.
+
+    Credentials are taken from the 'email' and 'password' form fields. Requests whose body is not a 
+    form (e.g. a raw image upload) can send them with HTTP Basic authentication instead.
+
+    Returns:
+        tuple: A tuple containing the email and the password (None if they are missing).
+    """
+    if request.mimetype not in RAW_IMAGE_MIMETYPES:
+        email = request.form.get('email')
+        if email is not None:
+            return (email, request.form.get('password'))
+    if request.authorization is not None:
+        return (request.authorization.username, request.authorization.password)
+    return (None, None)
+
+def get_request_image():
+    """
+    Read the submitted image from the current request.
+
+    Three encodings are supported: a raw 'image/jpeg' or 'image/png' request body, a 'multipart/form-data' 
+    file part named 'image', and a base64 string in the 'base64' form field, used by older clients.
+
+    Returns:
+        tuple: A tuple containing the image object and its byte data.
+    """
+    if request.mimetype in RAW_IMAGE_MIMETYPES:
+        return transform_stream_into_image_and_byte_data(request.stream)
+    if 'image' in request.files:
+        return transform_stream_into_image_and_byte_data(request.files['image'].stream)
+    return transform_base64_into_image_and_byte_data(request.form.get('base64'))
+
+def get_request_token():
+    """
+    Read the session token from the current request.
+
+    The token can be sent as an 'Authorization: Bearer <token>' header or, for form requests, in 
+    the 'token' form field.
+
+    Returns:
+        str or None: The token, or None if the request does not carry one.
+    """
+    authorization_header = request.headers.get('Authorization', '')
+    if authorization_header.startswith('Bearer '):
+        return authorization_header[len('Bearer '):].strip()
+    if request.mimetype not in RAW_IMAGE_MIMETYPES:
+        return request.form.get('token')
+    return None
+
+def authenticate_request():
+    """
+    Authenticate the user sending the current request.
+
+    Requests carrying a session token are verified with the application's token authenticator, 
+    which only needs an HMAC check and a cached lookup. Requests without a token fall back to 
+    the email and password check of 'attempt_user_login', kept for older clients.
+
+    Returns:
+        tuple: A tuple containing the result ('success' or 'fail'), the reason for failure if 
+               applicable and the authenticated user's email (None on failure).
+    """
+    token = get_request_token()
+    if token is not None:
+        return current_app.token_authenticator.verify_token(token)
+    email, password = get_request_credentials()
+    login_response = attempt_user_login(email, password)
+    return (login_response[0], login_response[1], email if login_response[0] == 'success' else None)
 
 def attempt_user_login(email, password):
     """
@@ -75,78 +152,348 @@ def attempt_user_sing_up(email, first_name, password, repeated_password):
             reason = 'Password should be at least 5 characters long!'
     return (result, reason)
 
-def get_user_image_history(email):
+def get_user_image_history(email, limit=HISTORY_PAGE_SIZE, cursor=None, created_from=None, created_to=None,
+                           predicted_class=None):
     """
-    Retrieve the history of images processed for a given user.
+    Retrieve a page of the history of images processed for a given user.
+
+    Images are returned newest first. The user's images are selected with a single indexed query 
+    joined on the user's email, and only one page plus one row is loaded, so the cost of a request 
+    does not grow with the size of the user's history. The next page is requested by passing the 
+    returned cursor back.
 
     Args:
         email (str): User's email.
+        limit (int): Maximum number of images returned.
+        cursor (int): Cursor returned with the previous page, or None for the first page.
+        created_from (datetime): Only return images submitted at or after this time.
+        created_to (datetime): Only return images submitted before this time.
+        predicted_class (int): Only return images whose most probable multiclass class is this one.
 
     Returns:
-        dict: A dictionary with image names as keys and their details (URL, prediction) as values.
+        tuple: A tuple containing a list of image details (name, URL, prediction, predicted class, 
+               creation time and upload status) and the cursor of the next page (None if this is 
+               the last page).
     """
-    user = User.query.filter_by(email = email).first()
-    user_images = Image.query.filter_by(user_id = user.id)
-    image_history = {}
-    for image in user_images:
-        image_name = image.url.split('/')[-1]
-        image_history.update({image_name: {}})
-        image_history.get(image_name).update({'url': image.url,
-                                            'prediction': image.jsonified_prediction})
-    return image_history
+    query = Image.query.join(User).filter(User.email == email)
+    if cursor is not None:
+        query = query.filter(Image.id < cursor)
+    if created_from is not None:
+        query = query.filter(Image.created_at >= created_from)
+    if created_to is not None:
+        query = query.filter(Image.created_at < created_to)
+    if predicted_class is not None:
+        query = query.filter(Image.predicted_class == predicted_class)
+    user_images = query.order_by(Image.id.desc()).limit(limit + 1).all()
+    image_history = []
+    for image in user_images[:limit]:
+        image_history.append({'name': image.storage_key,
+                              'url': image.url,
+                              'prediction': image.prediction,
+                              'predictedClass': image.predicted_class,
+                              'createdAt': image.created_at.isoformat() if image.created_at else None,
+                              'uploadStatus': image.upload_status})
+    next_cursor = user_images[limit - 1].id if len(user_images) > limit else None
+    return (image_history, next_cursor)
+
+def get_predicted_class(predicted_values):
+    """
+    Return the index of the most probable class of a multiclass prediction.
+
+    Args:
+        predicted_values (dict): Predictions with a 'multiclass' list of probabilities.
+
+    Returns:
+        int: Index of the most probable class.
+    """
+    return int(np.argmax(predicted_values['multiclass']))
 
 def predict_image(image):
     """
     Predict the classification of an image using pre-loaded machine learning models.
 
     This function first transforms the input image into a tensor format suitable for 
-    the machine learning models. It then uses the binary and multiclass models loaded 
-    into the Flask application to predict the image's classification.
+    the machine learning models, decoding it at reduced scale and writing it into the 
+    request thread's reusable input buffer. It then submits the tensor to the application's inference 
+    scheduler, which batches it together with tensors from concurrent requests and runs 
+    the binary and multiclass models over the whole batch at once.
 
     Args:
         image: An image file to be classified. The image is expected to be in a format 
-               compatible with the transform_image_into_tensor function (e.g., PIL image).
+               compatible with the transform_image_into_tensor function (e.g., PIL image). 
+               It is decoded in draft mode, so it should not have been loaded yet.
 
     Returns:
         dict: A dictionary containing the predictions from both models. The 'binary' key 
               corresponds to the prediction from the binary model, and the 'multiclass' 
               key corresponds to the prediction from the multiclass model.
     """
-    image_tensor = transform_image_into_tensor(image.copy())
-    binary_prediction = current_app.available_models['binary_model'].predict(image_tensor, verbose=0)
-    multiclass_prediction = current_app.available_models['multiclass_model'].predict(image_tensor, verbose=0)
-    return {'binary': binary_prediction.tolist()[0], 'multiclass': multiclass_prediction.tolist()[0]}
+    metrics = current_app.pipeline_metrics
+    with metrics.time_stage('transform'):
+        image_tensor = transform_image_into_tensor(image, out=get_thread_buffer())
+    with metrics.time_stage('inference'):
+        return current_app.inference_scheduler.predict(image_tensor)[0]
+
+def generate_storage_key(user_id):
+    """
+    Generate a unique storage key for a new image of a user.
+
+    Args:
+        user_id (int): ID of the user submitting the image.
+
+    Returns:
+        str: A key of the form 'user_<id>_image_<uuid>.jpg'.
+    """
+    return f'user_{user_id}_image_{uuid.uuid4().hex}.jpg'
 
-def add_image_for_user(email, image_byte_data, predicted_values):
+def add_images_for_user(email, submitted_images):
+    """
+    Add images and their associated prediction results to the database for a specific user.
+
+    This function creates a new image record for every submitted image, with the image's URL, its 
+    prediction results, the version of the models that made them, its upload status and the 
+    associated user's ID, commits all of them in a single transaction and then hands the byte data 
+    over to the application's background upload queue. The function first looks up the user's ID based on the provided email and then gives 
+    every new image a storage key made of the user's ID and a random UUID, so keys are unique even 
+    for concurrent uploads of the same user and no image collection has to be loaded to name them. 
+    The URLs are known before the uploads happen, so the request does not wait for the 
+    storage backend; the upload workers later mark the records as 'uploaded' or 'failed'. If an 
+    already uploaded image with the same content is given for a submission, its stored object is 
+    reused and nothing is uploaded.
+
+    Args:
+        email (str): The email address of the user to whom the images will be associated.
+        submitted_images (list): A list of (image_byte_data, predicted_values, reused_image) tuples, 
+                                 where 'reused_image' is an uploaded image record whose stored 
+                                 object should be reused, or None.
+
+    Returns:
+        list: The new image records committed to the database, in the order of submission.
+    """
+    user_id = db.session.query(User.id).filter_by(email = email).scalar()
+    new_images = []
+    pending_uploads = []
+    for image_byte_data, predicted_values, reused_image in submitted_images:
+        if reused_image is not None:
+            new_image = Image(url = reused_image.url,
+                        storage_key = reused_image.storage_key,
+                        prediction = predicted_values,
+                        predicted_class = get_predicted_class(predicted_values),
+                        models_version = current_app.models_version,
+                        upload_status = 'uploaded',
+                        user_id = user_id)
+        else:
+            storage_key = generate_storage_key(user_id)
+            new_image = Image(url = current_app.storage.get_url(storage_key),
+                        storage_key = storage_key,
+                        prediction = predicted_values,
+                        predicted_class = get_predicted_class(predicted_values),
+                        models_version = current_app.models_version,
+                        upload_status = 'pending',
+                        user_id = user_id)
+            pending_uploads.append((new_image, image_byte_data))
+        db.session.add(new_image)
+        new_images.append(new_image)
+    with current_app.pipeline_metrics.time_stage('database_commit'):
+        db.session.commit()
+    for new_image, image_byte_data in pending_uploads:
+        current_app.upload_queue.enqueue(new_image.id, image_byte_data.getvalue(), new_image.storage_key)
+    return new_images
+
+def add_image_for_user(email, image_byte_data, predicted_values, reused_image=None):
     """
     Add an image and its associated prediction results to the database for a specific user.
 
-    This function uploads the provided image byte data to an S3 bucket and creates a new 
-    image record in the database with the image's URL, its prediction results, and the 
-    associated user's ID. The function first retrieves the user based on the provided email, 
-    calculates the number of images already associated with the user to generate a unique 
-    file name for the new image, and then uploads the image. After the image is successfully 
-    uploaded, a new record for the image is created in the database including the URL and 
-    prediction results.
+    This is the single image variant of 'add_images_for_user'.
 
     Args:
         email (str): The email address of the user to whom the image will be associated.
         image_byte_data: The byte data of the image to be uploaded.
-        predicted_values: The prediction results to be associated with the image. This should be 
-                          a data structure (like a dictionary or list) that can be converted to 
-                          a string format.
+        predicted_values (dict): The prediction results to be associated with the image, with 
+                                 'binary' and 'multiclass' lists of probabilities.
+        reused_image (Image): An uploaded image record whose stored object should be reused 
+                              instead of uploading the byte data again.
 
     Returns:
-        None: This function does not return a value but commits the new image record to the database.
+        Image: The new image record committed to the database.
     """
-    user = User.query.filter_by(email = email).first()
-    number_of_user_images = len(user.images)
-    url = upload_to_s3(image_byte_data, f'user_{user.id}_image_{number_of_user_images}.jpg')
-    new_image = Image(url = url,
-                jsonified_prediction = predicted_values.__str__(),
-                user_id = user.id)
-    db.session.add(new_image)
-    db.session.commit()
+    return add_images_for_user(email, [(image_byte_data, predicted_values, reused_image)])[0]
+
+def look_up_cached_prediction(image_byte_data):
+    """
+    Look up the prediction of an uploaded image in the prediction cache.
+
+    The cache is looked up by the hash of the image bytes and the current models version. A hit 
+    whose image has been uploaded successfully also returns that image record, so that its stored 
+    object can be reused instead of uploading a duplicate.
+
+    Args:
+        image_byte_data: The byte data of the image file.
+
+    Returns:
+        tuple: A tuple containing the cache key (None if the cache is disabled), the cached 
+               predictions (None on a miss) and the reusable image record (None if there is none).
+    """
+    prediction_cache = current_app.prediction_cache
+    if prediction_cache is None:
+        return (None, None, None)
+    cache_key = prediction_cache.get_key(image_byte_data.getvalue())
+    cached = prediction_cache.get(cache_key)
+    if cached is None:
+        return (cache_key, None, None)
+    cached_image = db.session.get(Image, cached['image_id'])
+    if cached_image is not None and cached_image.upload_status == 'uploaded':
+        return (cache_key, cached['prediction'], cached_image)
+    return (cache_key, cached['prediction'], None)
+
+def predict_and_store_image(email, image, image_byte_data):
+    """
+    Predict the classification of an uploaded image and store it for the user, using the prediction cache.
+
+    On a cache hit inference is skipped, and if the cached image has been uploaded successfully its 
+    stored object is reused. Otherwise the image is classified with 'predict_image', stored with 
+    'add_image_for_user' and the result is cached.
+
+    Args:
+        email (str): The email address of the user submitting the image.
+        image: The decoded image (e.g., PIL image).
+        image_byte_data: The byte data of the image file.
+
+    Returns:
+        dict: The predictions, as returned by 'predict_image'.
+    """
+    cache_key, predicted_values, reused_image = look_up_cached_prediction(image_byte_data)
+    if predicted_values is None:
+        predicted_values = predict_image(image)
+    new_image = add_image_for_user(email, image_byte_data, predicted_values, reused_image)
+    if cache_key is not None and reused_image is None:
+        current_app.prediction_cache.put(cache_key, predicted_values, new_image.id)
+    return predicted_values
+
+def predict_images_in_batch(email, image_sources):
+    """
+    Predict the classification of many uploaded images and store them for the user, yielding results as they finish.
+
+    The images are decoded and preprocessed in parallel on the application's preprocessing pool, 
+    straight into a single batch tensor. Images found in the prediction cache are stored and reported 
+    first. The remaining ones are submitted to the inference scheduler in chunks of its maximum batch 
+    size, so each model runs once per chunk, and every chunk is stored in its own transaction as soon 
+    as it finishes. An image is only reported as successful once its record is committed, so if the 
+    client disconnects partway through, every image reported so far is kept. If the inference or the 
+    storing of a chunk fails, only the images of that chunk are reported as failed and the remaining 
+    chunks are still processed.
+
+    Args:
+        email (str): The email address of the user submitting the images.
+        image_sources (list): Multipart file streams or base64 strings of the images.
+
+    Yields:
+        str: NDJSON lines. Every image produces one line with its 'index', the 'result' and either 
+             its 'prediction' or the 'reason' of the failure. The last line reports the number of 
+             'submitted' and 'stored' images and the overall 'result': 'success' if every image was 
+             stored, 'partial' if only some were and 'fail' if none was.
+    """
+    metrics = current_app.pipeline_metrics
+
+    def decode(source):
+        try:
+            with metrics.time_stage('decode'):
+                if isinstance(source, str):
+                    return transform_base64_into_image_and_byte_data(source)
+                return transform_stream_into_image_and_byte_data(source)
+        except Exception:
+            return None
+
+    def preprocess(image, out):
+        try:
+            with metrics.time_stage('transform'):
+                transform_image_into_tensor(image, out=out)
+            return True
+        except Exception:
+            return False
+
+    def store(indices):
+        new_images = add_images_for_user(email, [(decoded_images[index][1], predictions[index],
+                                                  cache_entries[index][1]) for index in indices])
+        for index, new_image in zip(indices, new_images):
+            cache_key, reused_image = cache_entries[index]
+            if cache_key is not None and reused_image is None:
+                current_app.prediction_cache.put(cache_key, predictions[index], new_image.id)
+        return len(new_images)
+
+    def store_and_report(indices, future=None):
+        try:
+            if future is not None:
+                with metrics.time_stage('inference'):
+                    predictions.update(zip(indices, future.result()))
+            stored_images = store(indices)
+        except Exception:
+            current_app.logger.exception('Classifying or storing %d images failed', len(indices))
+            db.session.rollback()
+            return 0, [json.dumps({'index': index, 'result': 'fail', 'reason': 'Image could not be classified!'}) + '\n'
+                       for index in indices]
+        return stored_images, [json.dumps({'index': index, 'result': 'success', 'prediction': predictions[index]}) + '\n'
+                               for index in indices]
+
+    executor = current_app.preprocessing_executor
+    decoded_images = list(executor.map(decode, image_sources))
+    predictions = {}
+    cache_entries = {}
+    indices_to_predict = []
+    cached_indices = []
+    stored = 0
+    for index, decoded_image in enumerate(decoded_images):
+        if decoded_image is None:
+            yield json.dumps({'index': index, 'result': 'fail', 'reason': 'Image could not be decoded!'}) + '\n'
+            continue
+        cache_key, predicted_values, reused_image = look_up_cached_prediction(decoded_image[1])
+        cache_entries[index] = (cache_key, reused_image)
+        if predicted_values is None:
+            indices_to_predict.append(index)
+        else:
+            predictions[index] = predicted_values
+            cached_indices.append(index)
+    if cached_indices:
+        stored_images, lines = store_and_report(cached_indices)
+        stored += stored_images
+        yield from lines
+
+    batch = np.empty((len(indices_to_predict),) + INPUT_SHAPE, dtype=np.float32)
+    preprocessed = list(executor.map(preprocess, [decoded_images[index][0] for index in indices_to_predict], batch))
+    valid_positions = [position for position, is_valid in enumerate(preprocessed) if is_valid]
+    for position, is_valid in enumerate(preprocessed):
+        if not is_valid:
+            yield json.dumps({'index': indices_to_predict[position], 'result': 'fail',
+                              'reason': 'Image could not be decoded!'}) + '\n'
+
+    scheduler = current_app.inference_scheduler
+    chunks = [valid_positions[start:start + scheduler.max_batch_size]
+              for start in range(0, len(valid_positions), scheduler.max_batch_size)]
+    futures = [scheduler.submit(batch[chunk]) for chunk in chunks]
+    for chunk, future in zip(chunks, futures):
+        stored_images, lines = store_and_report([indices_to_predict[position] for position in chunk], future)
+        stored += stored_images
+        yield from lines
+
+    if stored == len(image_sources):
+        result = 'success'
+    elif stored > 0:
+        result = 'partial'
+    else:
+        result = 'fail'
+    yield json.dumps({'result': result, 'submitted': len(image_sources), 'stored': stored}) + '\n'
+
+def get_models_not_ready_response():
+    """
+    Build the response of prediction endpoints called before the models are loaded.
+
+    Returns:
+        tuple or None: A JSON response with the result 'fail', the status code 503 and a
+                       'Retry-After' header, or None if the models are ready.
+    """
+    if current_app.model_loader.is_ready():
+        return None
+    return (jsonify({'result': 'fail', 'reason': 'Models are still loading!'}), 503, {'Retry-After': '5'})
 
 @endpoints.route('/', methods=['GET'])
 def info():
@@ -205,14 +552,15 @@ def login():
     process. It retrieves the user's email and password from the request form and then attempts to 
     log in the user using these credentials. The function relies on the 'attempt_user_login' function 
     to process the login logic and returns a JSON response with the result ('success' or 'fail') and 
-    the reason for failure, if any.
+    the reason for failure, if any. On success the response also contains a signed, expiring session 
+    token, which the other endpoints accept instead of the email and password.
 
     Returns:
         For GET requests:
             str: An HTML string indicating the login service.
         For POST requests:
             flask.Response: A JSON response containing the result of the login attempt ('success' or 
-                            'fail') and the reason for the result.
+                            'fail'), the reason for the result and the session token on success.
     """
     if request.method == 'GET':
         return "<h1>Python back-end server API for Tensorflow. Login service.</h1>"    
@@ -221,7 +569,29 @@ def login():
         password = request.form.get('password')
 
         login_response = attempt_user_login(email, password)
-        return jsonify({'result': login_response[0], 'reason': login_response[1]})
+        response = {'result': login_response[0], 'reason': login_response[1]}
+        if login_response[0] == 'success':
+            user = User.query.filter_by(email = email).first()
+            response['token'] = current_app.token_authenticator.issue_token(user)
+        return jsonify(response)
+
+@endpoints.route('/logout', methods=['POST'])
+def logout():
+    """
+    Handle requests to revoke a user's session tokens.
+
+    The POST request authenticates the user with a session token (or email and password) and 
+    revokes every token issued to the user so far, signing the user out on all devices.
+
+    Returns:
+        flask.Response: A JSON response containing the result of the authentication ('success' or 
+                        'fail') and the reason for the result.
+    """
+    login_response = authenticate_request()
+    if login_response[0] == 'success':
+        user = User.query.filter_by(email = login_response[2]).first()
+        current_app.token_authenticator.revoke_tokens(user)
+    return jsonify({'result': login_response[0], 'reason': login_response[1]})
 
 @endpoints.route('/predict', methods=['GET', 'POST'])
 def predict_photo():
@@ -230,11 +600,12 @@ def predict_photo():
 
     This endpoint supports two HTTP methods: GET and POST. The GET request simply returns a basic
     informational HTML page about the image prediction service. The POST request handles the image
-    prediction process. It first authenticates the user using their email and password. If the
-    authentication is successful, the function proceeds to process the image sent in the request
-    (encoded as a base64 string), predicts its classification using pre-loaded models, and saves
-    the image and prediction results for the user. The function uses 'predict_image' for making
-    predictions and 'add_image_for_user' for saving the image and prediction results. If
+    prediction process. It first authenticates the user using their session token, or their email and
+    password. If the authentication is successful, the function proceeds to process the image sent in the request
+    (as a raw image body, a multipart file part or a base64 string), predicts its classification using pre-loaded models, and saves
+    the image and prediction results for the user. The function uses 'predict_and_store_image',
+    which serves repeated images from the prediction cache and otherwise relies on 'predict_image'
+    for making predictions and 'add_image_for_user' for saving the image and prediction results. If
     authentication fails, no prediction is made.
 
     Returns:
@@ -242,25 +613,65 @@ def predict_photo():
             str: An HTML string indicating the prediction service.
         For POST requests:
             flask.Response: A JSON response containing the result of the authentication ('success' or
-            'fail') and the prediction results (empty if authentication fails).
+            'fail') and the prediction results (empty if authentication fails), or a 503 response
+            while the models are still loading.
     """
     if request.method == 'GET':
         return "<h1>Python back-end server API for Tensorflow. Prediction service.</h1>"    
     elif request.method == 'POST':
-        email = request.form.get('email')
-        password = request.form.get('password')
-
-        login_response = attempt_user_login(email, password)
+        not_ready_response = get_models_not_ready_response()
+        if not_ready_response is not None:
+            return not_ready_response
+        login_response = authenticate_request()
+        email = login_response[2]
         if login_response[0] == 'success':
-            base64_str = request.form.get('base64')
-            image, image_byte_data = transform_base64_into_image_and_byte_data(base64_str)
-            predicted_values = predict_image(image)
-            add_image_for_user(email, image_byte_data, predicted_values)
+            with current_app.pipeline_metrics.time_stage('decode'):
+                image, image_byte_data = get_request_image()
+            predicted_values = predict_and_store_image(email, image, image_byte_data)
         else:
             predicted_values = {}
         result = login_response[0]
         return jsonify({'result': result, 'prediction': predicted_values})
 
+@endpoints.route('/predict/batch', methods=['GET', 'POST'])
+def predict_photo_batch():
+    """
+    Handle batch image prediction requests for the application.
+
+    This endpoint supports two HTTP methods: GET and POST. The GET request simply returns a basic
+    informational HTML page about the batch prediction service. The POST request authenticates the
+    user once, with a session token or email and password, and then classifies every image sent in the request, either as multipart file parts
+    named 'images' or as base64 strings in repeated 'base64' form fields. The number of images is
+    limited by the 'BATCH_PREDICT_MAX_IMAGES' setting and the payload size by 'MAX_CONTENT_LENGTH'.
+    Results are streamed back as NDJSON by 'predict_images_in_batch' while the batch is processed.
+
+    Returns:
+        For GET requests:
+            str: An HTML string indicating the batch prediction service.
+        For POST requests:
+            flask.Response: An NDJSON response with one line per image followed by a summary line, or
+            a JSON response with the result 'fail' and the reason if authentication fails or the
+            request contains no or too many images, or a 503 response while the models are still loading.
+    """
+    if request.method == 'GET':
+        return "<h1>Python back-end server API for Tensorflow. Batch prediction service.</h1>"
+    elif request.method == 'POST':
+        not_ready_response = get_models_not_ready_response()
+        if not_ready_response is not None:
+            return not_ready_response
+        login_response = authenticate_request()
+        email = login_response[2]
+        if login_response[0] != 'success':
+            return jsonify({'result': login_response[0], 'reason': login_response[1]})
+        image_sources = [file.stream for file in request.files.getlist('images')] or request.form.getlist('base64')
+        if not image_sources:
+            return jsonify({'result': 'fail', 'reason': 'No images were sent!'})
+        if len(image_sources) > current_app.config['BATCH_PREDICT_MAX_IMAGES']:
+            return jsonify({'result': 'fail', 'reason': f'At most {current_app.config["BATCH_PREDICT_MAX_IMAGES"]} '
+                                                        'images can be sent at once!'})
+        return Response(stream_with_context(predict_images_in_batch(email, image_sources)),
+                        mimetype='application/x-ndjson')
+
 @endpoints.route('/history', methods=['GET', 'POST'])
 def history():
     """
@@ -268,28 +679,100 @@ def history():
 
     This endpoint supports two HTTP methods: GET and POST. The GET request simply returns a basic 
     informational HTML page about the history service. The POST request processes requests for a 
-    user's history of processed images. It first authenticates the user using their email and 
-    password. If authentication is successful, it retrieves the user's image processing history 
-    using the 'get_user_image_history' function, which returns a list of images along with their 
-    associated details and predictions. If the authentication fails, an empty history is returned.
+    user's history of processed images. It first authenticates the user using their session token, 
+    or their email and password. If authentication is successful, it retrieves a page of the user's image 
+    processing history using the 'get_user_image_history' function, which returns a list of images, newest 
+    first, along with their associated details and predictions. The optional 'limit', 'cursor', 'from', 'to' 
+    (ISO 8601 dates) and 'predictedClass' form fields select the page and filter the images. If the 
+    authentication fails, an empty history is returned.
 
     Returns:
         For GET requests:
             str: An HTML string indicating the history service.
         For POST requests:
             flask.Response: A JSON response containing the result of the authentication ('success' or 
-                            'fail') and the user's image history (empty if authentication fails).
+                            'fail'), a page of the user's image history (empty if authentication fails) 
+                            and the cursor of the next page under 'nextCursor'.
     """
     if request.method == 'GET':
         return "<h1>Python back-end server API for Tensorflow. History service.</h1>"    
     elif request.method == 'POST':
-        email = request.form.get('email')
-        password = request.form.get('password')
+        login_response = authenticate_request()
+        email = login_response[2]
+        if login_response[0] != 'success':
+            return jsonify({'result': login_response[0], 'images': [], 'nextCursor': None})
+        try:
+            limit = min(int(request.form.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)
+            cursor = int(request.form['cursor']) if request.form.get('cursor') else None
+            created_from = datetime.fromisoformat(request.form['from']) if request.form.get('from') else None
+            created_to = datetime.fromisoformat(request.form['to']) if request.form.get('to') else None
+            predicted_class = int(request.form['predictedClass']) if request.form.get('predictedClass') else None
+        except ValueError:
+            return jsonify({'result': 'fail', 'reason': 'History filters are not valid!', 'images': [], 'nextCursor': None})
+        image_history, next_cursor = get_user_image_history(email, max(limit, 1), cursor, created_from,
+                                                            created_to, predicted_class)
+        return jsonify({'result': login_response[0], 'images': image_history, 'nextCursor': next_cursor})
+
+@endpoints.route('/inference-metrics', methods=['GET'])
+def inference_metrics():
+    """
+    Report the state of the inference scheduler and the prediction cache.
 
-        login_response = attempt_user_login(email, password)
-        if login_response[0] == 'success':
-            image_history = get_user_image_history(email)
-        else:
-            image_history = {}
-        result = login_response[0]
-        return jsonify({'result': result, 'images': image_history})
+    This endpoint returns a JSON snapshot of the metrics gathered by the micro-batching 
+    inference scheduler, such as the current queue depth and the distribution of batch sizes, 
+    together with the hit and miss statistics of the prediction cache under 'prediction_cache'.
+
+    Returns:
+        flask.Response: A JSON response containing the scheduler and cache metrics, or a 503
+                        response while the models are still loading.
+    """
+    not_ready_response = get_models_not_ready_response()
+    if not_ready_response is not None:
+        return not_ready_response
+    metrics = current_app.inference_scheduler.get_metrics()
+    if current_app.prediction_cache is not None:
+        metrics['prediction_cache'] = current_app.prediction_cache.get_metrics()
+    return jsonify(metrics)
+
+@endpoints.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Export the application metrics in the Prometheus text format.
+
+    Besides request counts, durations and errors per endpoint, the export contains histograms of
+    the prediction pipeline stages ('decode', 'transform', 'inference', 'database_commit' and the
+    background 'upload'), the duration and number of calls and images of every model, and the
+    current statistics of the inference scheduler, the prediction cache and the upload queue.
+
+    Returns:
+        flask.Response: The metrics, or a 404 response if metrics are disabled.
+    """
+    if not current_app.pipeline_metrics.enabled:
+        return jsonify({'result': 'fail', 'reason': 'Metrics are disabled!'}), 404
+    body, content_type = current_app.pipeline_metrics.generate_latest()
+    return Response(body, content_type=content_type)
+
+@endpoints.route('/healthz', methods=['GET'])
+def healthz():
+    """
+    Liveness probe reporting that the process is up and serving requests.
+
+    Returns:
+        flask.Response: A JSON response with the status 'alive'.
+    """
+    return jsonify({'status': 'alive'})
+
+@endpoints.route('/readyz', methods=['GET'])
+def readyz():
+    """
+    Readiness probe reporting whether the models are loaded and warmed up.
+
+    The response includes the loading state and the duration of the completed import, load and
+    warm-up phases, so the probe also shows where startup time goes.
+
+    Returns:
+        flask.Response: A JSON response with the loading status of the models, with the status
+                        code 200 once predictions can be served and 503 before.
+    """
+    status = current_app.model_loader.get_status()
+    return jsonify(status), 200 if current_app.model_loader.is_ready() else 503
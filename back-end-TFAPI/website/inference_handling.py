@@ -0,0 +1,467 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import queue
+import time
+import tensorflow as tf
+import numpy as np
+
+from .transform_handling import INPUT_SHAPE
+
+PREDICTION_KEYS = {'binary': 'binary_model', 'multiclass': 'multiclass_model'}
+
+def get_batch_buckets(max_batch_size):
+    """
+    Compute the batch sizes for which models are traced.
+
+    Args:
+        max_batch_size (int): The largest batch size the models will be called with.
+
+    Returns:
+        list: Powers of two below 'max_batch_size', followed by 'max_batch_size' itself.
+    """
+    batch_buckets = []
+    bucket = 1
+    while bucket < max_batch_size:
+        batch_buckets.append(bucket)
+        bucket *= 2
+    batch_buckets.append(max_batch_size)
+    return batch_buckets
+
+class TracedModel:
+    """
+    A Keras model compiled into concrete 'tf.function' graphs, one per batch bucket.
+
+    Calling 'Model.predict' builds a tf.data pipeline and callback machinery on every call, which
+    dominates latency for small batches. This wrapper traces the model once for every
+    (batch bucket, height, width, channels) input signature and runs requests straight through
+    the traced graphs. Batches are zero-padded up to the nearest bucket, so no retracing happens
+    at serving time, and batches larger than the biggest bucket are split into chunks.
+
+    Attributes:
+        model (tf.keras.Model): The wrapped Keras model.
+        batch_buckets (list): Batch sizes the model is traced for, in increasing order.
+        input_shape (tuple): Shape of a single input image.
+        jit_compile (bool): Whether the graphs are compiled with XLA.
+    """
+    def __init__(self, model, batch_buckets, input_shape=INPUT_SHAPE, jit_compile=False):
+        self.model = model
+        self.batch_buckets = sorted(batch_buckets)
+        self.input_shape = tuple(input_shape)
+        self.jit_compile = jit_compile
+        self._function = tf.function(lambda inputs: self.model(inputs, training=False),
+                                     jit_compile=jit_compile)
+        self._concrete_functions = {}
+
+    def trace(self):
+        """
+        Trace the model for every batch bucket up front instead of on first use.
+        """
+        for batch_size in self.batch_buckets:
+            self._get_concrete_function(batch_size)
+
+    def predict(self, batch, verbose=0):
+        """
+        Run a batch through the traced graphs.
+
+        The signature mirrors 'tf.keras.Model.predict', so a traced model can be used wherever
+        a Keras model is expected for prediction.
+
+        Args:
+            batch (numpy.ndarray): A float32 tensor of shape (n, height, width, channels).
+            verbose (int): Ignored, kept for compatibility with 'tf.keras.Model.predict'.
+
+        Returns:
+            numpy.ndarray or dict: Model outputs for the n images, with the same structure as the
+                                   outputs of the wrapped model.
+        """
+        largest_bucket = self.batch_buckets[-1]
+        if len(batch) > largest_bucket:
+            chunks = [self.predict(batch[start:start + largest_bucket])
+                      for start in range(0, len(batch), largest_bucket)]
+            return tf.nest.map_structure(lambda *outputs: np.concatenate(outputs, axis=0), *chunks)
+        number_of_images = len(batch)
+        batch_size = next(bucket for bucket in self.batch_buckets if bucket >= number_of_images)
+        if batch_size != number_of_images:
+            padding = np.zeros((batch_size - number_of_images,) + self.input_shape, dtype=np.float32)
+            batch = np.concatenate([batch, padding], axis=0)
+        outputs = self._get_concrete_function(batch_size)(tf.constant(batch, dtype=tf.float32))
+        return tf.nest.map_structure(lambda output: output.numpy()[:number_of_images], outputs)
+
+    def _get_concrete_function(self, batch_size):
+        """
+        Return the concrete function for a batch size, tracing it on first use.
+
+        Args:
+            batch_size (int): One of the batch buckets.
+
+        Returns:
+            tf.types.experimental.ConcreteFunction: The traced graph for that batch size.
+        """
+        if batch_size not in self._concrete_functions:
+            signature = tf.TensorSpec((batch_size,) + self.input_shape, tf.float32)
+            self._concrete_functions[batch_size] = self._function.get_concrete_function(signature)
+        return self._concrete_functions[batch_size]
+
+def split_shared_backbone(model):
+    """
+    Split a sequential transfer-learning model into its backbone and its classification head.
+
+    The backbone consists of the leading layers up to and including the first nested model
+    (the ImageNet base, e.g. VGG19 or Xception), together with any preprocessing layers placed
+    before it. Everything after it forms the head.
+
+    Args:
+        model (tf.keras.Model): A loaded sequential model.
+
+    Returns:
+        tuple: A (backbone_layers, head_layers) tuple, or None if the model has no nested base
+               model or its base model is trainable.
+    """
+    for index, layer in enumerate(model.layers):
+        if isinstance(layer, tf.keras.Model):
+            if layer.trainable_weights:
+                return None
+            return (model.layers[:index + 1], model.layers[index + 1:])
+    return None
+
+def have_same_backbone(backbone_layers, other_backbone_layers):
+    """
+    Check whether two backbones are the same frozen network with identical weights.
+
+    Args:
+        backbone_layers (list): Backbone layers of the first model.
+        other_backbone_layers (list): Backbone layers of the second model.
+
+    Returns:
+        bool: True if both backbones have the same layer types, configuration and weights.
+    """
+    if len(backbone_layers) != len(other_backbone_layers):
+        return False
+    for layer, other_layer in zip(backbone_layers, other_backbone_layers):
+        if type(layer) is not type(other_layer):
+            return False
+        weights, other_weights = layer.get_weights(), other_layer.get_weights()
+        if len(weights) != len(other_weights):
+            return False
+        if any(weight.shape != other_weight.shape or not np.array_equal(weight, other_weight)
+               for weight, other_weight in zip(weights, other_weights)):
+            return False
+    return True
+
+def build_fused_model(available_models, input_shape=INPUT_SHAPE):
+    """
+    Build a single two-headed model computing the shared backbone features once.
+
+    Args:
+        available_models (dict): Models keyed by name, as stored in 'app.available_models'.
+        input_shape (tuple): Shape of a single input image.
+
+    Returns:
+        tf.keras.Model or None: A model returning a dictionary with 'binary' and 'multiclass'
+                                outputs, or None if the models do not share a frozen backbone.
+    """
+    splits = {key: split_shared_backbone(available_models[model_name])
+              for key, model_name in PREDICTION_KEYS.items()}
+    if any(split is None for split in splits.values()):
+        return None
+    backbone_layers = splits['binary'][0]
+    if not have_same_backbone(backbone_layers, splits['multiclass'][0]):
+        return None
+
+    # Both models are loaded after 'clear_session', so their layer names collide. Wrapping the
+    # backbone and every head into its own named sub-model keeps the fused model's names unique.
+    inputs = tf.keras.Input(shape=input_shape)
+    features = tf.keras.Sequential(backbone_layers, name='backbone')(inputs, training=False)
+    outputs = {key: tf.keras.Sequential(head_layers, name=f'{key}_head')(features, training=False)
+               for key, (_, head_layers) in splits.items()}
+    return tf.keras.Model(inputs, outputs, name='fused_model')
+
+class FusedPredictor:
+    """
+    Predictor running the binary and multiclass heads on top of a single shared backbone pass.
+
+    Attributes:
+        fused_model: A two-headed model (or its traced wrapper) returning a dictionary with
+                     'binary' and 'multiclass' outputs.
+        mode (str): Always 'fused'.
+    """
+    mode = 'fused'
+
+    def __init__(self, fused_model):
+        self.fused_model = fused_model
+
+    def predict(self, batch):
+        """
+        Run the batch through the fused model.
+
+        Args:
+            batch (numpy.ndarray): A float32 tensor of shape (n, height, width, channels).
+
+        Returns:
+            dict: 'binary' and 'multiclass' output arrays for the n images.
+        """
+        outputs = self.fused_model.predict(batch, verbose=0)
+        return {key: np.asarray(outputs[key]) for key in PREDICTION_KEYS}
+
+class ConcurrentPredictor:
+    """
+    Predictor running the binary and multiclass models at the same time on separate threads.
+
+    Used when the models do not share a backbone, so that the second model does not wait for
+    the first one to finish.
+
+    Attributes:
+        available_models (dict): Models (or their traced wrappers) keyed by name.
+        mode (str): Always 'concurrent'.
+    """
+    mode = 'concurrent'
+
+    def __init__(self, available_models):
+        self.available_models = available_models
+        self._executor = ThreadPoolExecutor(max_workers=len(PREDICTION_KEYS),
+                                            thread_name_prefix='model-predictor')
+
+    def predict(self, batch):
+        """
+        Run the batch through both models concurrently.
+
+        Args:
+            batch (numpy.ndarray): A float32 tensor of shape (n, height, width, channels).
+
+        Returns:
+            dict: 'binary' and 'multiclass' output arrays for the n images.
+        """
+        futures = {key: self._executor.submit(self.available_models[model_name].predict, batch, verbose=0)
+                   for key, model_name in PREDICTION_KEYS.items()}
+        return {key: np.asarray(future.result()) for key, future in futures.items()}
+
+def build_predictor(available_models, engine='traced', fuse_models=True, max_batch_size=32,
+                    jit_compile=False):
+    """
+    Build the predictor used by the inference scheduler.
+
+    If model fusion is enabled and both models share the same frozen backbone, a fused
+    two-headed model is built. Fusion only reuses layers whose weights 'have_same_backbone' found
+    identical, so its outputs match the separate models; 'tests/test_inference_handling.py'
+    verifies this numerically on small stand-in models and 'run_benchmark.py fusion' on the served
+    ones. Otherwise, e.g. when the backbones were fine-tuned, the separate models are run concurrently.
+
+    Args:
+        available_models (dict): Models keyed by name, as stored in 'app.available_models'.
+        engine (str): 'traced' to run through concrete tf.function graphs, 'keras' to run
+                      through 'Model.predict'.
+        fuse_models (bool): Whether to try building a fused two-headed model.
+        max_batch_size (int): The largest batch size the predictor will be called with.
+        jit_compile (bool): Whether traced graphs are compiled with XLA.
+
+    Returns:
+        FusedPredictor or ConcurrentPredictor: The predictor to serve requests with.
+    """
+    def prepare(model):
+        if engine != 'traced':
+            return model
+        traced_model = TracedModel(model, get_batch_buckets(max_batch_size), jit_compile=jit_compile)
+        traced_model.trace()
+        return traced_model
+
+    fused_model = build_fused_model(available_models) if fuse_models else None
+    if fused_model is not None:
+        return FusedPredictor(prepare(fused_model))
+    return ConcurrentPredictor({model_name: prepare(model) for model_name, model in available_models.items()})
+
+class InferenceScheduler:
+    """
+    Dynamic micro-batching scheduler standing between the endpoints and the loaded models.
+
+    Request threads submit their image tensors to a shared queue. A single background worker
+    thread collects pending tensors until either the maximum batch size is reached or the
+    maximum wait time since the first pending tensor has passed, runs one batched forward
+    pass through the predictor and hands every request back its own slice of the results.
+
+    Attributes:
+        predictor (FusedPredictor or ConcurrentPredictor): Predictor returning 'binary' and
+                                                           'multiclass' outputs for a batch.
+        max_batch_size (int): Maximum number of images run through a model in a single pass.
+        max_wait_time (float): Maximum time (in seconds) the first pending image waits for
+                               other requests to join its batch.
+    """
+    def __init__(self, predictor, max_batch_size=32, max_wait_time=0.005):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait_time = max_wait_time
+        self._queue = queue.Queue()
+        self._batch_buffer = np.empty((max_batch_size,) + INPUT_SHAPE, dtype=np.float32)
+        self._metrics_lock = threading.Lock()
+        self._batch_size_counts = {}
+        self._requests_served = 0
+        self._images_served = 0
+        self._worker = threading.Thread(target=self._run, name='inference-scheduler', daemon=True)
+        self._worker.start()
+
+    def submit(self, image_tensor):
+        """
+        Queue an image tensor for prediction without waiting for the result.
+
+        Args:
+            image_tensor (numpy.ndarray): A tensor of shape (n, height, width, channels).
+
+        Returns:
+            concurrent.futures.Future: A future resolving to a list of n prediction dictionaries
+                                       with 'binary' and 'multiclass' keys.
+        """
+        future = Future()
+        self._queue.put((image_tensor, future))
+        return future
+
+    def predict(self, image_tensor):
+        """
+        Predict the classification of every image in the tensor, waiting for the batch to finish.
+
+        Args:
+            image_tensor (numpy.ndarray): A tensor of shape (n, height, width, channels).
+
+        Returns:
+            list: A list of n dictionaries with 'binary' and 'multiclass' predictions.
+        """
+        return self.submit(image_tensor).result()
+
+    def warm_up(self):
+        """
+        Run a zero-filled batch of every traced batch size through the predictor.
+
+        The first call of a traced graph or TFLite interpreter allocates its buffers and
+        initializes its kernels, so warming up moves that cost from the first requests to startup.
+        """
+        for batch_size in get_batch_buckets(self.max_batch_size):
+            self.predictor.predict(np.zeros((batch_size, *INPUT_SHAPE), dtype='float32'))
+
+    def get_metrics(self):
+        """
+        Return a snapshot of the scheduler metrics.
+
+        Returns:
+            dict: Predictor mode, current queue depth, number of requests and images served,
+                  number of batches run, average batch size and a histogram of batch sizes.
+        """
+        with self._metrics_lock:
+            batches_run = sum(self._batch_size_counts.values())
+            return {'predictor_mode': self.predictor.mode,
+                    'queue_depth': self._queue.qsize(),
+                    'requests_served': self._requests_served,
+                    'images_served': self._images_served,
+                    'batches_run': batches_run,
+                    'average_batch_size': self._images_served / batches_run if batches_run else 0.0,
+                    'batch_size_counts': dict(self._batch_size_counts)}
+
+    def _collect_batch(self):
+        """
+        Block until at least one request is pending, then gather more until the batch is full
+        or the wait time runs out.
+
+        Returns:
+            list: A list of (image_tensor, future) tuples.
+        """
+        pending = [self._queue.get()]
+        number_of_images = len(pending[0][0])
+        deadline = time.monotonic() + self.max_wait_time
+        while number_of_images < self.max_batch_size:
+            remaining_time = deadline - time.monotonic()
+            if remaining_time <= 0:
+                break
+            try:
+                pending.append(self._queue.get(timeout=remaining_time))
+            except queue.Empty:
+                break
+            number_of_images += len(pending[-1][0])
+        return pending
+
+    def _assemble_batch(self, image_tensors):
+        """
+        Copy the pending tensors into the preallocated batch buffer.
+
+        Args:
+            image_tensors (list): Tensors of shape (n, height, width, channels).
+
+        Returns:
+            numpy.ndarray: A view of the batch buffer holding all images, or a newly allocated
+                           array if a single oversized submission does not fit into the buffer.
+        """
+        number_of_images = sum(len(image_tensor) for image_tensor in image_tensors)
+        if number_of_images > len(self._batch_buffer):
+            return np.concatenate(image_tensors, axis=0)
+        offset = 0
+        for image_tensor in image_tensors:
+            self._batch_buffer[offset:offset + len(image_tensor)] = image_tensor
+            offset += len(image_tensor)
+        return self._batch_buffer[:number_of_images]
+
+    def _run_batch(self, pending):
+        """
+        Run a single forward pass over the collected batch and resolve the futures.
+
+        Args:
+            pending (list): A list of (image_tensor, future) tuples.
+        """
+        try:
+            batch = self._assemble_batch([image_tensor for image_tensor, _ in pending])
+            outputs = {key: output.tolist() for key, output in self.predictor.predict(batch).items()}
+        except Exception as exception:
+            for _, future in pending:
+                future.set_exception(exception)
+            return
+        offset = 0
+        for image_tensor, future in pending:
+            future.set_result([{key: outputs[key][index] for key in outputs}
+                               for index in range(offset, offset + len(image_tensor))])
+            offset += len(image_tensor)
+        with self._metrics_lock:
+            self._batch_size_counts[len(batch)] = self._batch_size_counts.get(len(batch), 0) + 1
+            self._requests_served += len(pending)
+            self._images_served += len(batch)
+
+    def _run(self):
+        """
+        Worker thread loop collecting and running batches for the lifetime of the process.
+        """
+        while True:
+            self._run_batch(self._collect_batch())
+
+def load_inference_scheduler(settings, models_directory, print_summary=False):
+    """
+    Load the models and build the inference scheduler serving them.
+
+    Args:
+        settings (dict): Inference settings, as returned by 'get_inference_settings'.
+        models_directory (str): Directory holding the SavedModels and quantized models.
+        print_summary (bool): Whether to print the summary of the loaded Keras models.
+
+    Returns:
+        tuple: A tuple containing the loaded models keyed by name and the InferenceScheduler.
+    """
+    if settings['INFERENCE_BACKEND'].startswith('tflite-'):
+        from .quantization_handling import load_quantized_models
+        available_models = load_quantized_models(models_directory,
+                                                 settings['INFERENCE_BACKEND'].split('-', 1)[1],
+                                                 min_agreement=settings['QUANTIZATION_MIN_AGREEMENT'],
+                                                 max_batch_size=settings['INFERENCE_MAX_BATCH_SIZE'],
+                                                 max_batch_bucket=settings['QUANTIZATION_MAX_BATCH_BUCKET'],
+                                                 num_threads=settings['INFERENCE_INTRA_OP_THREADS'] or None)
+        predictor = ConcurrentPredictor(available_models)
+    else:
+        available_models = {}
+        available_models['binary_model'] = tf.keras.models.load_model(models_directory + '/model_bin')
+        tf.keras.backend.clear_session()
+        available_models['multiclass_model'] = tf.keras.models.load_model(models_directory + '/model_mul')
+        tf.keras.backend.clear_session()
+        if print_summary:
+            for model in available_models:
+                available_models[model].summary()
+        predictor = build_predictor(available_models,
+                                    engine=settings['INFERENCE_ENGINE'],
+                                    fuse_models=settings['INFERENCE_FUSE_MODELS'],
+                                    max_batch_size=settings['INFERENCE_MAX_BATCH_SIZE'],
+                                    jit_compile=settings['INFERENCE_JIT_COMPILE'])
+    scheduler = InferenceScheduler(predictor,
+                                   max_batch_size=settings['INFERENCE_MAX_BATCH_SIZE'],
+                                   max_wait_time=settings['INFERENCE_MAX_WAIT_MS'] / 1000)
+    return (available_models, scheduler)
@@ -0,0 +1,289 @@
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.connection import Listener, Client
+import multiprocessing
+import itertools
+import threading
+import queue
+import os
+import numpy as np
+
+from .transform_handling import INPUT_SHAPE
+
+IMAGE_SIZE_IN_BYTES = int(np.prod(INPUT_SHAPE)) * np.dtype(np.float32).itemsize
+
+def get_inference_server_addresses(socket_directory, workers):
+    """
+    Return the socket paths of the workers of an inference server.
+
+    Args:
+        socket_directory (str): Directory holding the Unix domain sockets.
+        workers (int): Number of worker processes.
+
+    Returns:
+        list: One socket path per worker.
+    """
+    return [os.path.join(socket_directory, f'inference-{index}.sock') for index in range(workers)]
+
+def start_inference_server(addresses, authkey, settings, models_directory):
+    """
+    Start one inference worker process per address.
+
+    Every worker loads its own copy of the models and serves batches sent by any number of web
+    worker processes, so the models are held in memory once per inference worker instead of
+    once per web worker. Workers are started with the 'spawn' method, since TensorFlow's thread
+    pools do not survive a fork.
+
+    Args:
+        addresses (list): Socket paths the workers listen on.
+        authkey (bytes): Key clients authenticate with.
+        settings (dict): Inference settings, as returned by 'get_inference_settings'.
+        models_directory (str): Directory holding the models.
+
+    Returns:
+        list: The started 'multiprocessing.Process' instances.
+    """
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for index, address in enumerate(addresses):
+        if os.path.exists(address):
+            os.unlink(address)
+        process = context.Process(target=run_inference_worker, name=f'inference-worker-{index}',
+                                  args=(address, authkey, settings, models_directory), daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
+
+def run_inference_worker(address, authkey, settings, models_directory):
+    """
+    Entry point of an inference worker process.
+
+    The worker pins TensorFlow's thread pools to the configured sizes, loads and warms up the
+    models behind its own InferenceScheduler and serves every accepted connection on its own thread, so
+    requests from different web workers are batched together.
+
+    Args:
+        address (str): Socket path to listen on.
+        authkey (bytes): Key clients authenticate with.
+        settings (dict): Inference settings, as returned by 'get_inference_settings'.
+        models_directory (str): Directory holding the models.
+    """
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(settings['INFERENCE_INTRA_OP_THREADS'])
+    tf.config.threading.set_inter_op_parallelism_threads(settings['INFERENCE_INTER_OP_THREADS'])
+    from .inference_handling import load_inference_scheduler
+    from .cache_handling import get_models_version
+    models_version = get_models_version(models_directory, settings['INFERENCE_BACKEND'])
+    available_models, scheduler = load_inference_scheduler(settings, models_directory,
+                                                           print_summary=settings['INFERENCE_PRINT_SUMMARY'])
+    scheduler.warm_up()
+
+    with Listener(address, family='AF_UNIX', authkey=authkey) as listener:
+        while True:
+            try:
+                connection = listener.accept()
+            except Exception:
+                continue
+            threading.Thread(target=serve_connection, args=(connection, scheduler, models_version),
+                             daemon=True).start()
+
+def serve_connection(connection, scheduler, models_version):
+    """
+    Serve the inference requests of a single client connection.
+
+    A request is the name of a shared memory segment and the shape of the batch stored in it;
+    the batch itself never goes through the socket. Segments are attached once and kept for the
+    lifetime of the connection. Their lifetime is managed by the client, so they are removed from
+    this process' resource tracker. A request without a segment name asks for the models version.
+
+    Args:
+        connection (multiprocessing.connection.Connection): The accepted client connection.
+        scheduler (InferenceScheduler): The scheduler running the models.
+        models_version (str): Version of the loaded models, as returned by 'get_models_version'.
+    """
+    segments = {}
+    try:
+        while True:
+            segment_name, shape = connection.recv()
+            if segment_name is None:
+                connection.send(('success', models_version))
+                continue
+            if segment_name not in segments:
+                segment = shared_memory.SharedMemory(name=segment_name)
+                resource_tracker.unregister(segment._name, 'shared_memory')
+                segments[segment_name] = segment
+            batch = np.ndarray(shape, dtype=np.float32, buffer=segments[segment_name].buf)
+            try:
+                connection.send(('success', scheduler.predict(batch)))
+            except Exception as exception:
+                connection.send(('fail', repr(exception)))
+            del batch
+    except (EOFError, OSError):
+        pass
+    finally:
+        connection.close()
+        for segment in segments.values():
+            try:
+                segment.close()
+            except BufferError:
+                pass
+
+class RemoteInferenceClient:
+    """
+    Client of an inference server, used by web workers in place of an in-process InferenceScheduler.
+
+    The client keeps a pool of channels, each made of a connection to one of the server's workers
+    and a shared memory segment large enough for 'max_batch_size' images. A prediction copies the
+    batch into the segment of a free channel and sends only its name and shape, so the image data
+    is not serialized. New channels are spread over the workers round-robin.
+
+    Attributes:
+        addresses (list): Socket paths of the server's workers.
+        max_batch_size (int): Maximum number of images sent in a single request.
+    """
+    def __init__(self, addresses, authkey, max_batch_size=32, max_pending=16):
+        self.addresses = addresses
+        self.max_batch_size = max_batch_size
+        self._authkey = authkey
+        self._address_cycle = itertools.cycle(addresses)
+        self._channels = queue.LifoQueue()
+        self._executor = ThreadPoolExecutor(max_workers=max_pending, thread_name_prefix='remote-inference')
+        self._lock = threading.Lock()
+        self._statistics = {'requests_served': 0, 'images_served': 0, 'failed_requests': 0, 'open_channels': 0}
+
+    def submit(self, image_tensor):
+        """
+        Submit a batch of preprocessed images for prediction.
+
+        Args:
+            image_tensor (numpy.ndarray): A batch of images of shape (n, *INPUT_SHAPE).
+
+        Returns:
+            concurrent.futures.Future: Resolves to a list with one prediction dictionary per image.
+        """
+        return self._executor.submit(self.predict, image_tensor)
+
+    def predict(self, image_tensor):
+        """
+        Predict a batch of preprocessed images and wait for the result.
+
+        Batches larger than 'max_batch_size' are sent in several requests.
+
+        Args:
+            image_tensor (numpy.ndarray): A batch of images of shape (n, *INPUT_SHAPE).
+
+        Returns:
+            list: One prediction dictionary per image.
+        """
+        predictions = []
+        for start in range(0, len(image_tensor), self.max_batch_size):
+            predictions.extend(self._predict_chunk(image_tensor[start:start + self.max_batch_size]))
+        with self._lock:
+            self._statistics['requests_served'] += 1
+            self._statistics['images_served'] += len(image_tensor)
+        return predictions
+
+    def close(self):
+        """
+        Close every idle channel and unlink its shared memory segment.
+
+        Registered with 'atexit' by the application, so segments do not outlive the process.
+        """
+        while True:
+            try:
+                connection, segment = self._channels.get_nowait()
+            except queue.Empty:
+                break
+            self._close_channel(connection, segment)
+        self._executor.shutdown(wait=False)
+
+    def get_models_version(self):
+        """
+        Ask the server for the version of the models it has loaded.
+
+        Returns:
+            str: The models version, as returned by 'get_models_version'.
+        """
+        connection, segment = self._acquire_channel()
+        try:
+            connection.send((None, None))
+            _, models_version = connection.recv()
+        except (EOFError, OSError):
+            self._close_channel(connection, segment)
+            raise
+        self._channels.put((connection, segment))
+        return models_version
+
+    def get_metrics(self):
+        """
+        Return the client statistics.
+
+        Returns:
+            dict: The predictor mode, number of requests and images served, failed requests and
+                  number of open channels.
+        """
+        with self._lock:
+            metrics = dict(self._statistics)
+        metrics['predictor_mode'] = 'remote'
+        metrics['server_workers'] = len(self.addresses)
+        return metrics
+
+    def _predict_chunk(self, image_tensor):
+        """
+        Send a batch of at most 'max_batch_size' images through a free channel.
+
+        Args:
+            image_tensor (numpy.ndarray): A batch of images of shape (n, *INPUT_SHAPE).
+
+        Returns:
+            list: One prediction dictionary per image.
+        """
+        connection, segment = self._acquire_channel()
+        try:
+            np.ndarray(image_tensor.shape, dtype=np.float32, buffer=segment.buf)[...] = image_tensor
+            connection.send((segment.name, image_tensor.shape))
+            status, result = connection.recv()
+        except (EOFError, OSError):
+            self._close_channel(connection, segment)
+            with self._lock:
+                self._statistics['failed_requests'] += 1
+            raise
+        self._channels.put((connection, segment))
+        if status != 'success':
+            with self._lock:
+                self._statistics['failed_requests'] += 1
+            raise RuntimeError(f'Inference server failed: {result}')
+        return result
+
+    def _acquire_channel(self):
+        """
+        Take a free channel from the pool or open a new one.
+
+        Returns:
+            tuple: The connection and the shared memory segment of the channel.
+        """
+        try:
+            return self._channels.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            address = next(self._address_cycle)
+        connection = Client(address, family='AF_UNIX', authkey=self._authkey)
+        segment = shared_memory.SharedMemory(create=True, size=self.max_batch_size * IMAGE_SIZE_IN_BYTES)
+        with self._lock:
+            self._statistics['open_channels'] += 1
+        return (connection, segment)
+
+    def _close_channel(self, connection, segment):
+        """
+        Close a broken channel and release its shared memory segment.
+
+        Args:
+            connection (multiprocessing.connection.Connection): The channel's connection.
+            segment (multiprocessing.shared_memory.SharedMemory): The channel's segment.
+        """
+        connection.close()
+        segment.close()
+        segment.unlink()
+        with self._lock:
+            self._statistics['open_channels'] -= 1
@@ -0,0 +1,346 @@
+from contextlib import contextmanager
+from flask import g, request
+import threading
+import cProfile
+import pstats
+import random
+import time
+import uuid
+import os
+
+try:
+    from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+    from prometheus_client.core import GaugeMetricFamily
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class PipelineMetrics:
+    """
+    Prometheus metrics and sampled profiling of the prediction pipeline.
+
+    Stages of the pipeline (decoding, preprocessing, inference, the database commit and the
+    background upload) are timed with 'time_stage' into a histogram labelled by stage, and every
+    model call is timed and counted by 'InstrumentedModel'. 'init_app' adds per-endpoint request
+    counts, durations and error counts, and exports the scheduler, cache and upload queue
+    statistics on every scrape. Every metric lives in the instance's own registry, so several
+    applications can exist in one process. 'prometheus_client' is optional: without it, metrics
+    are disabled and '/metrics' answers 404.
+
+    When 'profile_sample_rate' is above zero, that fraction of requests is profiled with cProfile
+    or the TensorFlow profiler and the result is written to 'profile_directory'. Both profilers are
+    process-wide, so at most one request is profiled at a time and the others are skipped. The
+    model calls run on the inference scheduler's threads rather than the request thread, so while
+    a request is profiled with cProfile, every model call is profiled as well and merged into the
+    request's profile.
+
+    Attributes:
+        enabled (bool): Whether metrics are recorded; when False every method is a no-op. Always
+                        False if 'prometheus_client' is not installed.
+        profile_sample_rate (float): Fraction of requests profiled.
+        profile_directory (str): Directory profiles are written to.
+        profiler (str): 'cprofile' or 'tensorflow'.
+        registry (prometheus_client.CollectorRegistry): Registry holding every metric, None when
+                                                        metrics are disabled.
+    """
+    def __init__(self, enabled=True, profile_sample_rate=0.0, profile_directory=None, profiler='cprofile'):
+        self.enabled = enabled and PROMETHEUS_AVAILABLE
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_directory = profile_directory
+        self.profiler = profiler
+        self.registry = None
+        self._profile_lock = threading.Lock()
+        self._model_call_profiles = None
+        if not self.enabled:
+            return
+        self.registry = CollectorRegistry()
+        self.stage_duration = Histogram('prediction_stage_duration_seconds', 'Duration of a prediction pipeline stage.',
+                                        ['stage'], buckets=STAGE_BUCKETS, registry=self.registry)
+        self.model_duration = Histogram('model_predict_duration_seconds', 'Duration of a batched model call.',
+                                        ['model'], buckets=STAGE_BUCKETS, registry=self.registry)
+        self.model_batches = Counter('model_batches', 'Batches run through a model.', ['model'], registry=self.registry)
+        self.model_images = Counter('model_images', 'Images run through a model.', ['model'], registry=self.registry)
+        self.model_errors = Counter('model_errors', 'Model calls that raised an exception.', ['model'],
+                                    registry=self.registry)
+        self.request_duration = Histogram('http_request_duration_seconds', 'Duration of a request until its response '
+                                          'is returned.', ['endpoint'], buckets=STAGE_BUCKETS, registry=self.registry)
+        self.requests = Counter('http_requests', 'Handled requests.', ['endpoint', 'method', 'status'],
+                                registry=self.registry)
+        self.request_errors = Counter('http_request_errors', 'Requests that failed with an exception or a 5xx status.',
+                                      ['endpoint', 'error'], registry=self.registry)
+        self.upload_failures = Counter('upload_failures', 'Uploads that failed after every attempt.',
+                                       registry=self.registry)
+
+    def init_app(self, app):
+        """
+        Register the request hooks of the metrics and the collector of the application statistics.
+
+        Args:
+            app (Flask): The application to instrument.
+        """
+        if not self.enabled:
+            return
+        self.registry.register(ApplicationCollector(app))
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    @contextmanager
+    def time_stage(self, stage):
+        """
+        Time the enclosed block as a stage of the prediction pipeline.
+
+        Args:
+            stage (str): Name of the stage.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_duration.labels(stage).observe(time.perf_counter() - start)
+
+    def observe_stage(self, stage, duration):
+        """
+        Record the duration of a stage timed by the caller.
+
+        Args:
+            stage (str): Name of the stage.
+            duration (float): Duration in seconds.
+        """
+        if self.enabled:
+            self.stage_duration.labels(stage).observe(duration)
+
+    @contextmanager
+    def profile_model_call(self):
+        """
+        Profile the enclosed model call if a request is being profiled with cProfile.
+
+        The profile is collected on the calling thread and merged into the profile of the sampled
+        request when that request finishes.
+        """
+        model_call_profiles = self._model_call_profiles
+        if model_call_profiles is None:
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Interpreters whose profilers are process-wide already record this thread.
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            model_call_profiles.append(profile)
+
+    def generate_latest(self):
+        """
+        Render every metric in the Prometheus text format.
+
+        Returns:
+            tuple: The rendered metrics and their content type.
+        """
+        return (generate_latest(self.registry), CONTENT_TYPE_LATEST)
+
+    def _before_request(self):
+        """
+        Start timing the request and, if it is sampled, start profiling it.
+        """
+        g.metrics_request_start = time.perf_counter()
+        if self.profile_sample_rate > 0 and random.random() < self.profile_sample_rate \
+                and self._profile_lock.acquire(blocking=False):
+            g.metrics_profile = self._start_profile()
+
+    def _after_request(self, response):
+        """
+        Count the request and record its duration.
+
+        Flask also runs this hook on the 500 response of a request failed with an unhandled
+        exception, so every request is counted here exactly once; its errors are counted in
+        '_teardown_request'.
+
+        Args:
+            response (flask.Response): The response of the request.
+
+        Returns:
+            flask.Response: The unchanged response.
+        """
+        endpoint = request.endpoint or 'unknown'
+        self.requests.labels(endpoint, request.method, str(response.status_code)).inc()
+        self.request_duration.labels(endpoint).observe(time.perf_counter() - g.metrics_request_start)
+        g.metrics_status_code = response.status_code
+        return response
+
+    def _teardown_request(self, exception):
+        """
+        Count requests failed with an unhandled exception or a 5xx status and finish the profile
+        of sampled requests.
+
+        Args:
+            exception (Exception or None): The unhandled exception of the request.
+        """
+        status_code = g.pop('metrics_status_code', 0)
+        if exception is not None:
+            self.request_errors.labels(request.endpoint or 'unknown', type(exception).__name__).inc()
+        elif status_code >= 500:
+            self.request_errors.labels(request.endpoint or 'unknown', f'http_{status_code}').inc()
+        profile = g.pop('metrics_profile', None)
+        if profile is not None:
+            try:
+                self._stop_profile(profile, request.endpoint or 'unknown')
+            finally:
+                self._profile_lock.release()
+
+    def _start_profile(self):
+        """
+        Start the configured profiler.
+
+        Returns:
+            cProfile.Profile or str: The running cProfile profile, or the TensorFlow trace directory.
+        """
+        if self.profiler == 'tensorflow':
+            import tensorflow as tf
+            trace_directory = os.path.join(self.profile_directory, f'tensorflow-{uuid.uuid4().hex}')
+            tf.profiler.experimental.start(trace_directory)
+            return trace_directory
+        self._model_call_profiles = []
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def _stop_profile(self, profile, endpoint):
+        """
+        Stop the profiler and write the profile of a sampled request, merged with the profiles of
+        the model calls run meanwhile.
+
+        Args:
+            profile (cProfile.Profile or str): The value returned by '_start_profile'.
+            endpoint (str): Endpoint of the profiled request, part of the file name.
+        """
+        if isinstance(profile, str):
+            import tensorflow as tf
+            tf.profiler.experimental.stop()
+            return
+        profile.disable()
+        model_call_profiles, self._model_call_profiles = self._model_call_profiles, None
+        statistics = pstats.Stats(profile)
+        for model_call_profile in model_call_profiles:
+            statistics.add(model_call_profile)
+        os.makedirs(self.profile_directory, exist_ok=True)
+        statistics.dump_stats(os.path.join(self.profile_directory,
+                                        f'{endpoint.replace(".", "-")}-{int(time.time())}-{uuid.uuid4().hex[:8]}.prof'))
+
+class InstrumentedModel:
+    """
+    Wrapper of a model (or its traced or TFLite counterpart) timing and counting every 'predict' call.
+
+    While a request is profiled, the calls are profiled as well (see 'profile_model_call').
+
+    Attributes:
+        model: The wrapped model.
+        model_name (str): Label of the model in the metrics.
+        metrics (PipelineMetrics): The metrics the calls are recorded in.
+    """
+    def __init__(self, model, model_name, metrics):
+        self.model = model
+        self.model_name = model_name
+        self.metrics = metrics
+
+    def predict(self, batch, verbose=0):
+        """
+        Run a batch through the wrapped model and record the call.
+
+        Args:
+            batch (numpy.ndarray): A float32 tensor of shape (n, height, width, channels).
+            verbose (int): Passed on to the wrapped model.
+
+        Returns:
+            The outputs of the wrapped model.
+        """
+        start = time.perf_counter()
+        try:
+            with self.metrics.profile_model_call():
+                outputs = self.model.predict(batch, verbose=verbose)
+        except Exception:
+            self.metrics.model_errors.labels(self.model_name).inc()
+            raise
+        self.metrics.model_duration.labels(self.model_name).observe(time.perf_counter() - start)
+        self.metrics.model_batches.labels(self.model_name).inc()
+        self.metrics.model_images.labels(self.model_name).inc(len(batch))
+        return outputs
+
+def instrument_predictor(predictor, metrics):
+    """
+    Wrap the models of a predictor so that every model call is recorded.
+
+    Args:
+        predictor (FusedPredictor or ConcurrentPredictor): The predictor of the inference scheduler.
+        metrics (PipelineMetrics): The metrics the calls are recorded in.
+    """
+    if not metrics.enabled:
+        return
+    if predictor.mode == 'fused':
+        predictor.fused_model = InstrumentedModel(predictor.fused_model, 'fused_model', metrics)
+    else:
+        predictor.available_models = {model_name: InstrumentedModel(model, model_name, metrics)
+                                      for model_name, model in predictor.available_models.items()}
+
+class ApplicationCollector:
+    """
+    Prometheus collector exporting the statistics the application already keeps.
+
+    The scheduler, prediction cache and upload queue statistics are read on every scrape, so they
+    cost nothing between scrapes. Numeric scheduler and cache statistics are exported as gauges
+    prefixed with 'inference_scheduler_' and 'prediction_cache_'.
+
+    Attributes:
+        app (Flask): The application whose statistics are exported.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    def collect(self):
+        """
+        Yield the current statistics of the application.
+
+        Yields:
+            prometheus_client.core.GaugeMetricFamily: One metric family per statistic.
+        """
+        ready = GaugeMetricFamily('models_ready', 'Whether the models are loaded and warmed up.')
+        ready.add_metric([], 1 if self.app.model_loader.is_ready() else 0)
+        yield ready
+        queue_depth = GaugeMetricFamily('upload_queue_depth', 'Uploads waiting for a worker.')
+        queue_depth.add_metric([], self.app.upload_queue.get_queue_depth())
+        yield queue_depth
+        if self.app.inference_scheduler is not None:
+            scheduler_metrics = self.app.inference_scheduler.get_metrics()
+            yield from get_gauge_families('inference_scheduler_', scheduler_metrics)
+            batch_sizes = GaugeMetricFamily('inference_scheduler_batches_by_size', 'Batches run per batch size.',
+                                            labels=['batch_size'])
+            for batch_size, count in scheduler_metrics.get('batch_size_counts', {}).items():
+                batch_sizes.add_metric([str(batch_size)], count)
+            yield batch_sizes
+        if self.app.prediction_cache is not None:
+            yield from get_gauge_families('prediction_cache_', self.app.prediction_cache.get_metrics())
+
+def get_gauge_families(prefix, statistics):
+    """
+    Convert the numeric entries of a statistics dictionary into gauge metric families.
+
+    Args:
+        prefix (str): Prefix of the metric names.
+        statistics (dict): Statistics as returned by a 'get_metrics' method.
+
+    Returns:
+        list: One GaugeMetricFamily per numeric statistic.
+    """
+    return [GaugeMetricFamily(prefix + name, f'{name.replace("_", " ").capitalize()}.', value=value)
+            for name, value in statistics.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)]
@@ -0,0 +1,223 @@
+from sqlalchemy import inspect, text
+from contextlib import contextmanager
+import json
+import ast
+import os
+
+from . import db
+
+MIGRATIONS = []
+MIGRATION_LOCK_KEY = 7362519
+
+def migration(version):
+    """
+    Register a schema migration.
+
+    Migrations bring a database created with an older version of the models up to date. They
+    are applied in order of their version, each inside its own transaction, and the version of
+    the last applied migration is stored in the 'schema_migration' table.
+
+    Args:
+        version (int): Version the database is at after the migration has been applied.
+
+    Returns:
+        callable: Decorator registering a function taking an SQLAlchemy connection.
+    """
+    def register(function):
+        MIGRATIONS.append((version, function))
+        MIGRATIONS.sort(key=lambda registered: registered[0])
+        return function
+    return register
+
+def get_latest_version():
+    """
+    Return the version of the newest registered migration.
+
+    Returns:
+        int: The latest schema version, or 0 if no migrations are registered.
+    """
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+@contextmanager
+def lock_migrations(lock_path):
+    """
+    Hold an exclusive lock while the schema is created or upgraded.
+
+    Every worker process of the application upgrades the database on startup, so the upgrade is
+    serialized: workers wait for the one holding the lock and then find the database up to date.
+    PostgreSQL databases are locked with a session-level advisory lock, which also serializes
+    workers on different hosts; other databases are locked with an advisory lock file ('fcntl'
+    on POSIX systems, 'msvcrt' on Windows, imported only when a lock file is used).
+
+    Args:
+        lock_path (str): Path of the lock file used for databases other than PostgreSQL.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as connection:
+            connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+            connection.commit()
+            try:
+                yield
+            finally:
+                connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+                connection.commit()
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+    with open(lock_path, 'a') as lock_file:
+        try:
+            import fcntl
+        except ImportError:
+            import msvcrt
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 seconds, keep waiting for the upgrading worker.
+                    continue
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            return
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def upgrade_database(lock_path):
+    """
+    Create the database schema or upgrade an existing one to the latest version.
+
+    A database without a 'user' table is new: all tables are created from the current models and
+    the database is stamped with the latest version. An existing database without the
+    'schema_migration' table was created before migrations existed and is treated as version 0.
+    The whole upgrade runs under 'lock_migrations', and the schema version is only read once the
+    lock is held. Must be called inside an application context.
+
+    Args:
+        lock_path (str): Path of the lock file used for databases other than PostgreSQL.
+    """
+    with lock_migrations(lock_path):
+        with db.engine.begin() as connection:
+            inspector = inspect(connection)
+            is_new_database = not inspector.has_table('user')
+            connection.execute(text('CREATE TABLE IF NOT EXISTS schema_migration (version INTEGER NOT NULL)'))
+            current_version = connection.execute(text('SELECT MAX(version) FROM schema_migration')).scalar()
+        if is_new_database:
+            db.create_all()
+            with db.engine.begin() as connection:
+                record_version(connection, get_latest_version())
+            return
+        for version, function in MIGRATIONS:
+            if version > (current_version or 0):
+                with db.engine.begin() as connection:
+                    function(connection)
+                    record_version(connection, version)
+        db.create_all()
+
+def record_version(connection, version):
+    """
+    Record the schema version of the database.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection of the running transaction.
+        version (int): The version to record.
+    """
+    connection.execute(text('INSERT INTO schema_migration (version) VALUES (:version)'), {'version': version})
+
+def add_column(connection, table, column, column_type):
+    """
+    Add a column to a table unless it already exists, so that migrations can be applied again
+    to a database a failed or concurrent upgrade has already partially changed.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection of the running transaction.
+        table (str): Name of the table.
+        column (str): Name of the new column.
+        column_type (str): SQL type and default of the new column.
+
+    Returns:
+        bool: True if the column was added, False if it already existed.
+    """
+    if column in {existing_column['name'] for existing_column in inspect(connection).get_columns(table)}:
+        return False
+    connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {column_type}'))
+    return True
+
+@migration(1)
+def add_image_upload_status(connection):
+    """
+    Add the 'upload_status' column to the 'image' table.
+
+    Images uploaded before this migration were uploaded synchronously, so rows with a URL are
+    marked as 'uploaded' and rows without one (failed uploads) as 'failed'.
+    """
+    if add_column(connection, 'image', 'upload_status', 'VARCHAR(16)'):
+        connection.execute(text("UPDATE image SET upload_status = CASE WHEN url IS NULL THEN 'failed' ELSE 'uploaded' END"))
+
+@migration(2)
+def add_user_token_generation(connection):
+    """
+    Add the 'token_generation' column to the 'user' table, starting every user at generation 0.
+    """
+    if add_column(connection, 'user', 'token_generation', 'INTEGER DEFAULT 0'):
+        connection.execute(text('UPDATE "user" SET token_generation = 0'))
+
+@migration(3)
+def add_structured_image_predictions(connection):
+    """
+    Store image predictions as JSON and index the columns used by history queries.
+
+    Adds the 'prediction', 'predicted_class' and 'created_at' columns to the 'image' table and 
+    converts the Python dictionary strings of the legacy 'jsonified_prediction' column into JSON 
+    and the index of the most probable multiclass class. The submission time of existing images 
+    is unknown, so their 'created_at' stays empty. The legacy column is left in place but is no 
+    longer written.
+    """
+    add_column(connection, 'image', 'prediction', 'JSON')
+    add_column(connection, 'image', 'predicted_class', 'INTEGER')
+    add_column(connection, 'image', 'created_at', 'DATETIME')
+    rows = connection.execute(text('SELECT id, jsonified_prediction FROM image WHERE jsonified_prediction IS NOT NULL '
+                                   'AND prediction IS NULL')).fetchall()
+    converted_rows = []
+    for image_id, jsonified_prediction in rows:
+        try:
+            prediction = ast.literal_eval(jsonified_prediction)
+        except (ValueError, SyntaxError):
+            continue
+        multiclass = prediction.get('multiclass') or [0]
+        converted_rows.append({'id': image_id,
+                               'prediction': json.dumps(prediction),
+                               'predicted_class': max(range(len(multiclass)), key=multiclass.__getitem__)})
+    if converted_rows:
+        connection.execute(text('UPDATE image SET prediction = :prediction, predicted_class = :predicted_class '
+                                'WHERE id = :id'), converted_rows)
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_image_user_id ON image (user_id)'))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_image_predicted_class ON image (predicted_class)'))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_image_created_at ON image (created_at)'))
+    connection.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS ix_user_email ON "user" (email)'))
+
+@migration(4)
+def add_image_storage_key(connection):
+    """
+    Add the 'storage_key' column to the 'image' table, derived from the URL of existing images.
+    """
+    add_column(connection, 'image', 'storage_key', 'VARCHAR(200)')
+    rows = connection.execute(text('SELECT id, url FROM image WHERE url IS NOT NULL AND storage_key IS NULL')).fetchall()
+    if rows:
+        connection.execute(text('UPDATE image SET storage_key = :storage_key WHERE id = :id'),
+                           [{'id': image_id, 'storage_key': url.split('/')[-1]} for image_id, url in rows])
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_image_storage_key ON image (storage_key)'))
+
+@migration(5)
+def add_image_models_version(connection):
+    """
+    Add the 'models_version' column to the 'image' table. Existing predictions were made by
+    unknown models, so their version stays empty until they are re-scored.
+    """
+    add_column(connection, 'image', 'models_version', 'VARCHAR(16)')
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_image_models_version ON image (models_version)'))
@@ -1,5 +1,6 @@
 from . import db
 from flask_login import UserMixin
+from datetime import datetime
 
 class User(db.Model, UserMixin):
     """
@@ -12,18 +13,21 @@ class User(db.Model, UserMixin):
 
     Attributes:
         id (int): A unique identifier for each user, serving as the primary key.
-        email (str): The user's email address. It is set to be unique, ensuring no two users 
-                    can share the same email.
+        email (str): The user's email address. It is set to be unique and indexed, ensuring no two 
+                    users can share the same email.
         password (str): The user's hashed password.
         first_name (str): The user's first name.
+        token_generation (int): The generation of the user's session tokens. Incrementing it revokes 
+                                every token issued before.
         images (SQLAlchemy relationship): A relationship to the 'Image' model. This represents 
                                         a one-to-many relationship, indicating that a single 
                                         user can be associated with multiple images.
     """
     id = db.Column(db.Integer, primary_key = True)
-    email = db.Column(db.String(150), unique = True)
+    email = db.Column(db.String(150), unique = True, index = True)
     password = db.Column(db.String(150))
     first_name = db.Column(db.String(150))
+    token_generation = db.Column(db.Integer, default = 0)
     images = db.relationship('Image')
 
 class Image(db.Model):
@@ -31,19 +35,55 @@ class Image(db.Model):
     A database model representing an image and its associated data in the system.
 
     This class defines the structure of the 'Image' table in the database, inheriting from 'db.Model' 
-    provided by SQLAlchemy. The model includes several fields: id, url, jsonified_prediction, and 
-    user_id, each corresponding to a column in the database table.
+    provided by SQLAlchemy. The model includes several fields: id, url, storage_key, prediction, predicted_class, 
+    models_version, upload_status, created_at and user_id, each corresponding to a column in the database table. 
+    The 'user_id', 'predicted_class' and 'created_at' columns are indexed for history queries.
 
     Attributes:
         id (int): A unique identifier for each image, serving as the primary key.
         url (str): The URL where the image is stored, typically pointing to a location in an S3 bucket 
         storage service. The string length is set to accommodate very long URLs.
-        jsonified_prediction (str): A string representation of the prediction results associated with 
-                                    the image.
+        storage_key (str): The key the image is stored under in the storage backend. Images reusing 
+                           the stored object of an identical earlier submission share its key.
+        prediction (dict): The prediction results associated with the image, stored as JSON with 
+                           'binary' and 'multiclass' lists of probabilities.
+        predicted_class (int): Index of the most probable class of the multiclass prediction.
+        models_version (str): The version of the models that made the prediction (see 'get_models_version'), 
+                              empty for predictions made before versions were recorded.
+        upload_status (str): State of the background upload of the image to the storage backend: 
+                            'pending', 'uploaded' or 'failed'.
+        created_at (datetime): The UTC time at which the image was submitted.
         user_id (int): A foreign key linking the image to a user in the 'User' table. This establishes 
                     a many-to-one relationship, indicating that each image is associated with one user.
     """
     id = db.Column(db.Integer, primary_key = True)
     url = db.Column(db.String(10000))
-    jsonified_prediction = db.Column(db.String(10000))
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
\ No newline at end of file
+    storage_key = db.Column(db.String(200), index = True)
+    prediction = db.Column(db.JSON)
+    predicted_class = db.Column(db.Integer, index = True)
+    models_version = db.Column(db.String(16), index = True)
+    upload_status = db.Column(db.String(16), default = 'pending')
+    created_at = db.Column(db.DateTime, default = datetime.utcnow, index = True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index = True)
+
+class CachedPrediction(db.Model):
+    """
+    A database model representing the persistent tier of the prediction cache.
+
+    This class defines the structure of the 'CachedPrediction' table in the database, inheriting from 
+    'db.Model' provided by SQLAlchemy. Every row maps the hash of an uploaded image, computed for a 
+    specific version of the models, to the prediction made for it and to the image record holding the 
+    already uploaded object.
+
+    Attributes:
+        key (str): The cache key, made of the image content hash and the models version.
+        models_version (str): The version of the models that made the prediction.
+        prediction (str): The JSON-encoded prediction results.
+        image_id (int): A foreign key linking the entry to the 'Image' row holding the uploaded object.
+        created_at (float): The UNIX timestamp at which the entry was stored.
+    """
+    key = db.Column(db.String(100), primary_key = True)
+    models_version = db.Column(db.String(16), index = True)
+    prediction = db.Column(db.String(10000))
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id'))
+    created_at = db.Column(db.Float)
@@ -0,0 +1,294 @@
+import threading
+import pathlib
+import time
+import json
+import os
+import tensorflow as tf
+import numpy as np
+from PIL import Image
+
+from .transform_handling import INPUT_SHAPE, transform_image_into_tensor
+from .inference_handling import get_batch_buckets
+from .cache_handling import get_models_version
+
+QUANTIZATION_VARIANTS = ('dynamic', 'float16', 'int8')
+MODEL_FILES = {'binary_model': 'model_bin', 'multiclass_model': 'model_mul'}
+REPORT_NAME = 'quantization_report.json'
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+
+def get_resident_memory(pid='self'):
+    """
+    Return the resident set size of a process.
+
+    Args:
+        pid (int or str): Id of the process, the current process by default.
+
+    Returns:
+        int: Resident memory in bytes, read from '/proc/<pid>/statm'.
+    """
+    with open(f'/proc/{pid}/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def load_sample_tensors(sample_directory, sample_size):
+    """
+    Load a sample of images from a directory tree as model-ready tensors.
+
+    Args:
+        sample_directory (str): Directory searched recursively for JPEG and PNG images.
+        sample_size (int): Maximum number of images to load.
+
+    Returns:
+        numpy.ndarray: A float32 tensor of shape (n, height, width, channels).
+    """
+    paths = sorted(path for path in pathlib.Path(sample_directory).rglob('*')
+                   if path.suffix.lower() in IMAGE_SUFFIXES)
+    if not paths:
+        raise ValueError(f'No images found in {sample_directory}')
+    rng = np.random.default_rng(0)
+    paths = rng.choice(paths, size=min(sample_size, len(paths)), replace=False)
+    tensors = np.empty((len(paths),) + INPUT_SHAPE, dtype=np.float32)
+    for index, path in enumerate(paths):
+        with Image.open(path) as image:
+            transform_image_into_tensor(image, out=tensors[index])
+    return tensors
+
+def convert_model(model, variant, calibration_tensors=None):
+    """
+    Convert a Keras model into a quantized TensorFlow Lite flatbuffer.
+
+    Args:
+        model (tf.keras.Model): The float32 model to convert.
+        variant (str): 'dynamic' for dynamic-range quantization, 'float16' for float16 weights or
+                       'int8' for full-integer quantization calibrated on 'calibration_tensors'.
+        calibration_tensors (numpy.ndarray): Representative inputs, required for 'int8'.
+
+    Returns:
+        bytes: The serialized TensorFlow Lite model. Inputs and outputs stay float32.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == 'int8':
+        if calibration_tensors is None:
+            raise ValueError('Full-integer quantization requires calibration images')
+        converter.representative_dataset = lambda: ([tensor[np.newaxis]] for tensor in calibration_tensors)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    elif variant != 'dynamic':
+        raise ValueError(f'Unknown quantization variant: {variant}')
+    return converter.convert()
+
+class TFLiteModel:
+    """
+    A quantized TensorFlow Lite model exposing the prediction interface of a Keras model.
+
+    Every interpreter holds its own tensor arena, so interpreters are only allocated for a fixed
+    set of batch buckets, as 'TracedModel' traces its graphs. Batches are zero-padded up to the
+    nearest bucket and batches larger than the biggest bucket are split into chunks, so the
+    number of arenas stays bounded whatever batch sizes the scheduler produces. Interpreters are
+    not thread-safe, so calls are serialized with a lock.
+
+    Attributes:
+        model_path (str): Path to the '.tflite' file.
+        batch_buckets (list): Batch sizes interpreters are allocated for, in increasing order.
+        num_threads (int): Number of threads used by every interpreter.
+    """
+    def __init__(self, model_path, batch_buckets=(1,), num_threads=None):
+        self.model_path = model_path
+        self.batch_buckets = sorted(batch_buckets)
+        self.num_threads = num_threads
+        self._interpreters = {}
+        self._lock = threading.Lock()
+
+    def predict(self, batch, verbose=0):
+        """
+        Run a batch through the interpreter.
+
+        Args:
+            batch (numpy.ndarray): A float32 tensor of shape (n, height, width, channels).
+            verbose (int): Ignored, kept for compatibility with 'tf.keras.Model.predict'.
+
+        Returns:
+            numpy.ndarray: Model outputs for the n images.
+        """
+        largest_bucket = self.batch_buckets[-1]
+        if len(batch) > largest_bucket:
+            return np.concatenate([self.predict(batch[start:start + largest_bucket])
+                                   for start in range(0, len(batch), largest_bucket)], axis=0)
+        number_of_images = len(batch)
+        batch_size = next(bucket for bucket in self.batch_buckets if bucket >= number_of_images)
+        if batch_size != number_of_images:
+            padding = np.zeros((batch_size - number_of_images,) + INPUT_SHAPE, dtype=np.float32)
+            batch = np.concatenate([batch, padding], axis=0)
+        with self._lock:
+            interpreter = self._get_interpreter(batch_size)
+            interpreter.set_tensor(interpreter.get_input_details()[0]['index'], batch.astype(np.float32, copy=False))
+            interpreter.invoke()
+            return interpreter.get_tensor(interpreter.get_output_details()[0]['index'])[:number_of_images].copy()
+
+    def _get_interpreter(self, batch_size):
+        """
+        Return the interpreter allocated for a batch bucket, creating it on first use.
+
+        Args:
+            batch_size (int): One of the batch buckets.
+
+        Returns:
+            tf.lite.Interpreter: An interpreter with tensors allocated for that batch size.
+        """
+        if batch_size not in self._interpreters:
+            interpreter = tf.lite.Interpreter(model_path=self.model_path, num_threads=self.num_threads)
+            interpreter.resize_tensor_input(interpreter.get_input_details()[0]['index'],
+                                            (batch_size,) + INPUT_SHAPE)
+            interpreter.allocate_tensors()
+            self._interpreters[batch_size] = interpreter
+        return self._interpreters[batch_size]
+
+def get_quantized_model_path(models_directory, model_name, variant):
+    """
+    Build the path of a quantized model file.
+
+    Args:
+        models_directory (str): Directory holding the SavedModels.
+        model_name (str): 'binary_model' or 'multiclass_model'.
+        variant (str): One of QUANTIZATION_VARIANTS.
+
+    Returns:
+        str: Path of the '.tflite' file, e.g. 'models/model_bin_int8.tflite'.
+    """
+    return os.path.join(models_directory, f'{MODEL_FILES[model_name]}_{variant}.tflite')
+
+def get_source_fingerprints(models_directory):
+    """
+    Fingerprint the float32 SavedModels quantized variants are built from.
+
+    Args:
+        models_directory (str): Directory holding the SavedModels.
+
+    Returns:
+        dict: The 'get_models_version' of every SavedModel directory, keyed by model name.
+    """
+    return {model_name: get_models_version(os.path.join(models_directory, model_file))
+            for model_name, model_file in MODEL_FILES.items()}
+
+def evaluate_variant(float_models, models_directory, variant, evaluation_tensors, batch_size=8):
+    """
+    Measure size, memory, latency and agreement of a quantized variant against float32 models.
+
+    Args:
+        float_models (dict): Float32 Keras models keyed by name.
+        models_directory (str): Directory holding the quantized model files.
+        variant (str): One of QUANTIZATION_VARIANTS.
+        evaluation_tensors (numpy.ndarray): Images used to compare predictions.
+        batch_size (int): Batch size used while evaluating.
+
+    Returns:
+        dict: Per-model file size, resident memory increase, mean batch latency and top-1
+              agreement with the float32 predictions.
+    """
+    report = {}
+    for model_name, float_model in float_models.items():
+        memory_before = get_resident_memory()
+        quantized_model = TFLiteModel(get_quantized_model_path(models_directory, model_name, variant),
+                                      batch_buckets=[batch_size])
+        quantized_model.predict(evaluation_tensors[:batch_size])
+        resident_memory = get_resident_memory() - memory_before
+
+        agreements = 0
+        latencies = []
+        for start in range(0, len(evaluation_tensors), batch_size):
+            batch = evaluation_tensors[start:start + batch_size]
+            expected = float_model.predict(batch, verbose=0)
+            started = time.perf_counter()
+            actual = quantized_model.predict(batch)
+            latencies.append(time.perf_counter() - started)
+            agreements += int(np.sum(np.argmax(expected, axis=1) == np.argmax(actual, axis=1)))
+        report[model_name] = {
+            'size_bytes': os.path.getsize(quantized_model.model_path),
+            'resident_memory_bytes': resident_memory,
+            'mean_batch_latency_ms': float(np.mean(latencies) * 1000),
+            'top1_agreement': agreements / len(evaluation_tensors)}
+    return report
+
+def quantize_models(float_models, models_directory, calibration_tensors, evaluation_tensors,
+                    min_agreement=0.99, variants=QUANTIZATION_VARIANTS):
+    """
+    Produce, evaluate and approve quantized variants of the binary and multiclass models.
+
+    Every variant is converted, written next to the SavedModels and evaluated against the
+    float32 models. A variant is only marked as activatable if the top-1 agreement of every
+    model reaches 'min_agreement'. The report, together with the fingerprints of the SavedModels
+    the variants were built from, is written to 'quantization_report.json' in the models
+    directory, where 'load_quantized_models' checks it before serving.
+
+    Args:
+        float_models (dict): Float32 Keras models keyed by name.
+        models_directory (str): Directory holding the SavedModels.
+        calibration_tensors (numpy.ndarray): Representative images for full-integer calibration.
+        evaluation_tensors (numpy.ndarray): Images used to compare predictions.
+        min_agreement (float): Minimum top-1 agreement required to activate a variant.
+        variants (tuple): Variants to produce.
+
+    Returns:
+        dict: The report, keyed by variant.
+    """
+    report = {'float32': {model_name: {'size_bytes': sum(path.stat().st_size for path in
+                                                         pathlib.Path(models_directory, MODEL_FILES[model_name]).rglob('*')
+                                                         if path.is_file())}
+                          for model_name in float_models}}
+    for variant in variants:
+        for model_name, float_model in float_models.items():
+            with open(get_quantized_model_path(models_directory, model_name, variant), 'wb') as model_file:
+                model_file.write(convert_model(float_model, variant, calibration_tensors))
+        report[variant] = {'models': evaluate_variant(float_models, models_directory, variant, evaluation_tensors)}
+        report[variant]['activatable'] = all(model_report['top1_agreement'] >= min_agreement
+                                             for model_report in report[variant]['models'].values())
+    report['min_agreement'] = min_agreement
+    report['source_fingerprints'] = get_source_fingerprints(models_directory)
+    with open(os.path.join(models_directory, REPORT_NAME), 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+    return report
+
+def load_quantized_models(models_directory, variant, min_agreement=0.99, max_batch_size=32, max_batch_bucket=8,
+                          num_threads=None):
+    """
+    Load an approved quantized variant of the binary and multiclass models.
+
+    Args:
+        models_directory (str): Directory holding the quantized models and their report.
+        variant (str): One of QUANTIZATION_VARIANTS.
+        min_agreement (float): Minimum top-1 agreement required to activate the variant.
+        max_batch_size (int): The largest batch size the models will be called with; interpreters
+                              are allocated for the buckets of 'get_batch_buckets'.
+        max_batch_bucket (int): The largest batch bucket an interpreter is allocated for. Every
+                                bucket holds its own arena, so larger batches are run in chunks of
+                                this size instead of allocating arenas for the biggest buckets.
+        num_threads (int): Number of threads used by every interpreter.
+
+    Returns:
+        dict: TFLiteModel instances keyed by name, as stored in 'app.available_models'.
+
+    Raises:
+        RuntimeError: If the variant has not been evaluated, was built from other SavedModels than
+                      the current ones or its agreement with the float32 models falls below
+                      'min_agreement'.
+    """
+    report_path = os.path.join(models_directory, REPORT_NAME)
+    if not os.path.exists(report_path):
+        raise RuntimeError(f'No quantization report found in {models_directory}, run quantize_models.py first')
+    with open(report_path) as report_file:
+        report = json.load(report_file)
+    if report.get('source_fingerprints') != get_source_fingerprints(models_directory):
+        raise RuntimeError(f'The quantization report in {models_directory} was made for other models, '
+                           'run quantize_models.py again')
+    variant_report = report.get(variant)
+    if variant_report is None:
+        raise RuntimeError(f'Quantized variant {variant} has not been evaluated')
+    for model_name, model_report in variant_report['models'].items():
+        if model_report['top1_agreement'] < min_agreement:
+            raise RuntimeError(f'Quantized variant {variant} of {model_name} agrees with the float32 model '
+                               f'on {model_report["top1_agreement"]:.2%} of images, below {min_agreement:.2%}')
+    return {model_name: TFLiteModel(get_quantized_model_path(models_directory, model_name, variant),
+                                    batch_buckets=get_batch_buckets(min(max_batch_size, max_batch_bucket)),
+                                    num_threads=num_threads)
+            for model_name in MODEL_FILES}
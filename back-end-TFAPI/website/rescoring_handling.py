@@ -0,0 +1,183 @@
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image as PILImage
+from sqlalchemy import or_
+from io import BytesIO
+import numpy as np
+import json
+import time
+import os
+
+from . import db
+from .models import Image
+from .endpoints import get_predicted_class
+from .transform_handling import transform_image_into_tensor, INPUT_SHAPE
+
+def load_checkpoint(checkpoint_path, models_version):
+    """
+    Read the checkpoint of an interrupted re-scoring run.
+
+    A checkpoint is only resumed if it was written for the same models version; a run with other
+    models starts from the beginning, since every image has to be re-scored again.
+
+    Args:
+        checkpoint_path (str): Path of the checkpoint file, or None.
+        models_version (str): Version of the models the images are re-scored with.
+
+    Returns:
+        dict: The ID of the last re-scored image and the counts of re-scored and failed images.
+    """
+    checkpoint = {'models_version': models_version, 'last_id': 0, 'rescored': 0, 'failed': 0}
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return checkpoint
+    with open(checkpoint_path) as checkpoint_file:
+        saved_checkpoint = json.load(checkpoint_file)
+    if saved_checkpoint.get('models_version') == models_version:
+        checkpoint.update(saved_checkpoint)
+    return checkpoint
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    """
+    Write the checkpoint of a re-scoring run.
+
+    The file is written under a temporary name and renamed, so an interrupted run never leaves a
+    partially written checkpoint behind.
+
+    Args:
+        checkpoint_path (str): Path of the checkpoint file, or None to skip checkpointing.
+        checkpoint (dict): The checkpoint as returned by 'load_checkpoint'.
+    """
+    if checkpoint_path is None:
+        return
+    temporary_path = f'{checkpoint_path}.tmp'
+    with open(temporary_path, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(temporary_path, checkpoint_path)
+
+def get_image_chunk(last_id, chunk_size, stale_version=None):
+    """
+    Read the next chunk of stored images in the order of their IDs.
+
+    Chunks are paginated by the last seen ID instead of an offset, so reading a chunk costs the
+    same anywhere in the archive and images added during the run do not shift later chunks. Only
+    the ID and storage key are selected, so no image record is kept in the session.
+
+    Args:
+        last_id (int): ID of the last image of the previous chunk.
+        chunk_size (int): Maximum number of images in the chunk.
+        stale_version (str): If given, only images not predicted by this models version are read.
+
+    Returns:
+        list: (id, storage_key) rows of uploaded images.
+    """
+    query = db.session.query(Image.id, Image.storage_key).filter(Image.id > last_id,
+                                                                 Image.upload_status == 'uploaded',
+                                                                 Image.storage_key.isnot(None))
+    if stale_version is not None:
+        query = query.filter(or_(Image.models_version.is_(None), Image.models_version != stale_version))
+    return query.order_by(Image.id).limit(chunk_size).all()
+
+def fetch_image_chunk(fetch_executor, storage, rows):
+    """
+    Start downloading the stored objects of a chunk.
+
+    Images sharing a stored object (see 'add_images_for_user') are downloaded once.
+
+    Args:
+        fetch_executor (ThreadPoolExecutor): Pool the downloads run on.
+        storage (S3Storage or FileSystemStorage): The storage backend of the application.
+        rows (list): (id, storage_key) rows as returned by 'get_image_chunk'.
+
+    Returns:
+        dict: A future resolving to the byte data of every storage key of the chunk.
+    """
+    downloads = {}
+    for _, storage_key in rows:
+        if storage_key not in downloads:
+            downloads[storage_key] = fetch_executor.submit(storage.download, storage_key)
+    return downloads
+
+def rescore_images(app, chunk_size=128, fetch_workers=8, preprocess_workers=None, checkpoint_path=None,
+                   only_stale=False, on_chunk=None):
+    """
+    Re-score the stored image archive with the currently loaded models.
+
+    Images are read from the database in chunks of 'chunk_size'. While a chunk is decoded,
+    preprocessed and scored, the stored objects of the next chunk are already being downloaded
+    through the application's storage backend, so fetching overlaps with inference. Every chunk
+    is decoded on a pool of workers straight into a single preallocated batch tensor and
+    submitted to the inference scheduler in slices of its maximum batch size. The new
+    predictions are then written, tagged with the models version, in one bulk update per chunk,
+    after which the checkpoint is advanced. At most two chunks of image data and one batch
+    tensor are held at any time, so memory does not grow with the size of the archive.
+
+    Images whose object cannot be downloaded or decoded keep their previous prediction and are
+    counted as failed; with 'only_stale' a later run retries them.
+
+    Args:
+        app (Flask): The application, with its models loaded. Must be called inside its context.
+        chunk_size (int): Number of images read, scored and committed together.
+        fetch_workers (int): Number of concurrent downloads.
+        preprocess_workers (int): Number of decoding workers, the number of CPUs if omitted.
+        checkpoint_path (str): File the progress is written to after every chunk and resumed
+                               from. The run cannot be resumed if omitted.
+        only_stale (bool): Whether to skip images already predicted by the current models version.
+        on_chunk (callable): Optional function called with the progress report after every chunk.
+
+    Returns:
+        dict: The models version, the ID of the last re-scored image, the number of re-scored
+              and failed images (including previous runs resumed from), and the throughput of
+              this run.
+    """
+    models_version = app.models_version
+    scheduler = app.inference_scheduler
+    checkpoint = load_checkpoint(checkpoint_path, models_version)
+    resumed_from = checkpoint['last_id']
+    stale_version = models_version if only_stale else None
+    batch = np.empty((chunk_size,) + INPUT_SHAPE, dtype=np.float32)
+    images_processed = 0
+    start = time.perf_counter()
+
+    def preprocess(slot, downloads, storage_key):
+        try:
+            image = PILImage.open(BytesIO(downloads[storage_key].result()))
+            transform_image_into_tensor(image, out=batch[slot])
+            return True
+        except Exception:
+            return False
+
+    with ThreadPoolExecutor(max_workers=fetch_workers) as fetch_executor, \
+            ThreadPoolExecutor(max_workers=preprocess_workers or os.cpu_count()) as preprocess_executor:
+        rows = get_image_chunk(checkpoint['last_id'], chunk_size, stale_version)
+        downloads = fetch_image_chunk(fetch_executor, app.storage, rows)
+        while rows:
+            next_rows = get_image_chunk(rows[-1].id, chunk_size, stale_version)
+            next_downloads = fetch_image_chunk(fetch_executor, app.storage, next_rows)
+
+            decoded = list(preprocess_executor.map(preprocess, range(len(rows)), [downloads] * len(rows),
+                                                   [storage_key for _, storage_key in rows]))
+            predictions = []
+            for future in [scheduler.submit(batch[offset:offset + scheduler.max_batch_size])
+                           for offset in range(0, len(rows), scheduler.max_batch_size)]:
+                predictions.extend(future.result())
+
+            updates = [{'id': image_id,
+                        'prediction': predicted_values,
+                        'predicted_class': get_predicted_class(predicted_values),
+                        'models_version': models_version}
+                       for (image_id, _), predicted_values, is_decoded in zip(rows, predictions, decoded)
+                       if is_decoded]
+            db.session.bulk_update_mappings(Image, updates)
+            db.session.commit()
+
+            checkpoint['last_id'] = rows[-1].id
+            checkpoint['rescored'] += len(updates)
+            checkpoint['failed'] += len(rows) - len(updates)
+            save_checkpoint(checkpoint_path, checkpoint)
+            images_processed += len(rows)
+            if on_chunk is not None:
+                on_chunk(dict(checkpoint))
+            rows, downloads = next_rows, next_downloads
+
+    elapsed = time.perf_counter() - start
+    return dict(checkpoint, resumed_from=resumed_from, images_processed=images_processed, elapsed_s=elapsed,
+                images_per_second=images_processed / elapsed if elapsed else 0.0)
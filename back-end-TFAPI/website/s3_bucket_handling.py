@@ -1,26 +1,347 @@
+from botocore.config import Config
+from datetime import datetime, timedelta
+from io import BytesIO
+import threading
+import pathlib
+import random
+import queue
+import time
 import boto3, os
 
-def upload_to_s3(image_byte_data, image_name):
+class S3Storage:
     """
-    Upload an image byte data to an Amazon S3 bucket and return the URL.
+    Storage backend keeping images in an Amazon S3 bucket.
 
-    This function uploads the provided image byte data to an Amazon S3 bucket. It requires the 
-    'boto3' library to interact with AWS S3 and expects the AWS access key and secret access 
-    key to be available in the environment variables as 'AWS_ACCESS_KEY' and 'AWS_SECRET_ACCESS_KEY'.
+    A single long-lived client is created for the backend and shared by all threads. boto3
+    clients are thread-safe and keep a pool of open connections, so uploads do not pay for a
+    new client and TLS handshake every time.
+
+    Attributes:
+        bucket (str): Name of the S3 bucket.
+        region (str): AWS region of the bucket, used to build public URLs.
+        endpoint_url (str): Endpoint of an S3-compatible stand-in, or None for Amazon S3.
+    """
+    def __init__(self, bucket, region, endpoint_url=None, max_pool_connections=10):
+        self.bucket = bucket
+        self.region = region
+        self.endpoint_url = endpoint_url
+        self.client = boto3.client('s3', aws_access_key_id=os.environ.get('AWS_ACCESS_KEY'),
+                                   aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
+                                   region_name=region, endpoint_url=endpoint_url,
+                                   config=Config(max_pool_connections=max_pool_connections))
+
+    def get_url(self, image_name):
+        """
+        Return the public URL an image is (or will be) available under.
+
+        With an 'endpoint_url', the path-style URL of the stand-in is returned.
+
+        Args:
+            image_name (str): The key of the image in the bucket.
+
+        Returns:
+            str: The URL of the image.
+        """
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.bucket}/{image_name}"
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{image_name}"
+
+    def upload(self, image_byte_data, image_name):
+        """
+        Upload image bytes to the bucket.
+
+        Args:
+            image_byte_data (bytes): The byte data of the image.
+            image_name (str): The key of the image in the bucket.
+        """
+        self.client.upload_fileobj(BytesIO(image_byte_data), self.bucket, image_name)
+
+    def download(self, image_name):
+        """
+        Download image bytes from the bucket.
+
+        Args:
+            image_name (str): The key of the image in the bucket.
+
+        Returns:
+            bytes: The byte data of the image.
+        """
+        return self.client.get_object(Bucket=self.bucket, Key=image_name)['Body'].read()
+
+class FileSystemStorage:
+    """
+    Storage backend keeping images in a local directory, used as an S3 stand-in for
+    development and testing.
+
+    Attributes:
+        root (pathlib.Path): Directory the images are written to.
+        base_url (str): Prefix of the URLs returned for stored images.
+    """
+    def __init__(self, root, base_url=None):
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.base_url = base_url or self.root.resolve().as_uri()
+
+    def get_url(self, image_name):
+        """
+        Return the URL an image is (or will be) available under.
+
+        Args:
+            image_name (str): The name of the image file.
+
+        Returns:
+            str: The URL of the image.
+        """
+        return f"{self.base_url}/{image_name}"
+
+    def upload(self, image_byte_data, image_name):
+        """
+        Write image bytes into the storage directory.
+
+        The file is written under a temporary name and renamed, so readers never see a partially
+        written image.
+
+        Args:
+            image_byte_data (bytes): The byte data of the image.
+            image_name (str): The name of the image file.
+        """
+        path = self.root / image_name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_name(f'.{path.name}.{threading.get_ident()}.tmp')
+        temporary_path.write_bytes(image_byte_data)
+        os.replace(temporary_path, path)
+
+    def download(self, image_name):
+        """
+        Read image bytes from the storage directory.
+
+        Args:
+            image_name (str): The name of the image file.
+
+        Returns:
+            bytes: The byte data of the image.
+        """
+        return (self.root / image_name).read_bytes()
+
+def create_storage(config):
+    """
+    Create the storage backend selected by the application configuration.
 
     Args:
-        image_byte_data: The byte data of the image to be uploaded.
-        image_name (str): The name to be assigned to the image file when stored in the S3 bucket.
+        config (flask.Config): Application configuration with the 'STORAGE_*' and 'S3_*' settings.
 
     Returns:
-        str or None: If the upload is successful, it returns the URL of the uploaded image. If 
-                    there's any error during the upload, it returns None.
-    """
-    image_byte_data.seek(0)
-    s3 = boto3.client('s3', aws_access_key_id=os.environ['AWS_ACCESS_KEY'],
-                      aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'])
-    try:
-        s3.upload_fileobj(image_byte_data, 'rofbusinesstestbucket', image_name)
-        return f"https://rofbusinesstestbucket.s3.eu-central-1.amazonaws.com/{image_name}"
-    except:
-        return None
+        S3Storage or FileSystemStorage: The configured storage backend.
+    """
+    if config['STORAGE_BACKEND'] == 'filesystem':
+        return FileSystemStorage(config['STORAGE_DIRECTORY'], config['STORAGE_BASE_URL'])
+    return S3Storage(config['S3_BUCKET'], config['S3_REGION'], endpoint_url=config['S3_ENDPOINT_URL'],
+                     max_pool_connections=config['UPLOAD_WORKERS'])
+
+class UploadQueue:
+    """
+    Bounded background queue uploading images to the storage backend with a pool of workers.
+
+    Requests only record the image as pending and enqueue it, so storage I/O does not delay the
+    response. The bytes of every queued image are written to a spool directory first and the
+    queue only holds the image's ID and name, so pending uploads survive a restart: on startup,
+    'recover_pending' re-enqueues every pending image whose spooled bytes still exist. Every
+    upload is retried with exponential backoff and jitter; once it succeeds or runs out of
+    attempts, the 'upload_status' of the corresponding 'Image' row is set to 'uploaded' or
+    'failed'. Enqueueing never blocks: when the queue is full, the image stays pending with its
+    bytes spooled, and the spool is scanned again through 'recover_pending' once the workers
+    have drained the queue, so a stalled storage backend cannot hold up request threads.
+
+    Uploads are idempotent (the same bytes under the same name), so an image enqueued by several
+    processes, e.g. recovered by a worker while the worker that accepted it is still running, is
+    stored correctly; an 'uploaded' status is never overwritten.
+
+    Attributes:
+        app (Flask): The application, used to open an app context for database updates.
+        storage (S3Storage or FileSystemStorage): The storage backend.
+        spool_directory (pathlib.Path): Directory holding the bytes of queued images.
+        max_attempts (int): Number of upload attempts before an image is marked as failed.
+        backoff (float): Delay in seconds before the first retry, doubled after every attempt.
+        max_pending_age (float): Age in seconds after which pending images without spooled bytes
+                                 are marked as failed by 'recover_pending'.
+        metrics (PipelineMetrics or None): Metrics recording the duration of every upload, including
+                                           retries, and the number of failed uploads.
+    """
+    def __init__(self, app, storage, spool_directory, workers=4, max_size=256, max_attempts=5, backoff=0.5,
+                 max_pending_age=3600, metrics=None):
+        self.app = app
+        self.storage = storage
+        self.spool_directory = pathlib.Path(spool_directory)
+        self.spool_directory.mkdir(parents=True, exist_ok=True)
+        self.metrics = metrics
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_pending_age = max_pending_age
+        self._queue = queue.Queue(maxsize=max_size)
+        self._overflowed = threading.Event()
+        self._recovery_lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._run, name=f'upload-worker-{index}', daemon=True)
+                         for index in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def enqueue(self, image_id, image_byte_data, image_name):
+        """
+        Spool an image and schedule its upload.
+
+        Args:
+            image_id (int): Id of the 'Image' row whose status is updated after the upload.
+            image_byte_data (bytes): The byte data of the image.
+            image_name (str): The name the image is stored under.
+
+        Returns:
+            bool: True if the upload was scheduled, False if the queue was full and the image is left
+                  pending until the spool is recovered.
+        """
+        spool_path = self.spool_directory / image_name
+        temporary_path = spool_path.with_name(f'.{spool_path.name}.{threading.get_ident()}.tmp')
+        temporary_path.write_bytes(image_byte_data)
+        os.replace(temporary_path, spool_path)
+        try:
+            self._queue.put_nowait((image_id, image_name))
+            return True
+        except queue.Full:
+            self.app.logger.warning('Upload queue is full, leaving %s pending in the spool', image_name)
+            self._overflowed.set()
+            return False
+
+    def recover_pending(self, max_pending_age=None):
+        """
+        Re-enqueue the pending uploads left behind by a previous run of the application.
+
+        Pending images whose spooled bytes still exist are enqueued again. Pending images without
+        spooled bytes (e.g. accepted by a process on another host) are left alone, unless they
+        were submitted more than 'max_pending_age' seconds ago, in which case their upload can no
+        longer happen and they are marked as failed.
+
+        Args:
+            max_pending_age (float): Age in seconds after which pending images without spooled
+                                     bytes are marked as failed, 'max_pending_age' if omitted.
+
+        Returns:
+            dict: Number of re-enqueued images and of images marked as failed.
+        """
+        from . import db
+        from .models import Image
+        if max_pending_age is None:
+            max_pending_age = self.max_pending_age
+        with self.app.app_context():
+            pending_images = db.session.query(Image.id, Image.storage_key, Image.created_at) \
+                .filter(Image.upload_status == 'pending').all()
+        oldest_recoverable = datetime.utcnow() - timedelta(seconds=max_pending_age)
+        recovered = {'enqueued': 0, 'failed': 0}
+        for image_id, image_name, created_at in pending_images:
+            if image_name is not None and (self.spool_directory / image_name).exists():
+                self._queue.put((image_id, image_name))
+                recovered['enqueued'] += 1
+            elif created_at is None or created_at < oldest_recoverable:
+                self._finish(image_id, image_name, 'failed')
+                recovered['failed'] += 1
+        return recovered
+
+    def _recover_overflow(self):
+        """
+        Re-enqueue the images left pending while the queue was full, unless a recovery is running.
+        """
+        if not self._recovery_lock.acquire(blocking=False):
+            return
+        try:
+            self.recover_pending()
+        except Exception:
+            self.app.logger.exception('Recovering the spooled uploads failed')
+        finally:
+            self._recovery_lock.release()
+
+    def get_queue_depth(self):
+        """
+        Return the number of uploads waiting for a worker.
+
+        Returns:
+            int: Current queue depth.
+        """
+        return self._queue.qsize()
+
+    def join(self):
+        """
+        Block until every enqueued upload has been processed.
+        """
+        self._queue.join()
+
+    def _upload_with_retries(self, image_byte_data, image_name):
+        """
+        Upload an image, retrying failed attempts with exponential backoff.
+
+        Args:
+            image_byte_data (bytes): The byte data of the image.
+            image_name (str): The name the image is stored under.
+
+        Returns:
+            bool: True if the upload succeeded, False if every attempt failed.
+        """
+        for attempt in range(self.max_attempts):
+            try:
+                self.storage.upload(image_byte_data, image_name)
+                return True
+            except Exception:
+                self.app.logger.warning('Upload of %s failed (attempt %d of %d)', image_name,
+                                        attempt + 1, self.max_attempts, exc_info=True)
+                if attempt + 1 < self.max_attempts:
+                    time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+        return False
+
+    def _finish(self, image_id, image_name, upload_status):
+        """
+        Record the final upload status of an image and remove its spooled bytes.
+
+        An 'uploaded' status is never overwritten, and 'failed' is only recorded for images that
+        are still pending.
+
+        Args:
+            image_id (int): Id of the 'Image' row.
+            image_name (str or None): The name the image is stored under.
+            upload_status (str): 'uploaded' or 'failed'.
+        """
+        from . import db
+        from .models import Image
+        if upload_status == 'failed' and self.metrics is not None and self.metrics.enabled:
+            self.metrics.upload_failures.inc()
+        with self.app.app_context():
+            query = db.session.query(Image).filter(Image.id == image_id)
+            if upload_status == 'uploaded':
+                query = query.filter(Image.upload_status != 'uploaded')
+            else:
+                query = query.filter(Image.upload_status == 'pending')
+            query.update({Image.upload_status: upload_status}, synchronize_session=False)
+            db.session.commit()
+        if image_name is not None:
+            (self.spool_directory / image_name).unlink(missing_ok=True)
+
+    def _run(self):
+        """
+        Worker thread loop uploading queued images and recording their upload status.
+        """
+        while True:
+            image_id, image_name = self._queue.get()
+            try:
+                try:
+                    image_byte_data = (self.spool_directory / image_name).read_bytes()
+                except FileNotFoundError:
+                    # Another process already finished this upload and removed the spooled bytes.
+                    continue
+                start = time.perf_counter()
+                upload_status = 'uploaded' if self._upload_with_retries(image_byte_data, image_name) else 'failed'
+                if self.metrics is not None:
+                    self.metrics.observe_stage('upload', time.perf_counter() - start)
+                self._finish(image_id, image_name, upload_status)
+            except Exception:
+                self.app.logger.exception('Recording the upload status of %s failed', image_name)
+            finally:
+                self._queue.task_done()
+            if self._overflowed.is_set() and self._queue.empty():
+                self._overflowed.clear()
+                threading.Thread(target=self._recover_overflow, name='upload-recovery', daemon=True).start()
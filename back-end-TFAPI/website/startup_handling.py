@@ -0,0 +1,225 @@
+import threading
+import atexit
+import time
+import os
+
+from .metrics_handling import instrument_predictor
+from .cache_handling import get_models_version
+
+def get_inference_settings():
+    """
+    Build the inference settings of the application from environment variables.
+
+    Environment Variables:
+        INFERENCE_MAX_BATCH_SIZE: Maximum number of images batched into a single forward pass
+                                  (defaults to 32).
+        INFERENCE_MAX_WAIT_MS: Maximum time in milliseconds a request waits for others to join
+                               its batch (defaults to 5).
+        INFERENCE_ENGINE: 'traced' to serve through concrete tf.function graphs traced at startup
+                          (default) or 'keras' to serve through 'Model.predict'.
+        INFERENCE_JIT_COMPILE: Set to '1' to compile the traced graphs with XLA.
+        INFERENCE_FUSE_MODELS: Set to '0' to never fuse the models into a single two-headed model,
+                               even if they share the same frozen backbone.
+        INFERENCE_BACKEND: 'tensorflow' to serve the float32 SavedModels (default), or
+                           'tflite-dynamic', 'tflite-float16' or 'tflite-int8' to serve a quantized
+                           variant produced by 'quantize_models.py'.
+        QUANTIZATION_MIN_AGREEMENT: Minimum top-1 agreement with the float32 models a quantized
+                                    variant needs to be activated (defaults to 0.99).
+        QUANTIZATION_MAX_BATCH_BUCKET: Largest batch size a TFLite interpreter is allocated for;
+                                       larger batches are run in chunks (defaults to 8).
+        INFERENCE_SERVER_ADDRESSES: Comma-separated socket paths of a running inference server
+                                    ('run_inference_server.py'). When set, the application does not
+                                    load any model and sends its batches to the server instead.
+        INFERENCE_INTRA_OP_THREADS, INFERENCE_INTER_OP_THREADS: Thread pool sizes TensorFlow is
+                                    pinned to (defaults to TensorFlow's own choice, 0).
+        INFERENCE_SERVER_CONNECT_TIMEOUT: Time in seconds web workers keep retrying to reach the
+                                          inference server on startup (defaults to 120).
+        INFERENCE_STARTUP: 'background' to load and warm up the models on a background thread
+                           while the other endpoints already serve requests (default), or
+                           'blocking' to load them before 'create_app' returns.
+        INFERENCE_PRINT_SUMMARY: Set to '1' to print the summary of the loaded Keras models.
+
+    Returns:
+        dict: Flask configuration entries for the inference settings.
+    """
+    server_addresses = os.environ.get('INFERENCE_SERVER_ADDRESSES', '')
+    return {'INFERENCE_MAX_BATCH_SIZE': int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 32)),
+            'INFERENCE_MAX_WAIT_MS': float(os.environ.get('INFERENCE_MAX_WAIT_MS', 5)),
+            'INFERENCE_ENGINE': os.environ.get('INFERENCE_ENGINE', 'traced'),
+            'INFERENCE_JIT_COMPILE': os.environ.get('INFERENCE_JIT_COMPILE', '0') == '1',
+            'INFERENCE_FUSE_MODELS': os.environ.get('INFERENCE_FUSE_MODELS', '1') == '1',
+            'INFERENCE_BACKEND': os.environ.get('INFERENCE_BACKEND', 'tensorflow'),
+            'QUANTIZATION_MIN_AGREEMENT': float(os.environ.get('QUANTIZATION_MIN_AGREEMENT', 0.99)),
+            'QUANTIZATION_MAX_BATCH_BUCKET': int(os.environ.get('QUANTIZATION_MAX_BATCH_BUCKET', 8)),
+            'INFERENCE_SERVER_ADDRESSES': [address for address in server_addresses.split(',') if address],
+            'INFERENCE_INTRA_OP_THREADS': int(os.environ.get('INFERENCE_INTRA_OP_THREADS', 0)),
+            'INFERENCE_INTER_OP_THREADS': int(os.environ.get('INFERENCE_INTER_OP_THREADS', 0)),
+            'INFERENCE_SERVER_CONNECT_TIMEOUT': float(os.environ.get('INFERENCE_SERVER_CONNECT_TIMEOUT', 120)),
+            'INFERENCE_STARTUP': os.environ.get('INFERENCE_STARTUP', 'background'),
+            'INFERENCE_PRINT_SUMMARY': os.environ.get('INFERENCE_PRINT_SUMMARY', '0') == '1'}
+
+class ModelLoader:
+    """
+    Load the models of an application and warm them up, optionally on a background thread.
+
+    TensorFlow is only imported by the loader, so an application whose models are loaded in the
+    background starts serving its other endpoints right away. Once the models are loaded and a
+    dummy batch of every traced batch size has been run through them, their calls are instrumented
+    with the application's 'pipeline_metrics' and the loader sets the application's
+    'available_models', 'inference_scheduler' and 'models_version' and reports itself as ready.
+    The models version is computed from the model files right before they are loaded, so it
+    describes the models held in memory even if the files are replaced later. The duration of the
+    import, load and warm-up phases is kept for the readiness probe.
+
+    Attributes:
+        app (Flask): The application the models are loaded for.
+        models_directory (str): Directory holding the models.
+        state (str): 'loading', 'ready' or 'failed'.
+        phases (dict): Duration in seconds of every completed phase.
+        error (str or None): Description of the error the loading failed with.
+    """
+    def __init__(self, app, models_directory):
+        self.app = app
+        self.models_directory = models_directory
+        self.state = 'loading'
+        self.phases = {}
+        self.error = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Load the models on a background thread.
+        """
+        self._thread = threading.Thread(target=self.load, name='model-loader', daemon=True)
+        self._thread.start()
+
+    def load(self, raise_errors=False):
+        """
+        Import TensorFlow, load the models, warm them up and install them into the application.
+
+        Errors are logged and recorded, leaving the application permanently not ready. When the
+        models are loaded before the application starts serving, the error is raised as well, so
+        the application fails at startup as it would without a loader.
+
+        When 'INFERENCE_SERVER_ADDRESSES' is set, no model is loaded; the loader connects to the
+        inference server instead (see 'connect').
+
+        Args:
+            raise_errors (bool): Whether to re-raise the error the loading failed with.
+        """
+        settings = self.app.config
+        try:
+            if settings['INFERENCE_SERVER_ADDRESSES']:
+                start = time.perf_counter()
+                inference_client, models_version = self.connect()
+                self.phases['connect_s'] = time.perf_counter() - start
+                self.install({}, inference_client, models_version)
+                return
+            start = time.perf_counter()
+            from .inference_handling import load_inference_scheduler
+            self.phases['import_s'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            models_version = get_models_version(self.models_directory, settings['INFERENCE_BACKEND'])
+            available_models, scheduler = load_inference_scheduler(settings, self.models_directory,
+                                                                   print_summary=settings['INFERENCE_PRINT_SUMMARY'])
+            self.phases['load_s'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            scheduler.warm_up()
+            self.phases['warmup_s'] = time.perf_counter() - start
+            instrument_predictor(scheduler.predictor, self.app.pipeline_metrics)
+        except Exception as exception:
+            self.app.logger.exception('Loading the models failed')
+            self.state = 'failed'
+            self.error = repr(exception)
+            if raise_errors:
+                raise
+            return
+        self.install(available_models, scheduler, models_version)
+
+    def connect(self, retry_interval=0.5):
+        """
+        Connect to the inference server, retrying until it accepts connections.
+
+        Web workers and the inference server are usually started together, so the server may not
+        listen yet. The connection is retried for 'INFERENCE_SERVER_CONNECT_TIMEOUT' seconds, and
+        the client's shared memory is released when the process exits.
+
+        Args:
+            retry_interval (float): Delay in seconds between two attempts.
+
+        Returns:
+            tuple: The RemoteInferenceClient and the version of the models loaded by the server.
+
+        Raises:
+            OSError: If the server could not be reached before the timeout.
+        """
+        from .inference_server import RemoteInferenceClient
+        settings = self.app.config
+        inference_client = RemoteInferenceClient(settings['INFERENCE_SERVER_ADDRESSES'],
+                                                 settings['SECRET_KEY'].encode(),
+                                                 max_batch_size=settings['INFERENCE_MAX_BATCH_SIZE'])
+        atexit.register(inference_client.close)
+        deadline = time.monotonic() + settings['INFERENCE_SERVER_CONNECT_TIMEOUT']
+        while True:
+            try:
+                return (inference_client, inference_client.get_models_version())
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(retry_interval)
+
+    def install(self, available_models, scheduler, models_version):
+        """
+        Make loaded models available to the endpoints and mark the application as ready.
+
+        The prediction cache is switched to the version of the installed models, so its entries
+        and the stored images are tagged with the same version.
+
+        Args:
+            available_models (dict): The loaded models keyed by name.
+            scheduler (InferenceScheduler or RemoteInferenceClient): The scheduler serving them.
+            models_version (str): Version of the loaded models, as returned by 'get_models_version'.
+        """
+        self.app.available_models = available_models
+        self.app.inference_scheduler = scheduler
+        self.app.models_version = models_version
+        if self.app.prediction_cache is not None:
+            with self.app.app_context():
+                self.app.prediction_cache.set_models_version(models_version)
+        self.state = 'ready'
+        self._ready.set()
+
+    def is_ready(self):
+        """
+        Return whether the models are loaded and warmed up.
+
+        Returns:
+            bool: True once predictions can be served.
+        """
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Block until the models are ready, the loading failed or the timeout runs out.
+
+        Args:
+            timeout (float or None): Maximum time to wait in seconds.
+
+        Returns:
+            bool: True if the models are ready.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.is_ready()
+
+    def get_status(self):
+        """
+        Return the loading state of the models.
+
+        Returns:
+            dict: The state, the duration of every completed phase and the error, if any.
+        """
+        return {'state': self.state, 'phases': dict(self.phases), 'error': self.error}
@@ -1,29 +1,94 @@
-import tensorflow as tf
 from PIL import Image
 import numpy as np
 from io import BytesIO
+import threading
 import base64
 
-def transform_image_into_tensor(image):
+INPUT_SHAPE = (320, 320, 3)
+_thread_buffers = threading.local()
+
+def get_thread_buffer(batch_size=1):
+    """
+    Return a float32 batch buffer owned by the calling thread.
+
+    The buffer is allocated once per thread and batch size and reused by every later call, so
+    that request threads do not allocate a new input tensor for every prediction. Its content
+    is only valid until the same thread asks for the buffer again.
+
+    Args:
+        batch_size (int): Number of images the buffer holds.
+
+    Returns:
+        numpy.ndarray: A float32 array of shape (batch_size, height, width, channels).
+    """
+    buffers = getattr(_thread_buffers, 'buffers', None)
+    if buffers is None:
+        buffers = _thread_buffers.buffers = {}
+    if batch_size not in buffers:
+        buffers[batch_size] = np.empty((batch_size,) + INPUT_SHAPE, dtype=np.float32)
+    return buffers[batch_size]
+
+def fit_image(image, target_size=INPUT_SHAPE[:2], center_crop=False):
+    """
+    Decode and resize an image to the model's input size as cheaply as possible.
+
+    For JPEG images the decoder is first switched into draft mode, which decodes the image at the
+    smallest DCT scale (1/2, 1/4 or 1/8) that is still at least as large as the target size. A
+    12 megapixel phone photo is therefore never decoded at full resolution. The reduced image is
+    then resized to the target size, optionally after cropping its center to the target aspect
+    ratio instead of squashing it.
+
+    Note that draft mode changes the given image object, so it must not have been loaded yet for
+    the reduction to take effect.
+
+    Args:
+        image: An image object in the PIL (Pillow) format.
+        target_size (tuple): Target (height, width).
+        center_crop (bool): Whether to crop the image center to the target aspect ratio before
+                            resizing.
+
+    Returns:
+        PIL.Image.Image: An RGB image of the target size.
+    """
+    height, width = target_size
+    image.draft('RGB', (width, height))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    box = None
+    if center_crop:
+        scale = min(image.width / width, image.height / height)
+        crop_width, crop_height = width * scale, height * scale
+        left, top = (image.width - crop_width) / 2, (image.height - crop_height) / 2
+        box = (left, top, left + crop_width, top + crop_height)
+    if image.size != (width, height) or box is not None:
+        image = image.resize((width, height), Image.BILINEAR, box=box, reducing_gap=2.0)
+    return image
+
+def transform_image_into_tensor(image, out=None, center_crop=False):
     """
     Transform an image into a tensor suitable for model prediction.
 
-    This function takes an image as input and performs several transformations to convert it into 
-    a format suitable for prediction by machine learning models.
+    The image is decoded at reduced scale and resized to the model's input size by 'fit_image'
+    before any conversion to floating point, so no full-resolution float copy is ever made. The
+    8-bit pixels are then normalized straight into the output buffer.
 
     Args:
         image: An image object, typically in the PIL (Pillow) format.
+        out (numpy.ndarray): Optional float32 buffer of shape (height, width, channels) or
+                             (1, height, width, channels) written in place, e.g. a slot of
+                             'get_thread_buffer'. A new array is allocated if omitted.
+        center_crop (bool): Whether to crop the image center instead of squashing it.
 
     Returns:
         numpy.ndarray: A NumPy array representing the image in tensor format. The array has the 
                     shape (1, height, width, channels) and is of data type 'float32' with values 
                     normalized to the range [0, 1].
     """
-    image = image.convert('RGB').copy()
-    image = tf.keras.utils.img_to_array(image)
-    image = np.expand_dims(image, axis=0)
-    image = image.astype('float32')/255
-    return image
+    if out is None:
+        out = np.empty((1,) + INPUT_SHAPE, dtype=np.float32)
+    pixels = np.asarray(fit_image(image, center_crop=center_crop))
+    np.divide(pixels, np.float32(255), out=out.reshape(INPUT_SHAPE), dtype=np.float32)
+    return out.reshape((1,) + INPUT_SHAPE)
 
 def transform_base64_into_image_and_byte_data(base64_str):
     """
@@ -43,4 +108,25 @@ def transform_base64_into_image_and_byte_data(base64_str):
     base64_str = base64_str.split(',')[1] if ',' in base64_str else base64_str
     image_byte_data = BytesIO(base64.b64decode(base64_str))
     image = Image.open(image_byte_data)
+    return(image, image_byte_data)
+
+def transform_stream_into_image_and_byte_data(stream):
+    """
+    Transform a binary image stream into an image object and byte data.
+
+    This function reads an image file sent as binary data, either as the raw request body or as a 
+    file part of a multipart form, straight from the stream. Unlike base64-encoded form fields, no 
+    encoded text copy of the image is held in memory: the bytes are read once into the buffer that 
+    the decoder and the storage upload share.
+
+    Args:
+        stream: A readable binary file-like object, e.g. 'request.stream' or a 'FileStorage' stream.
+
+    Returns:
+        tuple: A tuple containing two elements:
+            - image: An image object created from the stream, typically in the PIL (Pillow) format.
+            - image_byte_data: Byte data of the image, suitable for further processing or storage.
+    """
+    image_byte_data = BytesIO(stream.read())
+    image = Image.open(image_byte_data)
     return(image, image_byte_data)
\ No newline at end of file
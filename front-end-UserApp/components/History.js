@@ -10,6 +10,7 @@ import { interpretPredictionData} from '../helper_functions/MiscellaneousFunctio
  * @param {Object} props - Component props.
  * @param {boolean} props.visible - Indicates whether the history modal is visible.
  * @param {Object[]} props.data - Array of photo data to be displayed in the history.
+ * @param {Function} props.loadMore - Function loading the next page of the history when the end of the list is reached.
  * @param {Function} props.setHistoryVisible - Function to toggle the visibility of the history modal.
  * @returns {JSX.Element} - Rendered component.
  */
@@ -61,6 +62,10 @@ function History(props) {
               {/* Display enlarged item image */}
               <Image style={styles.enlargedModalItemImage} source={{uri: itemEnlarged.url}}/>
               <View style={styles.enlargedModalItemTexts}>
+                {/* Older images whose prediction could not be converted have none */}
+                {!itemEnlarged.hasPrediction &&
+                  <Text style={styles.text}> Prediction unavailable </Text>
+                }
                 {/* Display binary classification information */}
                 <Text style={styles.text}> Binary classification:</Text>
                 {Object.entries(itemEnlarged.predictedBinaryClasses)
@@ -91,11 +96,16 @@ function History(props) {
           data={props.data}
           keyExtractor={(_item, index) => `${index}`}
           numColumns={Platform.OS === 'web' ? 4 : 2}
+          onEndReached={props.loadMore}
+          onEndReachedThreshold={0.5}
           renderItem={({ item }) => {
-            // Parse prediction data and set predicted classes
-            const parsed_prediction = JSON.parse(item.prediction.replace(/'/g, '"'))
-            item.predictedBinaryClasses = interpretPredictionData(parsed_prediction.binary);
-            item.predictedMulticlassClasses = interpretPredictionData(parsed_prediction.multiclass);
+            // Parse prediction data (sent as JSON, or as a string by older back-ends) and set predicted classes
+            const parsed_prediction = typeof item.prediction === 'string'
+              ? JSON.parse(item.prediction.replace(/'/g, '"'))
+              : item.prediction;
+            item.hasPrediction = parsed_prediction != null;
+            item.predictedBinaryClasses = item.hasPrediction ? interpretPredictionData(parsed_prediction.binary) : {};
+            item.predictedMulticlassClasses = item.hasPrediction ? interpretPredictionData(parsed_prediction.multiclass) : {};
             return (
               <TouchableOpacity 
                 style={styles.historyItem} 
@@ -103,6 +113,9 @@ function History(props) {
               >
                 {/* Display image of the history item */}
                 <Image source={{ uri: item.url }} style={styles.image} />
+                {!item.hasPrediction &&
+                  <Text style={styles.text}> Prediction unavailable </Text>
+                }
                 {/* Display binary classification information */}
                 {Object.values(item.predictedBinaryClasses).map((value, index) => (
                   <Text key={index} style={styles.text}> {Object.keys(item.predictedBinaryClasses)[index]}: {value.toFixed(2)} </Text>
@@ -24,7 +24,29 @@ function App() {
   const [userEmail, setUserEmail] = useState("");
   const [userPassword, setUserPassword] = useState("");
   const [predictedClass, setPredictedClass] = useState("");
-  const [fetchedData, setFetchedData] = useState({});
+  const [fetchedData, setFetchedData] = useState([]);
+  const [historyCursor, setHistoryCursor] = useState(null);
+  const [loadingMoreHistory, setLoadingMoreHistory] = useState(false);
+
+  /**
+   * Fetch a page of the user's history, newest images first.
+   *
+   * @param {?number} cursor - Cursor returned with the previous page, or null for the first page.
+   * @returns {Promise<Object>} A Promise resolving to the response with the 'images' of the page and the 'nextCursor'.
+   */
+  const fetchHistoryPage = async (cursor) => {
+    // Construct the URL for the history API endpoint
+    const url = `https://my-engineering-project.click/api/history`;
+
+    // Create a FormData object to send email, password and the page cursor in the request body
+    var data = new FormData();
+    data.append('email', userEmail);
+    data.append('password', userPassword);
+    if (cursor !== null) {
+      data.append('cursor', `${cursor}`);
+    }
+    return fetchBackEndResources(url, data);
+  };
 
   /**
    * Show the history modal.
@@ -39,19 +61,12 @@ function App() {
     setLoadingText("Loading history...");
     setLoadingVisible(true);
 
-    // Construct the URL for the history API endpoint
-    const url = `https://my-engineering-project.click/api/history`;
-
-    // Create a FormData object to send email and password in the request body
-    var data = new FormData();
-    data.append('email', userEmail);
-    data.append('password', userPassword);
-
-    // Make a network request to the history API endpoint
-    await fetchBackEndResources(url, data)
-    // If successful, update the component state with fetched history data
+    // Request the first page of the history
+    await fetchHistoryPage(null)
+    // If successful, update the component state with fetched history data and the cursor of the next page
     .then(data => {
-      setFetchedData(Object.values(data.images));
+      setFetchedData(data.images);
+      setHistoryCursor(data.nextCursor);
       setLoadingVisible(false);
     })
     // If an error occurs during the network request, log the error message
@@ -60,6 +75,29 @@ function App() {
     });
   };
 
+  /**
+   * Append the next page of the history, if there is one and it is not being loaded already.
+   *
+   * @returns {Promise<void>} A Promise that resolves after loading the page.
+   */
+  const loadMoreHistory = async () => {
+    if (historyCursor === null || loadingMoreHistory) {
+      return;
+    }
+    setLoadingMoreHistory(true);
+    await fetchHistoryPage(historyCursor)
+    // If successful, append the page and remember the cursor of the next one
+    .then(data => {
+      setFetchedData(previousData => previousData.concat(data.images));
+      setHistoryCursor(data.nextCursor);
+    })
+    // If an error occurs during the network request, log the error message
+    .catch(error => {
+      console.log(error.message);
+    });
+    setLoadingMoreHistory(false);
+  };
+
   /**
    * Show the take photo modal and reset predicted class.
    */
@@ -143,6 +181,7 @@ function App() {
       <History
         visible={historyVisible}
         data={fetchedData}
+        loadMore={loadMoreHistory}
         setHistoryVisible={setHistoryVisible}
       />
       {/* Main content */}
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+"""
+Train the binary and multiclass lesion models and produce the SavedModels served by the back-end.
+
+Subcommands:
+    cache      Decode and resize a split directory once and write it as sharded TFRecords.
+    train      Train 'model_bin' and/or 'model_mul' and save them into the back-end's 'models'
+               directory (or '--output-dir').
+    benchmark  Compare the images per second of 'ImageDataGenerator.flow_from_directory' with
+               the 'tf.data' pipeline, from JPEGs and from the cache.
+
+A dataset directory holds a 'train' and a 'val' split. Every split either has one subdirectory of
+images per class, as used by the notebooks, or the TFRecord shards written by 'cache'.
+"""
+
+import argparse
+import json
+import time
+import os
+
+DEFAULT_OUTPUT_DIRECTORY = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                                        'back-end-TFAPI', 'models'))
+
+def cache_split(args):
+    """
+    Write a split directory as sharded TFRecords.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        dict: Number of images, number of shards and the class names.
+    """
+    from training_pipeline import write_tfrecord_shards
+    return write_tfrecord_shards(args.split_dir, args.output_dir, shard_size=args.shard_size)
+
+def train(args):
+    """
+    Train the selected models and save them as SavedModels.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        dict: Path, class names and final metrics of every trained model.
+    """
+    import tensorflow as tf
+    from training_pipeline import build_dataset, train_model, export_model
+
+    for device in tf.config.list_physical_devices('GPU'):
+        tf.config.experimental.set_memory_growth(device, True)
+    if args.mixed_precision:
+        tf.keras.mixed_precision.set_global_policy('mixed_float16')
+    if args.seed is not None:
+        tf.keras.utils.set_random_seed(args.seed)
+    dataset_directories = {'binary': args.binary_dir, 'multiclass': args.multiclass_dir}
+
+    def get_cache(task, split):
+        if args.cache == 'none':
+            return None
+        if args.cache == 'memory':
+            return ''
+        return os.path.join(args.cache, f'{task}-{split}')
+
+    results = {}
+    for task in args.tasks:
+        train_dataset, number_of_images, class_names = build_dataset(
+            os.path.join(dataset_directories[task], 'train'), task, batch_size=args.batch_size, training=True,
+            cache=get_cache(task, 'train'), seed=args.seed)
+        validation_dataset, _, _ = build_dataset(
+            os.path.join(dataset_directories[task], 'val'), task, batch_size=args.batch_size, training=False,
+            cache=get_cache(task, 'val'))
+        model, histories = train_model(task, train_dataset, validation_dataset, epochs=args.epochs,
+                                       learning_rate=args.learning_rate, fine_tune_epochs=args.fine_tune_epochs,
+                                       fine_tune_learning_rate=args.fine_tune_learning_rate,
+                                       backbone=args.backbone, head_units=args.head_units, dropout=args.dropout)
+        model_path = export_model(model, task, args.output_dir, backbone=args.backbone,
+                                  head_units=args.head_units, dropout=args.dropout)
+        if args.mixed_precision:
+            tf.keras.mixed_precision.set_global_policy('mixed_float16')
+        results[task] = {'model_path': model_path,
+                         'training_images': number_of_images,
+                         'class_names': class_names,
+                         'final_metrics': {name: values[-1] for name, values in histories[-1].items()}}
+    return results
+
+def measure_images_per_second(batches, number_of_batches):
+    """
+    Pull batches from an iterator and measure the throughput, excluding the first batch.
+
+    Args:
+        batches (iterator): Iterator yielding (images, labels) batches.
+        number_of_batches (int): Number of measured batches.
+
+    Returns:
+        dict: Number of measured images, elapsed time and images per second.
+    """
+    next(batches)
+    images = 0
+    start = time.perf_counter()
+    for _ in range(number_of_batches):
+        images += len(next(batches)[0])
+    elapsed = time.perf_counter() - start
+    return {'images': images, 'elapsed_s': elapsed, 'images_per_second': images / elapsed}
+
+def benchmark(args):
+    """
+    Compare the input pipelines on a split directory.
+
+    'ImageDataGenerator' uses the notebooks' augmentation settings. The 'tf.data' pipeline is
+    measured decoding the JPEGs every epoch, reading from a warm in-memory cache and, if
+    '--shards-dir' is given, reading TFRecord shards written by 'cache'. No model is trained, so
+    the numbers are the upper bound of what the input can feed.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        dict: Throughput of every pipeline.
+    """
+    import tensorflow as tf
+    from training_pipeline import build_dataset, IMAGE_SIZE
+
+    generator = tf.keras.preprocessing.image.ImageDataGenerator(rotation_range=90, zoom_range=0.1,
+                                                                width_shift_range=0.1, height_shift_range=0.1,
+                                                                horizontal_flip=True, vertical_flip=True,
+                                                                shear_range=10, rescale=1./255)
+    results = {'image_data_generator': measure_images_per_second(
+        generator.flow_from_directory(args.split_dir, target_size=IMAGE_SIZE, batch_size=args.batch_size,
+                                      class_mode='binary'), args.batches)}
+
+    dataset, number_of_images, _ = build_dataset(args.split_dir, 'binary', batch_size=args.batch_size)
+    results['tf_data_jpeg'] = measure_images_per_second(iter(dataset.repeat()), args.batches)
+
+    cached_dataset, _, _ = build_dataset(args.split_dir, 'binary', batch_size=args.batch_size, cache='')
+    for _ in cached_dataset:
+        pass
+    results['tf_data_cached'] = measure_images_per_second(iter(cached_dataset.repeat()), args.batches)
+
+    if args.shards_dir:
+        sharded_dataset, _, _ = build_dataset(args.shards_dir, 'binary', batch_size=args.batch_size)
+        results['tf_data_tfrecord'] = measure_images_per_second(iter(sharded_dataset.repeat()), args.batches)
+    results['split_images'] = number_of_images
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the binary and multiclass lesion models.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    cache_parser = subparsers.add_parser('cache', help='write a split directory as sharded TFRecords')
+    cache_parser.add_argument('split_dir', help='directory with one subdirectory of images per class')
+    cache_parser.add_argument('output_dir')
+    cache_parser.add_argument('--shard-size', type=int, default=1024, help='images per shard')
+    cache_parser.set_defaults(run=cache_split)
+
+    train_parser = subparsers.add_parser('train', help='train the models and save them for the back-end')
+    train_parser.add_argument('--tasks', nargs='+', choices=['binary', 'multiclass'], default=['binary', 'multiclass'])
+    train_parser.add_argument('--binary-dir', help='binary dataset with train and val splits')
+    train_parser.add_argument('--multiclass-dir', help='multiclass dataset with train and val splits')
+    train_parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIRECTORY)
+    train_parser.add_argument('--backbone', choices=['xception', 'inceptionv3', 'vgg19'],
+                              help="backbone of every trained model (defaults to each task's notebook backbone)")
+    train_parser.add_argument('--head-units', type=int, nargs='+',
+                              help="units of the hidden Dense layers (defaults to each task's notebook head)")
+    train_parser.add_argument('--dropout', type=float, nargs='+',
+                              help='one dropout rate for every hidden layer or one rate per layer')
+    train_parser.add_argument('--epochs', type=int, default=50)
+    train_parser.add_argument('--learning-rate', type=float, default=0.001)
+    train_parser.add_argument('--fine-tune-epochs', type=int, default=0,
+                              help='epochs training the whole model; the back-end cannot fuse fine-tuned models')
+    train_parser.add_argument('--fine-tune-learning-rate', type=float, default=0.00005)
+    train_parser.add_argument('--batch-size', type=int, default=32)
+    train_parser.add_argument('--cache', default='memory',
+                              help="'memory' (about 300 KB per image), 'none' or a directory for on-disk caches "
+                                   'of the resized images')
+    train_parser.add_argument('--mixed-precision', action='store_true', help='train with the mixed_float16 policy')
+    train_parser.add_argument('--seed', type=int)
+    train_parser.set_defaults(run=train)
+
+    benchmark_parser = subparsers.add_parser('benchmark', help='images per second of the input pipelines')
+    benchmark_parser.add_argument('split_dir', help='directory with one subdirectory of images per class')
+    benchmark_parser.add_argument('--shards-dir', help='the same split written by the cache subcommand')
+    benchmark_parser.add_argument('--batch-size', type=int, default=32)
+    benchmark_parser.add_argument('--batches', type=int, default=50)
+    benchmark_parser.set_defaults(run=benchmark)
+
+    args = parser.parse_args()
+    if args.command == 'train':
+        for task in args.tasks:
+            if getattr(args, f'{task}_dir') is None:
+                parser.error(f'--{task}-dir is required to train the {task} model')
+        if args.cache not in ('memory', 'none'):
+            os.makedirs(args.cache, exist_ok=True)
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '3')
+    print(json.dumps(args.run(args), indent=2, default=float))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,377 @@
+"""
+Training code of the binary and multiclass lesion models, pulled out of the notebooks.
+
+Images are read with a 'tf.data' pipeline instead of 'ImageDataGenerator.flow_from_directory':
+JPEGs are decoded and resized in parallel, the resized images are cached once (in memory, in a
+cache file or as sharded TFRecords written by 'write_tfrecord_shards'), and the augmentation of
+the notebooks (rotation, zoom, shift, shear and flips) is applied to whole batches on the graph
+as one projective transform per image. Batches are prefetched so the model never waits for input.
+
+The models are the notebooks' transfer-learning models: a frozen ImageNet backbone followed by a
+Flatten/BatchNormalization/Dense classification head, fed with 320x320 images scaled to [0, 1],
+the same input 'transform_image_into_tensor' produces for the back-end. By default every task is
+built like its notebook: the binary model on Xception with a single Dense layer of 128 units, the
+multiclass model on InceptionV3 with Dense layers of 576 and 120 units (see 'TASKS').
+"""
+
+import pathlib
+import json
+import math
+import os
+import tensorflow as tf
+
+IMAGE_SIZE = (320, 320)
+INPUT_SHAPE = IMAGE_SIZE + (3,)
+SHARD_PATTERN = 'shard-*.tfrecord'
+METADATA_FILE = 'metadata.json'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+BACKBONES = {'xception': tf.keras.applications.Xception, 'inceptionv3': tf.keras.applications.InceptionV3,
+             'vgg19': tf.keras.applications.VGG19}
+TASKS = {'binary': {'number_of_classes': 2, 'one_hot': False, 'model_name': 'model_bin',
+                    'backbone': 'xception', 'head_units': (128,), 'dropout': (0.2,), 'hidden_batch_norm': True},
+         'multiclass': {'number_of_classes': 8, 'one_hot': True, 'model_name': 'model_mul',
+                        'backbone': 'inceptionv3', 'head_units': (576, 120), 'dropout': (0.05, 0.45),
+                        'hidden_batch_norm': False}}
+TFRECORD_FEATURES = {'image': tf.io.FixedLenFeature([], tf.string),
+                     'label': tf.io.FixedLenFeature([], tf.int64)}
+
+def list_image_files(directory):
+    """
+    List the images of a directory with one subdirectory per class, like 'flow_from_directory'.
+
+    Args:
+        directory (str): Directory with one subdirectory of images per class.
+
+    Returns:
+        tuple: The image paths, their class indices and the class names in alphabetical order.
+    """
+    class_names = sorted(path.name for path in pathlib.Path(directory).iterdir() if path.is_dir())
+    paths, labels = [], []
+    for label, class_name in enumerate(class_names):
+        for path in sorted((pathlib.Path(directory) / class_name).rglob('*')):
+            if path.suffix.lower() in IMAGE_EXTENSIONS:
+                paths.append(str(path))
+                labels.append(label)
+    return (paths, labels, class_names)
+
+def decode_and_resize(path, label):
+    """
+    Read, decode and resize an image file on the graph.
+
+    Args:
+        path (tf.Tensor): Path of the image file.
+        label (tf.Tensor): Class index of the image.
+
+    Returns:
+        tuple: The resized uint8 image of shape INPUT_SHAPE and its label.
+    """
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, IMAGE_SIZE, method='bilinear')
+    return (tf.cast(tf.clip_by_value(tf.round(image), 0, 255), tf.uint8), label)
+
+def write_tfrecord_shards(directory, output_directory, shard_size=1024):
+    """
+    Decode and resize the images of a class directory once and write them as sharded TFRecords.
+
+    Images are stored as raw resized uint8 tensors, so reading a shard needs no JPEG decoding and
+    introduces no additional compression loss. The class names and the number of images are
+    written next to the shards.
+
+    Args:
+        directory (str): Directory with one subdirectory of images per class.
+        output_directory (str): Directory the shards are written to.
+        shard_size (int): Number of images per shard.
+
+    Returns:
+        dict: Number of images, number of shards and the class names.
+    """
+    paths, labels, class_names = list_image_files(directory)
+    os.makedirs(output_directory, exist_ok=True)
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    dataset = dataset.map(decode_and_resize, num_parallel_calls=tf.data.AUTOTUNE)
+    dataset = dataset.map(lambda image, label: (tf.io.serialize_tensor(image), label),
+                          num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+    number_of_shards = max(1, math.ceil(len(paths) / shard_size))
+    writer = None
+    for index, (serialized_image, label) in enumerate(dataset.as_numpy_iterator()):
+        if index % shard_size == 0:
+            if writer is not None:
+                writer.close()
+            shard_path = os.path.join(output_directory, f'shard-{index // shard_size:05d}-of-{number_of_shards:05d}.tfrecord')
+            writer = tf.io.TFRecordWriter(shard_path)
+        example = tf.train.Example(features=tf.train.Features(feature={
+            'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[serialized_image])),
+            'label': tf.train.Feature(int64_list=tf.train.Int64List(value=[label]))}))
+        writer.write(example.SerializeToString())
+    if writer is not None:
+        writer.close()
+    with open(os.path.join(output_directory, METADATA_FILE), 'w') as metadata_file:
+        json.dump({'class_names': class_names, 'images': len(paths)}, metadata_file)
+    return {'images': len(paths), 'shards': number_of_shards, 'class_names': class_names}
+
+def parse_tfrecord(record):
+    """
+    Parse a record written by 'write_tfrecord_shards'.
+
+    Args:
+        record (tf.Tensor): A serialized 'tf.train.Example'.
+
+    Returns:
+        tuple: The uint8 image of shape INPUT_SHAPE and its label.
+    """
+    features = tf.io.parse_single_example(record, TFRECORD_FEATURES)
+    image = tf.ensure_shape(tf.io.parse_tensor(features['image'], out_type=tf.uint8), INPUT_SHAPE)
+    return (image, tf.cast(features['label'], tf.int32))
+
+def load_split(directory):
+    """
+    Create a dataset of resized uint8 images from a split directory.
+
+    The directory either holds TFRecord shards written by 'write_tfrecord_shards' or one
+    subdirectory of images per class, which are decoded in parallel.
+
+    Args:
+        directory (str): The split directory.
+
+    Returns:
+        tuple: The unbatched dataset of (image, label) pairs, its number of images and the class names.
+    """
+    shard_paths = sorted(str(path) for path in pathlib.Path(directory).glob(SHARD_PATTERN))
+    if shard_paths:
+        with open(os.path.join(directory, METADATA_FILE)) as metadata_file:
+            metadata = json.load(metadata_file)
+        class_names, number_of_images = metadata['class_names'], metadata['images']
+        dataset = tf.data.Dataset.from_tensor_slices(shard_paths)
+        dataset = dataset.interleave(tf.data.TFRecordDataset, cycle_length=min(len(shard_paths), 8),
+                                     num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+        dataset = dataset.map(parse_tfrecord, num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+        return (dataset, number_of_images, class_names)
+    paths, labels, class_names = list_image_files(directory)
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    dataset = dataset.map(decode_and_resize, num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+    return (dataset, len(paths), class_names)
+
+def get_augmentation_transforms(batch_size, rotation_range=90, zoom_range=0.1, shift_range=0.1, shear_range=10):
+    """
+    Draw one random projective transform per image, matching the notebooks' 'ImageDataGenerator' settings.
+
+    Every transform combines a rotation, shear, independent horizontal and vertical zoom, random
+    horizontal and vertical flips (all around the image center) and a shift into a single matrix.
+
+    Args:
+        batch_size (tf.Tensor): Number of images in the batch.
+        rotation_range (float): Maximum rotation in degrees.
+        zoom_range (float): Maximum relative zoom.
+        shift_range (float): Maximum shift as a fraction of the image size.
+        shear_range (float): Maximum shear angle in degrees.
+
+    Returns:
+        tf.Tensor: Transforms of shape (batch_size, 8), as expected by 'ImageProjectiveTransformV3'.
+    """
+    height, width = IMAGE_SIZE
+    ones = tf.ones([batch_size])
+    zeros = tf.zeros([batch_size])
+
+    def uniform(limit):
+        return tf.random.uniform([batch_size], -limit, limit)
+
+    def matrices(*rows):
+        return tf.reshape(tf.stack(rows, axis=1), [-1, 3, 3])
+
+    rotation = uniform(rotation_range) * math.pi / 180
+    shear = uniform(shear_range) * math.pi / 180
+    zoom_x, zoom_y = 1 + uniform(zoom_range), 1 + uniform(zoom_range)
+    flip_x = tf.where(tf.random.uniform([batch_size]) < 0.5, -ones, ones)
+    flip_y = tf.where(tf.random.uniform([batch_size]) < 0.5, -ones, ones)
+    center_x, center_y = (width - 1) / 2, (height - 1) / 2
+
+    shifting = matrices(ones, zeros, uniform(shift_range) * width, zeros, ones, uniform(shift_range) * height,
+                        zeros, zeros, ones)
+    to_center = matrices(ones, zeros, center_x * ones, zeros, ones, center_y * ones, zeros, zeros, ones)
+    flipping = matrices(flip_x, zeros, zeros, zeros, flip_y, zeros, zeros, zeros, ones)
+    rotating = matrices(tf.cos(rotation), -tf.sin(rotation), zeros, tf.sin(rotation), tf.cos(rotation), zeros,
+                        zeros, zeros, ones)
+    shearing = matrices(ones, -tf.sin(shear), zeros, zeros, tf.cos(shear), zeros, zeros, zeros, ones)
+    zooming = matrices(zoom_x, zeros, zeros, zeros, zoom_y, zeros, zeros, zeros, ones)
+    from_center = matrices(ones, zeros, -center_x * ones, zeros, ones, -center_y * ones, zeros, zeros, ones)
+    transforms = shifting @ to_center @ flipping @ rotating @ shearing @ zooming @ from_center
+    return tf.reshape(transforms, [-1, 9])[:, :8]
+
+def augment_batch(images):
+    """
+    Augment a batch of images on the graph with a single vectorized projective transform.
+
+    Pixels moved in from outside the image repeat the nearest edge pixel, like the default
+    'fill_mode' of 'ImageDataGenerator'.
+
+    Args:
+        images (tf.Tensor): A float32 batch of shape (n, *INPUT_SHAPE).
+
+    Returns:
+        tf.Tensor: The augmented batch.
+    """
+    return tf.raw_ops.ImageProjectiveTransformV3(images=images,
+                                                 transforms=get_augmentation_transforms(tf.shape(images)[0]),
+                                                 output_shape=tf.constant(IMAGE_SIZE, dtype=tf.int32),
+                                                 fill_value=0.0, interpolation='BILINEAR', fill_mode='NEAREST')
+
+def build_dataset(directory, task, batch_size=32, training=True, cache=None, shuffle_buffer=2048, seed=None):
+    """
+    Build the input pipeline of a split.
+
+    Args:
+        directory (str): Split directory, see 'load_split'.
+        task (str): 'binary' or 'multiclass'; multiclass labels are one-hot encoded.
+        batch_size (int): Number of images per batch.
+        training (bool): Whether to shuffle and augment the images.
+        cache (str or None): None to decode the images every epoch, '' to cache the resized images
+                             in memory or a file path to cache them on disk. TFRecord shards are
+                             already resized and rarely need a cache.
+        shuffle_buffer (int): Number of images the shuffle buffer holds.
+        seed (int or None): Seed of the shuffling.
+
+    Returns:
+        tuple: The batched dataset of (images scaled to [0, 1], labels), its number of images and
+               the class names.
+    """
+    dataset, number_of_images, class_names = load_split(directory)
+    if cache is not None:
+        dataset = dataset.cache(cache)
+    if training:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size, num_parallel_calls=tf.data.AUTOTUNE)
+
+    number_of_classes = TASKS[task]['number_of_classes']
+    one_hot = TASKS[task]['one_hot']
+
+    def prepare(images, labels):
+        images = tf.cast(images, tf.float32)
+        if training:
+            images = augment_batch(images)
+        labels = tf.one_hot(labels, number_of_classes) if one_hot else labels
+        return (images / 255.0, labels)
+
+    dataset = dataset.map(prepare, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+    options = tf.data.Options()
+    options.deterministic = not training
+    return (dataset.with_options(options), number_of_images, class_names)
+
+def build_model(task, backbone=None, head_units=None, dropout=None, weights='imagenet'):
+    """
+    Build the notebooks' transfer-learning model of a task.
+
+    The backbone is frozen. The head flattens and normalizes the backbone features, then runs
+    every hidden Dense layer followed by its Dropout (and, for the binary model, a
+    BatchNormalization layer, as in its notebook). The last layer always computes in float32,
+    so the softmax stays numerically stable when the mixed precision policy is enabled.
+
+    Args:
+        task (str): 'binary' or 'multiclass'.
+        backbone (str): 'xception', 'inceptionv3' or 'vgg19', the task's notebook backbone if omitted.
+        head_units (list): Number of units of every hidden Dense layer of the head, the task's
+                           notebook head if omitted.
+        dropout (float or list): Dropout rate after every hidden layer, or one rate per layer.
+        weights (str or None): Weights of the backbone, 'imagenet' or None for random weights.
+
+    Returns:
+        tf.keras.Sequential: The uncompiled model.
+    """
+    task_settings = TASKS[task]
+    head_units = head_units or task_settings['head_units']
+    dropout = task_settings['dropout'] if dropout is None else dropout
+    dropout_rates = [dropout] * len(head_units) if isinstance(dropout, (int, float)) else list(dropout)
+    if len(dropout_rates) == 1:
+        dropout_rates *= len(head_units)
+    if len(dropout_rates) != len(head_units):
+        raise ValueError(f'Expected one dropout rate or {len(head_units)}, got {len(dropout_rates)}')
+    base_model = BACKBONES[backbone or task_settings['backbone']](include_top=False, weights=weights,
+                                                                   input_shape=INPUT_SHAPE)
+    base_model.trainable = False
+    layers = [base_model, tf.keras.layers.Flatten(), tf.keras.layers.BatchNormalization()]
+    for units, rate in zip(head_units, dropout_rates):
+        layers.extend([tf.keras.layers.Dense(units, activation='relu'), tf.keras.layers.Dropout(rate)])
+        if task_settings['hidden_batch_norm']:
+            layers.append(tf.keras.layers.BatchNormalization())
+    layers.append(tf.keras.layers.Dense(task_settings['number_of_classes'], activation='softmax', dtype='float32'))
+    return tf.keras.Sequential(layers)
+
+def compile_model(model, task, learning_rate):
+    """
+    Compile a model with the notebooks' optimizer and loss.
+
+    Args:
+        model (tf.keras.Model): The model.
+        task (str): 'binary' (sparse labels) or 'multiclass' (one-hot labels).
+        learning_rate (float): Learning rate of the Adam optimizer.
+    """
+    loss = (tf.keras.losses.CategoricalCrossentropy() if TASKS[task]['one_hot']
+            else tf.keras.losses.SparseCategoricalCrossentropy())
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate), loss=loss, metrics=['accuracy'])
+
+def train_model(task, train_dataset, validation_dataset, epochs=50, learning_rate=0.001, fine_tune_epochs=0,
+                fine_tune_learning_rate=0.00005, backbone=None, head_units=None, dropout=None):
+    """
+    Train the model of a task: first the head on the frozen backbone, then optionally the whole model.
+
+    The back-end only fuses the two models into one network sharing a single backbone pass if
+    both keep the same frozen ImageNet backbone, so fine-tuning the backbone trades serving
+    throughput for accuracy. The notebooks' backbones differ between the tasks, so both models
+    have to be trained with the same 'backbone' to be fused.
+
+    Args:
+        task (str): 'binary' or 'multiclass'.
+        train_dataset (tf.data.Dataset): Batched training dataset from 'build_dataset'.
+        validation_dataset (tf.data.Dataset): Batched validation dataset from 'build_dataset'.
+        epochs (int): Maximum number of epochs training the head.
+        learning_rate (float): Learning rate while training the head.
+        fine_tune_epochs (int): Maximum number of epochs training the whole model (0 to skip).
+        fine_tune_learning_rate (float): Learning rate while fine-tuning.
+        backbone (str): Backbone of the model, see 'build_model'.
+        head_units (list): Units of the hidden Dense layers of the head, see 'build_model'.
+        dropout (float or list): Dropout rates of the head, see 'build_model'.
+
+    Returns:
+        tuple: The trained model and the training histories of both phases.
+    """
+    model = build_model(task, backbone=backbone, head_units=head_units, dropout=dropout)
+    compile_model(model, task, learning_rate)
+    callbacks = [tf.keras.callbacks.ReduceLROnPlateau(monitor='val_accuracy', patience=5, factor=0.5,
+                                                      min_lr=0.00001, verbose=1),
+                 tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=20, restore_best_weights=True)]
+    histories = [model.fit(train_dataset, epochs=epochs, validation_data=validation_dataset,
+                           callbacks=callbacks).history]
+    if fine_tune_epochs:
+        model.layers[0].trainable = True
+        compile_model(model, task, fine_tune_learning_rate)
+        histories.append(model.fit(train_dataset, epochs=fine_tune_epochs, validation_data=validation_dataset,
+                                   callbacks=callbacks).history)
+    return (model, histories)
+
+def export_model(model, task, output_directory, backbone=None, head_units=None, dropout=None):
+    """
+    Save a trained model as the float32 SavedModel loaded by the back-end.
+
+    A model trained under the mixed precision policy is rebuilt under the float32 policy and the
+    trained weights are copied into it, since float16 layers are slow on the CPUs serving it.
+
+    Args:
+        model (tf.keras.Model): The trained model.
+        task (str): 'binary' or 'multiclass'; selects the 'model_bin' or 'model_mul' directory.
+        output_directory (str): Directory the SavedModel directory is written to.
+        backbone (str): Backbone the model was built with.
+        head_units (list): Units of the hidden Dense layers the model was built with.
+        dropout (float or list): Dropout rates the model was built with.
+
+    Returns:
+        str: Path of the SavedModel.
+    """
+    if tf.keras.mixed_precision.global_policy().name != 'float32':
+        tf.keras.mixed_precision.set_global_policy('float32')
+        float_model = build_model(task, backbone=backbone, head_units=head_units, dropout=dropout, weights=None)
+        for layer, float_layer in zip(model.layers, float_model.layers):
+            float_layer.trainable = layer.trainable
+        float_model.set_weights(model.get_weights())
+        model = float_model
+    model_path = os.path.join(output_directory, TASKS[task]['model_name'])
+    model.save(model_path)
+    return model_path